@@ -0,0 +1,61 @@
+'''Checks that a large query streams through picli with a bounded number of values held in memory.
+
+Run from the repository root:
+
+    python benchmarks/bench_backpressure.py --tags 100 --days 3 --interval 10
+
+A recorded query runs against benchmarks/mock_server.py with the series cache off and is exported
+to a CSV file in a scratch directory, as export does. Values that arrive before the units ahead of
+them are held until it's their turn, and the engine stops sending more once a full round of batches
+(max_workers times batch_size pages) is waiting or in flight. The most values held at once is
+reported next to the values exported, and the exit status is 1 if it went past that bound. HOME is pointed at a scratch directory so the
+user's config, save file and caches aren't touched.
+'''
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from os import path
+import logging
+import os
+import sys
+
+REPOSITORY_ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+def main() -> int:
+    parser = ArgumentParser(description='Check that picli holds a bounded number of values while exporting a large query.')
+    parser.add_argument('--tags', type=int, default=100, help='tags in the query (default: 100)')
+    parser.add_argument('--days', type=int, default=3, help='days of values per tag (default: 3)')
+    parser.add_argument('--interval', type=float, default=10, help='seconds between each tag\'s events (default: 10)')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds the mock server adds to every request (default: 0)')
+    arguments = parser.parse_args()
+
+    with TemporaryDirectory() as home:
+        os.environ['HOME'] = home
+        sys.path.insert(0, REPOSITORY_ROOT)
+        import mock_server
+        import picli.log
+        import picli.pi
+        from picli import config, engine, export, pi
+        from picli.commands import parse
+        logging.getLogger('picli').setLevel('WARNING')
+        config.set_series_cache_size('0')
+
+        settings = mock_server.Settings(tags=arguments.tags, interval=arguments.interval, latency=arguments.latency / 1000)
+        server, url = mock_server.start(settings)
+        tags = ','.join(mock_server.tag_name(index) for index in range(arguments.tags))
+        parse(['url', url, 'server', 'mock', 'type', 'recorded', 'bound', 'inside', 'start', f'*-{arguments.days}d', 'end', '*', 'tags', 'set', tags])
+        started = perf_counter()
+        with export.open_writer(path.join(home, 'export.csv')) as writer:
+            pi.run_query(writer)
+        elapsed = perf_counter() - started
+        server.shutdown()
+
+    bound = config.max_workers * config.batch_size * config.page_size
+    print(f'{writer.rows:,} values exported in {elapsed:.2f}s, at most {engine.peak_held_values:,} held at once (bound {bound:,})')
+    if engine.peak_held_values > bound:
+        print('Held more than max_workers * batch_size * page_size values.', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
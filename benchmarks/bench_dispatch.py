@@ -0,0 +1,52 @@
+'''Measures how long picli takes to dispatch command chains, the per-line cost of headless scripts.
+
+Run from the repository root:
+
+    python benchmarks/bench_dispatch.py --chains 20000
+
+Chains are matched against the registered commands without running them ("match"), then parsed
+and run ("parse"), so the share of the time spent in dispatch itself can be seen. HOME is pointed
+at a scratch directory so the user's config and save file aren't touched.
+'''
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from os import path
+import logging
+import os
+import sys
+
+REPOSITORY_ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+CHAINS = [
+    'tags set a,b start *-2h end * bound inside',
+    'url https://localhost/piwebapi server piserver',
+    'type summary summary total,average interval 1h',
+    'config set page_size 1000 config set max_workers 4',
+]
+
+def main() -> int:
+    parser = ArgumentParser(description='Benchmark picli command dispatch.')
+    parser.add_argument('--chains', type=int, default=20000, help='chains per scenario (default: 20000)')
+    arguments = parser.parse_args()
+
+    with TemporaryDirectory() as home:
+        os.environ['HOME'] = home
+        sys.path.insert(0, REPOSITORY_ROOT)
+        import picli.log
+        import picli.pi
+        from picli.commands import _match, parse
+        logging.getLogger('picli').setLevel('WARNING')
+        chains = [chain.split(' ') for chain in CHAINS]
+        print(f'{"scenario":<10}{"per chain":>12}{"per word":>12}')
+        for name, function in [('match', _match), ('parse', parse)]:
+            started = perf_counter()
+            for index in range(arguments.chains):
+                function(chains[index % len(chains)])
+            elapsed = perf_counter() - started
+            words = sum(len(chains[index % len(chains)]) for index in range(arguments.chains))
+            print(f'{name:<10}{elapsed / arguments.chains * 1e6:>10.2f}us{elapsed / words * 1e6:>10.2f}us')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
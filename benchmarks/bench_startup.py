@@ -0,0 +1,81 @@
+'''Measures picli cold-start latency: the wall time of fresh processes that import picli and run a command.
+
+Run from the repository root:
+
+    python benchmarks/bench_startup.py --runs 30
+    python benchmarks/bench_startup.py --json startup.json --max-ms 150
+
+Each scenario is run in a new interpreter, with HOME pointed at a scratch directory so the user's
+config, save file and keyring aren't touched. The bare interpreter is measured too, so the
+overhead picli adds on top of Python itself can be tracked.
+'''
+from argparse import ArgumentParser
+from statistics import median, quantiles
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from os import path
+import json
+import os
+import subprocess
+import sys
+
+REPOSITORY_ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+SCENARIOS = {
+    'python': ['-c', 'pass'],
+    'import': ['-c', 'import picli.__main__'],
+    'help': ['-m', 'picli', '--no-query', '-q', '-c', 'help'],
+    'config show': ['-m', 'picli', '--no-query', '-q', '-c', 'config show'],
+    'set query': ['-m', 'picli', '--no-query', '-q', '-c', 'url https://localhost/piwebapi', '-c', 'tags set sinusoid'],
+}
+
+def main() -> int:
+    parser = ArgumentParser(description='Benchmark picli cold-start latency.')
+    parser.add_argument('--runs', type=int, default=20, help='runs per scenario (default: 20)')
+    parser.add_argument('--json', metavar='PATH', help='also write the results to this file')
+    parser.add_argument('--max-ms', type=float, help='exit with status 1 if the median overhead of any scenario exceeds this')
+    arguments = parser.parse_args()
+
+    with TemporaryDirectory() as home:
+        environment = dict(os.environ, HOME=home, PYTHONPATH=REPOSITORY_ROOT)
+        for name in ['PICLI_USERNAME', 'PICLI_PASSWORD', 'PICLI_STORE_CREDENTIALS', 'PICLI_DEBUG_MODE']:
+            environment.pop(name, None)
+        # The first run creates the config and save files, later runs read them like a normal start.
+        for scenario in SCENARIOS.values():
+            _run(scenario, environment)
+        results = {name: _time(scenario, environment, arguments.runs) for name, scenario in SCENARIOS.items()}
+
+    baseline = results['python']['median_ms']
+    print(f'{"scenario":<14}{"median":>10}{"p90":>10}{"min":>10}{"overhead":>10}')
+    for name, result in results.items():
+        result['overhead_ms'] = result['median_ms'] - baseline
+        print(f'{name:<14}{result["median_ms"]:>8.1f}ms{result["p90_ms"]:>8.1f}ms{result["min_ms"]:>8.1f}ms{result["overhead_ms"]:>8.1f}ms')
+
+    if arguments.json is not None:
+        with open(arguments.json, 'w') as file:
+            json.dump({'python': sys.version, 'runs': arguments.runs, 'scenarios': results}, file, indent=4)
+
+    if arguments.max_ms is not None:
+        slow = [name for name, result in results.items() if result['overhead_ms'] > arguments.max_ms]
+        if slow:
+            print(f'Over {arguments.max_ms}ms: {", ".join(slow)}', file=sys.stderr)
+            return 1
+    return 0
+
+def _time(scenario: list[str], environment: dict, runs: int) -> dict:
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        _run(scenario, environment)
+        times.append((perf_counter() - start) * 1000)
+    return {
+        'median_ms': median(times),
+        'p90_ms': quantiles(times, n=10)[-1] if len(times) > 1 else times[0],
+        'min_ms': min(times)
+    }
+
+def _run(scenario: list[str], environment: dict) -> None:
+    subprocess.run([sys.executable, *scenario], env=environment, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
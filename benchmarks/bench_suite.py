@@ -0,0 +1,249 @@
+'''Benchmarks the code paths picli depends on against a local mock PI Web API, for catching regressions.
+
+Run from the repository root:
+
+    python benchmarks/bench_suite.py --runs 10
+    python benchmarks/bench_suite.py --json before.json
+    python benchmarks/bench_suite.py --baseline before.json --max-regression 20
+
+Scenarios:
+
+    query    a recorded query end to end through the real command path, into a result store
+    decode   streaming a batch response through picli's JSON decoder
+    parse    dispatching command chains
+    render   drawing a full frame of the interactive screen with a page of results
+    startup  a fresh picli process running a command
+
+Each scenario reports its throughput, the median, p90 and p99 latency of a run and its peak memory.
+Peak memory is what Python allocates during one extra, traced run; for startup it's the child
+process's peak resident size, on Linux only. The mock server is benchmarks/mock_server.py, run in its own
+process on a free port so its work isn't counted as picli's. HOME is pointed at a scratch directory
+so the user's config, save file and caches aren't touched, and the series cache is turned off so
+queries always fetch.
+
+With --baseline, the medians are compared to an earlier --json file and the exit status is 1 if any
+scenario got slower by more than --max-regression percent.
+'''
+from argparse import ArgumentParser, Namespace
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+from typing import Callable, Optional
+from urllib.request import urlopen
+from os import path
+import io
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tracemalloc
+
+REPOSITORY_ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+def main() -> int:
+    parser = ArgumentParser(description='Benchmark picli against a local mock PI Web API.')
+    parser.add_argument('--runs', type=int, default=10, help='timed runs per scenario (default: 10)')
+    parser.add_argument('--scenarios', default='query,decode,parse,render,startup', help='comma separated scenarios to run (default: all)')
+    parser.add_argument('--tags', type=int, default=100, help='tags in the query (default: 100)')
+    parser.add_argument('--hours', type=int, default=24, help='hours of values per tag in the query (default: 24)')
+    parser.add_argument('--interval', type=float, default=60, help='seconds between each tag\'s events (default: 60)')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds the mock server adds to every request (default: 0)')
+    parser.add_argument('--json', metavar='PATH', help='also write the results to this file')
+    parser.add_argument('--baseline', metavar='PATH', help='compare to results written earlier with --json')
+    parser.add_argument('--max-regression', type=float, default=20, help='percent a median may get slower than the baseline (default: 20)')
+    arguments = parser.parse_args()
+
+    with TemporaryDirectory() as home:
+        os.environ['HOME'] = home
+        os.environ['COLUMNS'], os.environ['LINES'] = '160', '50'
+        for name in ['PICLI_USERNAME', 'PICLI_PASSWORD', 'PICLI_STORE_CREDENTIALS', 'PICLI_DEBUG_MODE']:
+            os.environ.pop(name, None)
+        sys.path.insert(0, REPOSITORY_ROOT)
+        import mock_server
+        from bench_dispatch import CHAINS
+        import picli.log
+        import picli.pi
+        from picli import config
+        logging.getLogger('picli').setLevel('WARNING')
+        config.set_series_cache_size('0')
+
+        settings = mock_server.Settings(tags=max(arguments.tags, 1), interval=arguments.interval, latency=arguments.latency / 1000)
+        server, url = _start_server(settings)
+        scenarios = {
+            'query': lambda: _query(arguments, url, [mock_server.tag_name(index) for index in range(arguments.tags)]),
+            'decode': lambda: _decode(arguments, mock_server, settings),
+            'parse': lambda: _parse(CHAINS),
+            'render': lambda: _render(arguments, url),
+            'startup': _startup
+        }
+        results = {}
+        for name in arguments.scenarios.split(','):
+            if name not in scenarios:
+                print(f'Unknown scenario {name}. Must be one of {", ".join(scenarios)}.', file=sys.stderr)
+                return 2
+            results[name] = _measure(scenarios[name](), arguments.runs)
+        server.terminate()
+        server.wait()
+
+    print(f'{"scenario":<10}{"throughput":>22}{"median":>11}{"p90":>11}{"p99":>11}{"peak":>10}')
+    for name, result in results.items():
+        throughput = f'{result["throughput"]:,.0f} {result["unit"]}/s'
+        print(f'{name:<10}{throughput:>22}{result["median_ms"]:>9.2f}ms{result["p90_ms"]:>9.2f}ms{result["p99_ms"]:>9.2f}ms{result["peak_mb"]:>8.1f}MB')
+
+    if arguments.json is not None:
+        with open(arguments.json, 'w') as file:
+            json.dump({'python': sys.version, 'runs': arguments.runs, 'scenarios': results}, file, indent=4)
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline, 'r') as file:
+            baseline = json.load(file)['scenarios']
+        slower = []
+        for name, result in results.items():
+            if name in baseline and baseline[name]['median_ms'] > 0:
+                change = (result['median_ms'] / baseline[name]['median_ms'] - 1) * 100
+                print(f'{name:<10}{change:>+8.1f}% against the baseline')
+                if change > arguments.max_regression:
+                    slower.append(name)
+        if slower:
+            print(f'Slower than the baseline by more than {arguments.max_regression}%: {", ".join(slower)}', file=sys.stderr)
+            return 1
+    return 0
+
+def _start_server(settings) -> tuple[subprocess.Popen, str]:
+    '''Starts the mock server on a free port and waits until it answers. Returns the process and the base URL.'''
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, path.join(REPOSITORY_ROOT, 'benchmarks', 'mock_server.py'), '--port', str(port), '--tags', str(settings.tags), '--interval', str(settings.interval), '--latency', str(settings.latency * 1000)],
+        stdout=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            urlopen(f'http://127.0.0.1:{port}/_stats').close()
+            return server, f'http://127.0.0.1:{port}/piwebapi'
+        except OSError:
+            sleep(0.05)
+    server.kill()
+    raise RuntimeError('The mock server didn\'t start.')
+
+@dataclass
+class _Scenario:
+    run: Callable[[], int] # Runs once and returns how many units it processed
+    unit: str
+    peak_mb: Optional[Callable[[], float]] = None # Measures peak memory, instead of tracing an extra run
+
+def _measure(scenario: _Scenario, runs: int) -> dict:
+    '''Times runs of a scenario, then measures its peak memory.'''
+    scenario.run() # Warms up connections, caches and imports, like a session that's already running.
+    times = []
+    units = 0
+    for _ in range(runs):
+        started = perf_counter()
+        units += scenario.run()
+        times.append(perf_counter() - started)
+    if scenario.peak_mb is not None:
+        peak_mb = scenario.peak_mb()
+    else:
+        tracemalloc.start()
+        scenario.run()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    times.sort()
+    return {
+        'unit': scenario.unit,
+        'throughput': units / sum(times) if sum(times) else 0,
+        'median_ms': _percentile(times, 50) * 1000,
+        'p90_ms': _percentile(times, 90) * 1000,
+        'p99_ms': _percentile(times, 99) * 1000,
+        'peak_mb': peak_mb
+    }
+
+def _percentile(times: list[float], percent: float) -> float:
+    # Nearest rank, so small numbers of runs report a time that was actually measured.
+    return times[max(0, min(len(times) - 1, round(percent / 100 * len(times) + 0.5) - 1))]
+
+def _query(arguments: Namespace, url: str, tags: list[str]) -> _Scenario:
+    from picli import pi, task
+    from picli.commands import parse
+    parse(['url', url, 'server', 'mock', 'type', 'recorded', 'bound', 'inside', 'start', f'*-{arguments.hours}h', 'end', '*', 'tags', 'set', ','.join(tags)])
+
+    def run() -> int:
+        pi.execute_query()
+        task.wait()
+        if task.progress.state != 'done':
+            raise RuntimeError(f'The query {task.progress.state}, see the mock server settings.')
+        return len(pi.active_results())
+    return _Scenario(run, 'values')
+
+def _decode(arguments: Namespace, mock_server, settings) -> _Scenario:
+    from picli import jsonstream
+    from picli.engine import _CHUNK_SIZE
+    # A batch response of a page of values for each of 100 tags, the shape picli reads the most of.
+    responses = {}
+    for index in range(100):
+        status, content = mock_server.handle(settings, f'/piwebapi/streams/P{index % settings.tags:05d}/recorded?startTime=*-{arguments.hours}h&endTime=*&maxCount=1000')
+        responses[f'{index}.0'] = {'Status': status, 'Headers': {}, 'Content': content}
+    body = json.dumps(responses).encode()
+    chunks = [body[start:start + _CHUNK_SIZE] for start in range(0, len(body), _CHUNK_SIZE)]
+
+    def run() -> int:
+        for _ in jsonstream.iter_object(chunks):
+            pass
+        return len(body)
+    return _Scenario(run, 'bytes')
+
+def _parse(chains: list[str]) -> _Scenario:
+    from picli.commands import parse
+    chains = [chain.split(' ') for chain in chains]
+
+    def run() -> int:
+        for _ in range(100):
+            for chain in chains:
+                parse(chain)
+        return 100 * len(chains)
+    return _Scenario(run, 'chains')
+
+def _render(arguments: Namespace, url: str) -> _Scenario:
+    from picli import pi, render, task, view
+    from picli.commands import parse
+    parse(['url', url, 'server', 'mock', 'type', 'recorded', 'start', '*-1h', 'end', '*', 'tags', 'set', 'TAG00000'])
+    pi.execute_query()
+    task.wait()
+    output = io.StringIO()
+
+    def run() -> int:
+        with redirect_stdout(output):
+            for page in range(20):
+                # A full frame each time, like the first one drawn or one after the terminal narrows.
+                render._previous_frame = None
+                view.offset = page * view.page_rows
+                render.render()
+        output.seek(0)
+        output.truncate()
+        return 20
+    return _Scenario(run, 'frames')
+
+def _startup() -> _Scenario:
+    environment = dict(os.environ, PYTHONPATH=REPOSITORY_ROOT)
+
+    arguments = ['--no-query', '-q', '-c', 'help']
+
+    def run() -> int:
+        subprocess.run([sys.executable, '-m', 'picli', *arguments], env=environment, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        return 1
+
+    def peak_mb() -> float:
+        # The child reports its own high water mark. Its rusage would also count the memory of this
+        # process, which it shares until it execs.
+        report = f'import runpy, sys; sys.argv = ["picli", *{arguments!r}]\ntry: runpy.run_module("picli", run_name="__main__")\nexcept SystemExit: pass\nprint(open("/proc/self/status").read(), file=sys.stderr)'
+        status = subprocess.run([sys.executable, '-c', report], env=environment, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True).stderr
+        high_water = [line.split()[1] for line in status.splitlines() if line.startswith('VmHWM:')]
+        return int(high_water[0]) / 1024 if high_water else 0.0
+    return _Scenario(run, 'starts', peak_mb if sys.platform == 'linux' else lambda: 0.0)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+'''A local stand-in for the PI Web API, serving synthetic data so picli can be measured without a PI server.
+
+Run from the repository root:
+
+    python benchmarks/mock_server.py --port 8765 --tags 1000 --interval 60 --latency 20
+
+then point picli at it with "url http://localhost:8765/piwebapi server mock". It serves /dataservers,
+/points/search, /dataservers/<id>/points, /batch and /streams/<id>/recorded, interpolated and summary.
+Every tag has an event every --interval seconds, so the size of a response follows from the time range.
+Values are a sine wave of the time, so the same request always returns the same values. --latency is
+added to every request, like a round trip to a remote server. --failure-rate answers that share of
+batch sub-requests with a 503, to exercise retries. Only what picli uses is implemented.
+'''
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlparse
+import gzip
+import json
+import math
+import random
+import re
+import sys
+
+SERVER_WEB_ID = 'F1DSMOCK'
+MAX_COUNT = 1000 # Default maxCount of recorded values, as on a real server
+MAX_VALUES = 150_000 # Most values one stream request returns
+
+_RELATIVE_TIME = re.compile(r'^\*\s*([+-])\s*(\d+(?:\.\d+)?)\s*([smhd])$')
+_DURATION = re.compile(r'^(\d+(?:\.\d+)?)\s*([smhd])$')
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+@dataclass
+class Settings:
+    tags: int = 1000 # Tags are named TAG00000, TAG00001 and so on
+    interval: float = 60.0 # Seconds between a tag's events
+    latency: float = 0.0 # Seconds added to every request
+    gzip: bool = True # Whether responses are gzipped for clients that accept it
+    failure_rate: float = 0.0 # Share of batch sub-requests answered with a 503
+    stats: dict = field(default_factory=lambda: {'requests': 0, 'sub_requests': 0, 'failed_sub_requests': 0, 'bytes_sent': 0})
+    lock: Lock = field(default_factory=Lock)
+
+    def count(self, **counts: int) -> None:
+        with self.lock:
+            for name, count in counts.items():
+                self.stats[name] += count
+
+def tag_name(index: int) -> str:
+    return f'TAG{index:05d}'
+
+def start(settings: Settings, port: int = 0) -> tuple[ThreadingHTTPServer, str]:
+    '''Serves in a background thread. Returns the server and the base URL to give picli. Port 0 picks a free port.'''
+    server = ThreadingHTTPServer(('127.0.0.1', port), _handler(settings))
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name='mock-pi-web-api', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/piwebapi'
+
+def handle(settings: Settings, url: str) -> tuple[int, dict]:
+    '''Answers a GET, as a status and JSON content. Also used for each sub-request of a batch.'''
+    parsed = urlparse(url)
+    parameters = {name: values[0] for name, values in parse_qs(parsed.query).items()}
+    resource = parsed.path.split('/piwebapi', 1)[-1].rstrip('/')
+    if resource == '/dataservers':
+        return 200, {'WebId': SERVER_WEB_ID, 'Name': parameters.get('name', 'mock')}
+    if resource == '/points/search':
+        match = re.search(r'(?:name|tag):"?([^"\s]+)"?', unquote(parameters.get('query', '')))
+        points = _points(settings, match.group(1) if match else '*', 0, MAX_COUNT)
+        return 200, _select({'Items': points}, parameters.get('selectedFields'))
+    if resource == f'/dataservers/{SERVER_WEB_ID}/points':
+        points = _points(settings, parameters.get('nameFilter', '*'), int(parameters.get('startIndex', 0)), int(parameters.get('maxCount', MAX_COUNT)))
+        return 200, _select({'Items': points}, parameters.get('selectedFields'))
+    match = re.match(r'^/streams/([^/]+)/(recorded|interpolated|summary)$', resource)
+    if match is None:
+        return 404, {'Errors': [f'Unknown resource {resource}.']}
+    web_id, kind = match.groups()
+    index = _tag_index(settings, web_id)
+    if index is None:
+        return 404, {'Errors': [f'Unknown Web ID {web_id}.']}
+    now = datetime.now(timezone.utc)
+    start_time = _parse_time(parameters.get('startTime', '*-1d'), now)
+    end_time = _parse_time(parameters.get('endTime', '*'), now)
+    if start_time is None or end_time is None:
+        return 400, {'Errors': ['Unrecognized time.']}
+    if kind == 'recorded':
+        values = _recorded(settings, index, start_time, end_time, int(parameters.get('maxCount', MAX_COUNT)))
+    elif kind == 'interpolated':
+        values = _interpolated(index, start_time, end_time, _parse_duration(parameters.get('interval', '1h')))
+    else:
+        values = _summary(settings, index, start_time, end_time, _parse_duration(parameters.get('summaryDuration', '')), parse_qs(parsed.query).get('summaryType', ['Total']))
+    return 200, _select({'Links': {}, 'Items': values}, parameters.get('selectedFields'))
+
+def _points(settings: Settings, name_filter: str, start_index: int, max_count: int) -> list[dict]:
+    # Name filters ignore case and support * and ? wildcards.
+    pattern = re.compile(re.escape(name_filter).replace(r'\*', '.*').replace(r'\?', '.'), re.IGNORECASE)
+    if '*' in name_filter or '?' in name_filter:
+        matches = [tag_name(index) for index in range(settings.tags) if pattern.fullmatch(tag_name(index))]
+    else:
+        index = _tag_index(settings, f'P{name_filter[3:]}')
+        matches = [tag_name(index)] if index is not None and tag_name(index) == name_filter.upper() else []
+    return [{'WebId': f'P{name[3:]}', 'Name': name, 'Descriptor': '', 'PointClass': 'classic', 'PointType': 'Float64', 'Future': False} for name in matches[start_index:start_index + max_count]]
+
+def _tag_index(settings: Settings, web_id: str) -> Optional[int]:
+    if not web_id.startswith('P') or not web_id[1:].isdigit():
+        return None
+    index = int(web_id[1:])
+    return index if index < settings.tags else None
+
+def _value(index: int, time: datetime) -> float:
+    seconds = (time - _EPOCH).total_seconds()
+    return round(50 + 50 * math.sin(seconds / 3600 + index), 6)
+
+def _event(index: int, time: datetime, value: Optional[float] = None) -> dict:
+    return {
+        'Timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ') if time.microsecond == 0 else time.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        'Value': _value(index, time) if value is None else value,
+        'UnitsAbbreviation': '',
+        'Good': True,
+        'Questionable': False,
+        'Substituted': False,
+        'Annotated': False
+    }
+
+def _recorded(settings: Settings, index: int, start_time: datetime, end_time: datetime, max_count: int) -> list[dict]:
+    interval = timedelta(seconds=settings.interval)
+    # Events fall on whole multiples of the interval since the epoch, both ends included.
+    time = _EPOCH + math.ceil((start_time - _EPOCH) / interval) * interval
+    values = []
+    while time <= end_time and len(values) < min(max_count, MAX_VALUES):
+        values.append(_event(index, time))
+        time += interval
+    return values
+
+def _interpolated(index: int, start_time: datetime, end_time: datetime, interval: Optional[timedelta]) -> list[dict]:
+    if interval is None:
+        return []
+    values = []
+    time = start_time
+    while time <= end_time and len(values) < MAX_VALUES:
+        values.append(_event(index, time))
+        time += interval
+    return values
+
+def _summary(settings: Settings, index: int, start_time: datetime, end_time: datetime, duration: Optional[timedelta], summary_types: list[str]) -> list[dict]:
+    # One value per summary type and duration. The average is of the events in each duration.
+    duration = duration or (end_time - start_time)
+    items = []
+    for summary_type in summary_types:
+        time = start_time
+        while time < end_time and len(items) < MAX_VALUES:
+            # Each duration includes its start but not its end, which starts the next one.
+            events = _recorded(settings, index, time, min(time + duration, end_time) - timedelta(microseconds=1), MAX_VALUES)
+            values = [event['Value'] for event in events] or [0.0]
+            value = {'Total': sum(values), 'Minimum': min(values), 'Maximum': max(values), 'Count': len(events)}.get(summary_type, sum(values) / len(values))
+            items.append({'Type': summary_type, 'Value': _event(index, time, value)})
+            time += duration
+    return items
+
+def _parse_time(text: str, now: datetime) -> Optional[datetime]:
+    text = text.strip()
+    if text in ['*', '']:
+        return now
+    match = _RELATIVE_TIME.match(text)
+    if match:
+        sign, amount, unit = match.groups()
+        offset = timedelta(seconds=float(amount) * _UNITS[unit])
+        return now + offset if sign == '+' else now - offset
+    try:
+        time = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return time.replace(tzinfo=timezone.utc) if time.tzinfo is None else time.astimezone(timezone.utc)
+
+def _parse_duration(text: str) -> Optional[timedelta]:
+    match = _DURATION.match(text.strip())
+    if match is None:
+        return None
+    return timedelta(seconds=float(match.group(1)) * _UNITS[match.group(2)]) or None
+
+def _select(content: dict, selected_fields: Optional[str]) -> dict:
+    '''Keeps only the selected fields, like selectedFields on a real server. Items.Value.Value style paths are supported.'''
+    if not selected_fields:
+        return content
+    paths = [selected_field.split('.') for selected_field in selected_fields.split(';') if selected_field]
+
+    def pick(value, paths: list[list[str]]):
+        if isinstance(value, list):
+            return [pick(item, paths) for item in value]
+        if not isinstance(value, dict) or any(not path for path in paths):
+            return value
+        picked = {}
+        for name in dict.fromkeys(path[0] for path in paths):
+            if name in value:
+                picked[name] = pick(value[name], [path[1:] for path in paths if path[0] == name])
+        return picked
+    return pick(content, paths)
+
+def _handler(settings: Settings) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *arguments) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path == '/_stats':
+                with settings.lock:
+                    stats = dict(settings.stats)
+                return self._send(200, stats)
+            settings.count(requests=1)
+            sleep(settings.latency)
+            self._send(*handle(settings, self.path))
+
+        def do_POST(self) -> None:
+            settings.count(requests=1)
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            sleep(settings.latency)
+            if not urlparse(self.path).path.rstrip('/').endswith('/batch'):
+                return self._send(404, {'Errors': [f'Unknown resource {self.path}.']})
+            try:
+                requests = json.loads(body)
+            except ValueError:
+                return self._send(400, {'Errors': ['Invalid JSON.']})
+            responses = {}
+            failed = 0
+            for key, request in requests.items():
+                if random.random() < settings.failure_rate:
+                    status, content = 503, {'Errors': ['Service unavailable.']}
+                    failed += 1
+                else:
+                    status, content = handle(settings, request.get('Resource', ''))
+                responses[key] = {'Status': status, 'Headers': {'Content-Type': 'application/json'}, 'Content': content}
+            settings.count(sub_requests=len(requests), failed_sub_requests=failed)
+            self._send(207, responses)
+
+        def _send(self, status: int, content: dict) -> None:
+            data = json.dumps(content, separators=(',', ':')).encode()
+            compressed = settings.gzip and 'gzip' in self.headers.get('Accept-Encoding', '')
+            if compressed:
+                data = gzip.compress(data, compresslevel=1)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            if compressed:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            settings.count(bytes_sent=len(data))
+    return Handler
+
+def main() -> int:
+    parser = ArgumentParser(description='Serve a mock PI Web API with synthetic data.')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on (default: 8765)')
+    parser.add_argument('--tags', type=int, default=1000, help='number of tags, named TAG00000 and up (default: 1000)')
+    parser.add_argument('--interval', type=float, default=60, help='seconds between each tag\'s events (default: 60)')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every request (default: 0)')
+    parser.add_argument('--no-gzip', action='store_true', help='never gzip responses')
+    parser.add_argument('--failure-rate', type=float, default=0, help='share of batch sub-requests answered with a 503 (default: 0)')
+    arguments = parser.parse_args()
+    settings = Settings(tags=arguments.tags, interval=arguments.interval, latency=arguments.latency / 1000, gzip=not arguments.no_gzip, failure_rate=arguments.failure_rate)
+    server, url = start(settings, arguments.port)
+    print(f'Serving {settings.tags} tags at {url}. Ctrl+C stops.')
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,26 +1,122 @@
-from time import sleep
+from argparse import ArgumentParser, Namespace
+from logging import Formatter, StreamHandler
+from typing import Optional
+import sys
 
-from picli.log import info
-from picli.commands import parse
-from picli.render import render
+from picli.log import info, logger
+from picli.commands import parse, complete
 from picli.ansi import ANSI_CLEAR, ANSI_CURSOR_HOME
-from picli import pi
-from picli.query import active_query
+from picli import config, query, pi, export, task
 
 def main() -> None:
+    arguments = _parse_arguments()
+    if arguments.command or arguments.script or not sys.stdin.isatty():
+        exit(_run_headless(arguments))
+    _run_interactive()
+
+def _parse_arguments() -> Namespace:
+    parser = ArgumentParser(prog='picli', description='Send ad-hoc requests to the PI Web API. Runs interactively unless given commands.')
+    parser.add_argument('script', nargs='?', help='file with one command chain per line, or - for stdin')
+    parser.add_argument('-c', '--command', action='append', default=[], help='command chain to run, can be given more than once')
+    parser.add_argument('--export', metavar='PATH', default='-', help='where to write the results, format chosen by extension (default: CSV to stdout)')
+    parser.add_argument('--no-query', action='store_true', help='only run the commands, don\'t run the query afterwards')
+    parser.add_argument('-q', '--quiet', action='store_true', help='don\'t log progress to stderr')
+    return parser.parse_args()
+
+def _run_headless(arguments: Namespace) -> int:
+    '''Runs the command chains, then exports the query, without rendering anything. Returns the exit status.'''
+    if not arguments.quiet:
+        handler = StreamHandler(sys.stderr)
+        handler.setFormatter(Formatter('%(levelname)s: %(message)s'))
+        logger.addHandler(handler)
+    status = 0
+    try:
+        for command_chain in _command_chains(arguments):
+            parse(command_chain.split(' '))
+            # Queries started by a chain finish before the next chain runs, so the commands run in order.
+            task.wait()
+            if task.progress is not None and task.progress.state == 'failed':
+                raise task.progress.error
+        if not arguments.no_query:
+            config.set_output_file_path(arguments.export)
+            failed_tags = export.export_results()
+            if failed_tags:
+                # The rest of the results are written, but the export isn't complete.
+                print(f'picli: Values missing for {", ".join(failed_tags)}.', file=sys.stderr)
+                status = 1
+    except KeyboardInterrupt:
+        status = 130
+    except Exception as e:
+        print(f'picli: {e}', file=sys.stderr)
+        status = 1
+    # Changes to the queries are saved once, after every command has run.
     try:
-        while True:
+        query.save()
+    except Exception as e:
+        print(f'picli: {e}', file=sys.stderr)
+        status = status or 1
+    return status
+
+def _command_chains(arguments: Namespace) -> list[str]:
+    lines = []
+    if arguments.script == '-' or (arguments.script is None and not arguments.command):
+        lines = sys.stdin.read().splitlines()
+    elif arguments.script is not None:
+        with open(arguments.script, 'r') as file:
+            lines = file.read().splitlines()
+    command_chains = [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+    return command_chains + arguments.command
+
+def _run_interactive() -> None:
+    from picli.render import render, watch_resize, watch_progress
+    watch_resize()
+    watch_progress()
+    _enable_completion()
+    while True:
+        try:
             render()
             command = input('Enter a command: ')
-            try:
-                parse(command.split(' '))
-            except Exception as e:
-                info(e)
-    except KeyboardInterrupt:
-        active_query._save()
-        print(ANSI_CLEAR, end='')
-        print(ANSI_CURSOR_HOME, end='')
-        exit(0)
+        except KeyboardInterrupt:
+            # Ctrl+C stops a running query first, and only quits when there's nothing to stop.
+            if task.running():
+                task.cancel()
+                continue
+            break
+        try:
+            parse(command.split(' '))
+        except KeyboardInterrupt:
+            info('Interrupted.')
+        except Exception as e:
+            info(e)
+        try:
+            # Only writes if the command changed a saved field.
+            query.save()
+        except Exception as e:
+            info(e)
+    print(ANSI_CLEAR, end='')
+    print(ANSI_CURSOR_HOME, end='')
+    try:
+        query.save()
+    except Exception as e:
+        print(e)
+    exit(0)
+
+def _enable_completion() -> None:
+    '''Completes commands and subcommands with tab at the prompt, where readline is available.'''
+    try:
+        import readline
+    except ImportError:
+        return
+    matches = []
+
+    def completer(text: str, state: int) -> Optional[str]:
+        if state == 0:
+            # Python's readline doesn't add a space after a completed word, so it's added here.
+            matches[:] = [f'{word} ' for word in complete(readline.get_line_buffer()[:readline.get_endidx()])]
+        return matches[state] if state < len(matches) else None
+    readline.set_completer_delims(' ')
+    readline.set_completer(completer)
+    readline.parse_and_bind('tab: complete')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,36 @@
+from ssl import SSLContext
+from typing import Optional
+
+from requests.adapters import HTTPAdapter
+
+class PooledAdapter(HTTPAdapter):
+    '''HTTPAdapter that keeps connections alive and reuses one preloaded TLS context for every connection.'''
+    def __init__(self, ssl_context: Optional[SSLContext] = None, **kwargs):
+        self._ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self._ssl_context is not None:
+            kwargs['ssl_context'] = self._ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        if self._ssl_context is not None:
+            kwargs['ssl_context'] = self._ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        if self._ssl_context is not None:
+            pool_kwargs.pop('ca_certs', None)
+            pool_kwargs.pop('ca_cert_dir', None)
+            pool_kwargs['ssl_context'] = self._ssl_context
+        return host_params, pool_kwargs
+
+    def cert_verify(self, conn, url, verify, cert):
+        if self._ssl_context is None:
+            return super().cert_verify(conn, url, verify, cert)
+        # The CA bundle is already loaded into the context, don't make urllib3 load it again per connection.
+        conn.cert_reqs = 'CERT_REQUIRED'
+        conn.ca_certs = None
+        conn.ca_cert_dir = None
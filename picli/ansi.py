@@ -21,6 +21,13 @@ ANSI_BG_RESET = '\033[49m'
 ANSI_CLEAR = '\033[2J'
 ANSI_CLEAR_LINE = '\033[2K'
 ANSI_CURSOR_HOME = '\033[H'
+ANSI_CLEAR_TO_END = '\033[J'
+ANSI_SAVE_CURSOR = '\0337'
+ANSI_RESTORE_CURSOR = '\0338'
 
 ANSI_UP = '\033[A'
-ANSI_DOWN = '\033[B'
\ No newline at end of file
+ANSI_DOWN = '\033[B'
+
+def ansi_cursor_position(line: int, column: int = 1) -> str:
+    '''Moves the cursor to a 1-based line and column.'''
+    return f'\033[{line};{column}H'
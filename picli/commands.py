@@ -1,91 +1,79 @@
 from typing import Callable, Optional
-from enum import Enum
 from inspect import signature
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from picli import config
 from picli.errors import PICLICommandError
 
 @dataclass
 class Command:
-    primary_command: str 
+    primary_command: str
     subcommands: list[str]
     callback: Callable
+    arity: int # Number of arguments the callback takes, worked out once at registration
 
-class ParsingPhase(Enum):
-    PRIMARY_COMMAND = 1
-    SUBCOMMAND = 2
-    ARGUMENT = 3
+@dataclass
+class _Node:
+    '''One word of a command chain. The commands that end here are keyed by how many arguments they take.'''
+    children: dict[str, '_Node'] = field(default_factory=dict)
+    commands: dict[int, Command] = field(default_factory=dict)
 
 _all_commands: list[Command] = []
-_command_execution_queue: list[tuple[Command, list[str]]] = []
-
-_parse_phase: ParsingPhase = ParsingPhase.PRIMARY_COMMAND
-_command_search_pool: list[Command] = []
-_working_primary_command: Optional[str] = None
-_working_subcommands: list[str] = []
-_working_arguments: list[str] = []
+# Every registered command chain, one word per level, so parsing a word is a single dictionary lookup.
+_root = _Node()
 
 def register_command(callback: Callable, command_chain: list[str]) -> None:
         primary_command = command_chain[0]
         subcommands = command_chain[1:]
-        _all_commands.append(Command(primary_command=primary_command, subcommands=subcommands, callback=callback))
-
-def _parse_primary_command(item: str) -> None:
-    global _parse_phase, _command_search_pool, _working_primary_command
-    _command_search_pool = list(filter(lambda command: command.primary_command == item, _command_search_pool))
-    if len(_command_search_pool) == 0:
-        raise PICLICommandError('Command not found.')
-    _working_primary_command = item
-    _parse_phase = ParsingPhase.SUBCOMMAND
-
-def _parse_subcommand(item: str) -> None:
-    global _parse_phase, _command_search_pool, _working_primary_command, _working_subcommands
-    subcommands = _working_subcommands + [item]
-    search_pool = list(filter(lambda command: command.subcommands[:len(subcommands)] == subcommands, _command_search_pool))
-    if len(search_pool) == 0:
-        _parse_phase = ParsingPhase.ARGUMENT
-        return
-    _working_subcommands = subcommands
-    _command_search_pool = search_pool
-
-def _check() -> None:
-    global _command_search_pool, _working_subcommands, _working_arguments
-    for command in _command_search_pool:
-        if command.primary_command == _working_primary_command and command.subcommands == _working_subcommands and len(signature(command.callback).parameters) == len(_working_arguments):
-            _command_execution_queue.append((command, _working_arguments))
-            _reset()
+        command = Command(primary_command=primary_command, subcommands=subcommands, callback=callback, arity=len(signature(callback).parameters))
+        _all_commands.append(command)
+        node = _root
+        for word in command_chain:
+            node = node.children.setdefault(word, _Node())
+        # The first command registered for a chain and arity wins
+        node.commands.setdefault(command.arity, command)
 
-def _parse_argument(item: str) -> None:
-    _working_arguments.append(item)
+def _match(command_chain: list[str]) -> tuple[list[tuple[Command, list[str]]], Optional[_Node], list[str]]:
+    '''Matches words to commands. Returns the complete commands, and the node and arguments of a command left unfinished.'''
+    matched = []
+    node = None
+    arguments = []
+    for item in command_chain:
+        if node is None:
+            node = _root.children.get(item)
+            if node is None:
+                raise PICLICommandError('Command not found.')
+        elif not arguments and item in node.children:
+            node = node.children[item]
+        else:
+            # Once a word isn't a subcommand, the rest up to the end of the command are its arguments.
+            arguments.append(item)
+        command = node.commands.get(len(arguments))
+        if command is not None:
+            matched.append((command, arguments))
+            node = None
+            arguments = []
+    return matched, node, arguments
 
 def parse(command_chain: list[str]) -> None:
-    _reset()
-    for item in command_chain:
-        if _parse_phase == ParsingPhase.PRIMARY_COMMAND:
-            _parse_primary_command(item)
-        elif _parse_phase == ParsingPhase.SUBCOMMAND:
-            _parse_subcommand(item)
-        if _parse_phase == ParsingPhase.ARGUMENT:
-            _parse_argument(item)
-        _check()
-    if _working_primary_command is not None or _working_subcommands != [] or _working_arguments != []:
+    '''Parses a chain of commands and runs them in order. Nothing runs unless the whole chain parses.'''
+    matched, node, _ = _match(command_chain)
+    if node is not None:
         raise PICLICommandError('Command not found')
-    _execute()
-
-def _reset() -> None:
-    global _parse_phase, _command_search_pool, _working_primary_command, _working_subcommands, _working_arguments
-    _parse_phase = ParsingPhase.PRIMARY_COMMAND
-    _command_search_pool = _all_commands
-    _working_primary_command = None
-    _working_subcommands = []
-    _working_arguments = []
-
-def _execute() -> None:
-    for command, arguments in _command_execution_queue:
+    for command, arguments in matched:
         command.callback(*arguments)
-    _command_execution_queue.clear()
+
+def complete(line: str) -> list[str]:
+    '''Returns the commands and subcommands that could finish the last word of a line, for tab completion.'''
+    *words, last_word = line.split(' ')
+    try:
+        _, node, arguments = _match(words)
+    except PICLICommandError:
+        return []
+    if arguments:
+        return []
+    return sorted([word for word in (node or _root).children if word and word.startswith(last_word)])
 
 def _list_commands() -> None:
     for command in _all_commands:
-        print(f'{command.primary_command} {command.subcommands}')
\ No newline at end of file
+        print(f'{command.primary_command} {command.subcommands}')
@@ -5,23 +5,126 @@ from os import path
 import os
 import json
 from inspect import isclass
+from copy import copy
+from logging import Formatter, getLogger
 
 from picli.errors import PICLIConfigError, PICLIInitError
 from picli.commands import register_command
+from picli.pitime import parse_duration
 
 class AuthMethod(Enum):
     BASIC = 'basic'
     NTLM = 'ntlm'
 
-auth_method: AuthMethod = AuthMethod.BASIC
-store_credentials: bool = False
-request_fields_to_save: list[str] = ['api_base_url', 'pi_server']
-output_file_path: Optional[str] = None
-tls_cert_path: Optional[str] = None
-debug_mode: bool = False
+class Compression(Enum):
+    GZIP = 'gzip' # Compressed responses, and compressed bodies on large requests
+    RESPONSES = 'responses' # Compressed responses only
+    NONE = 'none'
+
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 3
+VALUE_FIELDS = ['Timestamp', 'Value', 'Good', 'Questionable', 'Substituted', 'UnitsAbbreviation', 'Annotated']
+
+# Settings are read from the config file and environment the first time one of them is used,
+# so commands that never touch them don't pay for the file I/O.
+_DEFAULTS = {
+    'auth_method': AuthMethod.BASIC,
+    'store_credentials': False,
+    'request_fields_to_save': ['api_base_url', 'pi_server'],
+    'output_file_path': None,
+    'tls_cert_path': None,
+    'debug_mode': False,
+    'pool_connections': 10,
+    'pool_maxsize': 10,
+    'compression': Compression.GZIP,
+    'webid_cache_ttl': 86400,
+    'series_cache_size': 256,
+    'page_size': 1000,
+    'max_workers': 4,
+    'batch_size': 100,
+    'follow_interval': 5,
+    'max_retries': 2,
+    'retry_budget': 100,
+    'time_slice': '1d',
+    'log_file_path': None,
+    'trace_file_path': None,
+    'recorded_fields': ['Timestamp', 'Value', 'Good', 'Questionable', 'Substituted'],
+    'interpolated_fields': ['Timestamp', 'Value', 'Good', 'Questionable', 'Substituted'],
+    'summary_fields': ['Timestamp', 'Value', 'Good', 'Questionable', 'Substituted']
+}
+
+auth_method: AuthMethod
+store_credentials: bool
+request_fields_to_save: list[str]
+output_file_path: Optional[str]
+tls_cert_path: Optional[str]
+debug_mode: bool
+pool_connections: int
+pool_maxsize: int
+compression: Compression
+webid_cache_ttl: int
+series_cache_size: int # MB
+page_size: int
+max_workers: int
+batch_size: int
+follow_interval: int # Seconds
+max_retries: int
+retry_budget: int # Retries a whole query can make, across all of its sub-requests
+time_slice: Optional[str]
+log_file_path: Optional[str]
+trace_file_path: Optional[str]
+recorded_fields: Optional[list[str]] # None requests every field
+interpolated_fields: Optional[list[str]]
+summary_fields: Optional[list[str]]
+
+_loaded = False
+
+def __getattr__(name: str) -> Any:
+    if name in _DEFAULTS and not _loaded:
+        _load()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def _load() -> None:
+    '''Reads the config file and environment. Runs once, on first use of any setting.'''
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    # Settings assigned before the first load, like config.output_file_path = ..., take precedence over the files.
+    assigned = {name: globals()[name] for name in _DEFAULTS if name in globals()}
+    globals().update({name: copy(value) for name, value in _DEFAULTS.items()})
+    _populate_from_file()
+    _populate_from_env()
+    globals().update(assigned)
+    _apply_debug_mode()
+    try:
+        _apply_log_file_path()
+    except PICLIConfigError as e:
+        # Don't stop picli starting over a log file, it can be fixed with config set log_file_path.
+        getLogger('picli').warning(e)
+
+def _apply_debug_mode() -> None:
+    getLogger('picli').setLevel('DEBUG' if debug_mode else 'INFO')
+
+def _apply_log_file_path() -> None:
+    # Everything the picli logger emits is also appended to the file, rotated once it reaches 10 MB.
+    from logging.handlers import RotatingFileHandler
+    logger = getLogger('picli')
+    for handler in [handler for handler in logger.handlers if isinstance(handler, RotatingFileHandler)]:
+        logger.removeHandler(handler)
+        handler.close()
+    if log_file_path is None:
+        return
+    try:
+        handler = RotatingFileHandler(log_file_path, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUP_COUNT, encoding='utf-8')
+    except OSError:
+        raise PICLIConfigError(f'Could not open log file {log_file_path}.')
+    handler.setFormatter(Formatter('%(asctime)s %(levelname)s %(message)s'))
+    logger.addHandler(handler)
 
 def _populate_from_file() -> None:
-    global auth_method, store_credentials, request_fields_to_save, output_file_path, tls_cert_path, debug_mode
+    global auth_method, store_credentials, request_fields_to_save, output_file_path, tls_cert_path, debug_mode, pool_connections, pool_maxsize, compression, webid_cache_ttl, series_cache_size, page_size, max_workers, batch_size, follow_interval, max_retries, retry_budget, time_slice, log_file_path, trace_file_path, recorded_fields, interpolated_fields, summary_fields
     if platform.system() == 'Windows':
         config_path = path.join(path.expanduser('~'), 'AppData', 'Local', 'picli', 'config.json')
     elif platform.system() == 'Linux':
@@ -34,12 +137,29 @@ def _populate_from_file() -> None:
             os.makedirs(path.dirname(config_path), exist_ok=True)
             with open(config_path, 'w') as file:
                 file.write(json.dumps({
-                    'auth_method': auth_method,
+                    'auth_method': auth_method.value,
                     'store_credentials': store_credentials,
                     'request_fields_to_save': request_fields_to_save,
                     'output_file_path': output_file_path,
                     'tls_cert_path': tls_cert_path,
-                    'debug_mode': debug_mode
+                    'debug_mode': debug_mode,
+                    'pool_connections': pool_connections,
+                    'pool_maxsize': pool_maxsize,
+                    'compression': compression.value,
+                    'webid_cache_ttl': webid_cache_ttl,
+                    'series_cache_size': series_cache_size,
+                    'page_size': page_size,
+                    'max_workers': max_workers,
+                    'batch_size': batch_size,
+                    'follow_interval': follow_interval,
+                    'max_retries': max_retries,
+                    'retry_budget': retry_budget,
+                    'time_slice': time_slice,
+                    'log_file_path': log_file_path,
+                    'trace_file_path': trace_file_path,
+                    'recorded_fields': recorded_fields,
+                    'interpolated_fields': interpolated_fields,
+                    'summary_fields': summary_fields
                 }, default=str, indent=4))
         except FileNotFoundError:
             raise PICLIInitError(f'Could not create config file at {config_path}.')
@@ -52,9 +172,26 @@ def _populate_from_file() -> None:
         output_file_path = config_file_contents['output_file_path']
         tls_cert_path = config_file_contents['tls_cert_path']
         debug_mode = config_file_contents['debug_mode']
+        pool_connections = config_file_contents.get('pool_connections', pool_connections)
+        pool_maxsize = config_file_contents.get('pool_maxsize', pool_maxsize)
+        compression = Compression(config_file_contents.get('compression', compression.value))
+        webid_cache_ttl = config_file_contents.get('webid_cache_ttl', webid_cache_ttl)
+        series_cache_size = config_file_contents.get('series_cache_size', series_cache_size)
+        page_size = config_file_contents.get('page_size', page_size)
+        max_workers = config_file_contents.get('max_workers', max_workers)
+        batch_size = config_file_contents.get('batch_size', batch_size)
+        follow_interval = config_file_contents.get('follow_interval', follow_interval)
+        max_retries = config_file_contents.get('max_retries', max_retries)
+        retry_budget = config_file_contents.get('retry_budget', retry_budget)
+        time_slice = config_file_contents.get('time_slice', time_slice)
+        log_file_path = config_file_contents.get('log_file_path', log_file_path)
+        trace_file_path = config_file_contents.get('trace_file_path', trace_file_path)
+        recorded_fields = config_file_contents.get('recorded_fields', recorded_fields)
+        interpolated_fields = config_file_contents.get('interpolated_fields', interpolated_fields)
+        summary_fields = config_file_contents.get('summary_fields', summary_fields)
             
 def _populate_from_env() -> None:
-    global auth_method, store_credentials, request_fields_to_save, output_file_path, tls_cert_path, debug_mode
+    global auth_method, store_credentials, request_fields_to_save, output_file_path, tls_cert_path, debug_mode, pool_connections, pool_maxsize, compression, webid_cache_ttl, series_cache_size, page_size, max_workers, batch_size, follow_interval, max_retries, retry_budget, time_slice, log_file_path, trace_file_path, recorded_fields, interpolated_fields, summary_fields
     if 'PICLI_AUTH_METHOD' in os.environ:
         auth_method = AuthMethod(os.environ['PICLI_AUTH_METHOD'])
     if 'PICLI_STORE_CREDENTIALS' in os.environ:
@@ -67,9 +204,53 @@ def _populate_from_env() -> None:
         tls_cert_path = os.environ['PICLI_TLS_CERT_PATH']
     if 'PICLI_DEBUG_MODE' in os.environ:
         debug_mode = bool(os.environ['PICLI_DEBUG_MODE'])
+    if 'PICLI_POOL_CONNECTIONS' in os.environ:
+        pool_connections = int(os.environ['PICLI_POOL_CONNECTIONS'])
+    if 'PICLI_POOL_MAXSIZE' in os.environ:
+        pool_maxsize = int(os.environ['PICLI_POOL_MAXSIZE'])
+    if 'PICLI_COMPRESSION' in os.environ:
+        compression = Compression(os.environ['PICLI_COMPRESSION'])
+    if 'PICLI_WEBID_CACHE_TTL' in os.environ:
+        webid_cache_ttl = int(os.environ['PICLI_WEBID_CACHE_TTL'])
+    if 'PICLI_SERIES_CACHE_SIZE' in os.environ:
+        series_cache_size = int(os.environ['PICLI_SERIES_CACHE_SIZE'])
+    if 'PICLI_PAGE_SIZE' in os.environ:
+        page_size = int(os.environ['PICLI_PAGE_SIZE'])
+    if 'PICLI_MAX_WORKERS' in os.environ:
+        max_workers = int(os.environ['PICLI_MAX_WORKERS'])
+    if 'PICLI_BATCH_SIZE' in os.environ:
+        batch_size = int(os.environ['PICLI_BATCH_SIZE'])
+    if 'PICLI_FOLLOW_INTERVAL' in os.environ:
+        follow_interval = int(os.environ['PICLI_FOLLOW_INTERVAL'])
+    if 'PICLI_MAX_RETRIES' in os.environ:
+        max_retries = int(os.environ['PICLI_MAX_RETRIES'])
+    if 'PICLI_RETRY_BUDGET' in os.environ:
+        retry_budget = int(os.environ['PICLI_RETRY_BUDGET'])
+    if 'PICLI_TIME_SLICE' in os.environ:
+        time_slice = os.environ['PICLI_TIME_SLICE'] or None
+    if 'PICLI_LOG_FILE_PATH' in os.environ:
+        log_file_path = os.environ['PICLI_LOG_FILE_PATH'] or None
+    if 'PICLI_TRACE_FILE_PATH' in os.environ:
+        trace_file_path = os.environ['PICLI_TRACE_FILE_PATH'] or None
+    if 'PICLI_RECORDED_FIELDS' in os.environ:
+        recorded_fields = _parse_fields(os.environ['PICLI_RECORDED_FIELDS'])
+    if 'PICLI_INTERPOLATED_FIELDS' in os.environ:
+        interpolated_fields = _parse_fields(os.environ['PICLI_INTERPOLATED_FIELDS'])
+    if 'PICLI_SUMMARY_FIELDS' in os.environ:
+        summary_fields = _parse_fields(os.environ['PICLI_SUMMARY_FIELDS'])
+
+def get_data_path(file_name: str) -> str:
+    '''Returns the path of a file in the data directory, next to the save file.'''
+    if platform.system() == 'Windows':
+        return path.join(path.expanduser('~'), 'AppData', 'Local', 'picli', file_name)
+    elif platform.system() == 'Linux':
+        return path.join(path.expanduser('~'), '.local', 'share', 'picli', file_name)
+    else:
+        raise PICLIInitError('Unsupported operating system. Don\'t know where to store data files.')
 
 def set_auth_method(method: str) -> None:
     '''Sets the authentication method for the PI Web API.'''
+    _load()
     global auth_method
     try:
         auth_method = AuthMethod.from_string_insensitive(method)
@@ -79,6 +260,7 @@ register_command(set_auth_method, ['config', 'set', 'auth_method'])
 
 def set_store_credentials(value: str) -> None:
     '''Sets whether to store credentials for future use.'''
+    _load()
     global store_credentials
     if value.lower() not in ['true', 'false']:
         raise PICLIConfigError(f'Invalid value {value}. Must be either "true" or "false".')
@@ -87,6 +269,7 @@ register_command(set_store_credentials, ['config', 'set', 'store_credentials'])
 
 def set_request_fields_to_save(fields: str) -> None:
     '''Sets the fields to save between sessions.'''
+    _load()
     global request_fields_to_save
     if ';' in fields:
         fields = fields.split(';')
@@ -100,24 +283,185 @@ def set_request_fields_to_save(fields: str) -> None:
 register_command(set_request_fields_to_save, ['config', 'set', 'request_fields_to_save'])
 
 def set_output_file_path(path: str) -> None:
-    '''Sets the path to save output to.'''
+    '''Sets the path to save output to. Used by export.'''
+    _load()
     global output_file_path
     output_file_path = path
 register_command(set_output_file_path, ['config', 'set', 'output_file_path'])
 
 def set_tls_cert_path(path: str) -> None:
     '''Sets the path to the TLS certificate to use.'''
+    _load()
     global tls_cert_path
     tls_cert_path = path
 register_command(set_tls_cert_path, ['config', 'set', 'tls_cert_path'])
 
 def set_debug_mode(value: str) -> None:
     '''Sets whether to output debug information.'''
+    _load()
     global debug_mode
     if value.lower() not in ['true', 'false']:
         raise PICLIConfigError(f'Invalid value {value}. Must be either "true" or "false".')
-    debug_mode = bool(value)
+    debug_mode = value.lower() == 'true'
+    _apply_debug_mode()
 register_command(set_debug_mode, ['config', 'set', 'debug_mode'])
 
-_populate_from_file()
-_populate_from_env()
\ No newline at end of file
+def set_pool_connections(value: str) -> None:
+    '''Sets the number of hosts to keep pooled connections for.'''
+    _load()
+    global pool_connections
+    pool_connections = _parse_positive_int(value)
+register_command(set_pool_connections, ['config', 'set', 'pool_connections'])
+
+def set_pool_maxsize(value: str) -> None:
+    '''Sets the maximum number of kept-alive connections per host.'''
+    _load()
+    global pool_maxsize
+    pool_maxsize = _parse_positive_int(value)
+register_command(set_pool_maxsize, ['config', 'set', 'pool_maxsize'])
+
+def set_compression(value: str) -> None:
+    '''Sets what gets compressed: gzip for responses and large request bodies, responses for responses only, or none.'''
+    _load()
+    global compression
+    try:
+        compression = Compression.from_string_insensitive(value)
+    except ValueError:
+        raise PICLIConfigError(f'Invalid compression {value}. Must be one of {", ".join([option.value for option in Compression])}.')
+register_command(set_compression, ['config', 'set', 'compression'])
+
+def set_webid_cache_ttl(value: str) -> None:
+    '''Sets how many seconds cached Web IDs stay valid. 0 disables the cache.'''
+    _load()
+    global webid_cache_ttl
+    if not value.isdigit():
+        raise PICLIConfigError(f'Invalid value {value}. Must be a whole number of seconds.')
+    webid_cache_ttl = int(value)
+register_command(set_webid_cache_ttl, ['config', 'set', 'webid_cache_ttl'])
+
+def set_series_cache_size(value: str) -> None:
+    '''Sets how many MB of fetched values to keep for reuse. 0 disables the cache.'''
+    _load()
+    global series_cache_size
+    if not value.isdigit():
+        raise PICLIConfigError(f'Invalid value {value}. Must be a whole number of MB.')
+    series_cache_size = int(value)
+register_command(set_series_cache_size, ['config', 'set', 'series_cache_size'])
+
+def set_page_size(value: str) -> None:
+    '''Sets the maximum number of values requested per tag in each page.'''
+    _load()
+    global page_size
+    page_size = _parse_positive_int(value)
+register_command(set_page_size, ['config', 'set', 'page_size'])
+
+def set_max_workers(value: str) -> None:
+    '''Sets how many batch requests run concurrently. Keep pool_maxsize at least this high.'''
+    _load()
+    global max_workers
+    max_workers = _parse_positive_int(value)
+register_command(set_max_workers, ['config', 'set', 'max_workers'])
+
+def set_batch_size(value: str) -> None:
+    '''Sets the maximum number of sub-requests sent in each batch request.'''
+    _load()
+    global batch_size
+    batch_size = _parse_positive_int(value)
+register_command(set_batch_size, ['config', 'set', 'batch_size'])
+
+def set_follow_interval(value: str) -> None:
+    '''Sets how many seconds follow waits between polls for new values.'''
+    _load()
+    global follow_interval
+    follow_interval = _parse_positive_int(value)
+register_command(set_follow_interval, ['config', 'set', 'follow_interval'])
+
+def set_max_retries(value: str) -> None:
+    '''Sets how many times a failed sub-request is retried.'''
+    _load()
+    global max_retries
+    if not value.isdigit():
+        raise PICLIConfigError(f'Invalid value {value}. Must be a whole number.')
+    max_retries = int(value)
+register_command(set_max_retries, ['config', 'set', 'max_retries'])
+
+def set_retry_budget(value: str) -> None:
+    '''Sets how many retries a query can make in all, so a failing server isn't flooded with them. 0 disables retries.'''
+    _load()
+    global retry_budget
+    if not value.isdigit():
+        raise PICLIConfigError(f'Invalid value {value}. Must be a whole number.')
+    retry_budget = int(value)
+register_command(set_retry_budget, ['config', 'set', 'retry_budget'])
+
+def set_time_slice(value: str) -> None:
+    '''Sets the length of the time windows recorded queries are split into, e.g. 1d. "none" disables splitting.'''
+    _load()
+    global time_slice
+    if value.lower() == 'none':
+        time_slice = None
+    elif parse_duration(value) is None:
+        raise PICLIConfigError(f'Invalid value {value}. Must be a duration such as 12h or 1d, or "none".')
+    else:
+        time_slice = value
+register_command(set_time_slice, ['config', 'set', 'time_slice'])
+
+def set_log_file_path(value: str) -> None:
+    '''Sets a file to also write log messages to, rotated at 10 MB. "none" turns it off.'''
+    _load()
+    global log_file_path
+    log_file_path = None if value.lower() == 'none' else value
+    _apply_log_file_path()
+register_command(set_log_file_path, ['config', 'set', 'log_file_path'])
+
+def set_trace_file_path(value: str) -> None:
+    '''Sets a file to write each query's timing trace to, in Chrome trace format. "none" turns it off.'''
+    _load()
+    global trace_file_path
+    trace_file_path = None if value.lower() == 'none' else value
+register_command(set_trace_file_path, ['config', 'set', 'trace_file_path'])
+
+def set_recorded_fields(value: str) -> None:
+    '''Sets the value fields requested by recorded queries. Can be comma, semicolon, or pipe separated. "all" requests every field.'''
+    _load()
+    global recorded_fields
+    recorded_fields = _parse_fields(value)
+register_command(set_recorded_fields, ['config', 'set', 'recorded_fields'])
+
+def set_interpolated_fields(value: str) -> None:
+    '''Sets the value fields requested by interpolated queries. Can be comma, semicolon, or pipe separated. "all" requests every field.'''
+    _load()
+    global interpolated_fields
+    interpolated_fields = _parse_fields(value)
+register_command(set_interpolated_fields, ['config', 'set', 'interpolated_fields'])
+
+def set_summary_fields(value: str) -> None:
+    '''Sets the value fields requested by summary queries. Can be comma, semicolon, or pipe separated. "all" requests every field.'''
+    _load()
+    global summary_fields
+    summary_fields = _parse_fields(value)
+register_command(set_summary_fields, ['config', 'set', 'summary_fields'])
+
+def _parse_fields(value: str) -> Optional[list[str]]:
+    if value.lower() == 'all':
+        return None
+    for separator in [',', ';', '|']:
+        if separator in value:
+            fields = value.split(separator)
+            break
+    else:
+        fields = [value]
+    by_lower_name = {field.lower(): field for field in VALUE_FIELDS}
+    invalid = [field for field in fields if field.lower() not in by_lower_name]
+    if invalid:
+        raise PICLIConfigError(f'Invalid fields {", ".join(invalid)}. Must be some of {", ".join(VALUE_FIELDS)}, or "all".')
+    fields = [by_lower_name[field.lower()] for field in fields]
+    if 'Timestamp' not in fields:
+        # Paging and the results both go by timestamp.
+        raise PICLIConfigError('Fields must include Timestamp.')
+    return fields
+
+def _parse_positive_int(value: str) -> int:
+    if not value.isdigit() or int(value) < 1:
+        raise PICLIConfigError(f'Invalid value {value}. Must be a positive whole number.')
+    return int(value)
@@ -1,36 +1,57 @@
-from typing import Optional
+from typing import Optional, Any
 from getpass import getpass
-
-from keyring import get_password, set_password, delete_password
+import os
 
 from picli import config
 from picli.commands import register_command
 
-username: Optional[str] = ''
-password: Optional[str] = ''
+# Read on first use: keyring is slow to import and may have to unlock a backend.
+username: Optional[str]
+password: Optional[str]
+
+_loaded = False
 
-if config.store_credentials:
-    username = get_password('picli', 'username')
-    password = get_password('picli', 'password')
+def __getattr__(name: str) -> Any:
+    if name in ['username', 'password'] and not _loaded:
+        _load()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def _load() -> None:
+    global username, password, _loaded
+    _loaded = True
+    username = ''
+    password = ''
+    if config.store_credentials:
+        from keyring import get_password
+        username = get_password('picli', 'username')
+        password = get_password('picli', 'password')
+    if 'PICLI_USERNAME' in os.environ:
+        username = os.environ['PICLI_USERNAME']
+        password = os.environ.get('PICLI_PASSWORD', '')
 
 def login():
     '''Sets credentials to use for authentication.'''
-    global username, password
+    global username, password, _loaded
+    _loaded = True
     username = input('Username: ')
     password = getpass('Password: ')
 
     if config.store_credentials:
+        from keyring import set_password
         set_password('picli', 'username', username)
         set_password('picli', 'password', password)
 register_command(login, ['login'])
 
 def logout():
     '''Clears stored credentials.'''
-    global username, password
+    global username, password, _loaded
+    _loaded = True
     username = None
     password = None
 
     if config.store_credentials:
+        from keyring import delete_password
         delete_password('picli', 'username')
         delete_password('picli', 'password')
-register_command(logout, ['logout'])
\ No newline at end of file
+register_command(logout, ['logout'])
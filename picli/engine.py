@@ -0,0 +1,362 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import Counter
+from dataclasses import dataclass, replace
+from heapq import heappop, heappush
+from itertools import count
+from random import uniform
+from time import monotonic, perf_counter
+from typing import Callable, Iterator, Optional, TYPE_CHECKING
+
+from picli import config, jsonstream, pitime, task, trace
+from picli.errors import PICLICancelledError, PICLIWebAPIError
+from picli.log import debug, debug_enabled
+from picli.session import get_session, post_json, sent_bytes, wire_bytes
+
+if TYPE_CHECKING:
+    from requests import Response, Session
+
+_CHUNK_SIZE = 64 * 1024
+_CANCEL_POLL_INTERVAL = 0.2
+RETRY_BASE_DELAY = 0.5 # Seconds before the first retry of a sub-request, doubled for each retry after it
+RETRY_MAX_DELAY = 8.0
+
+# Most values held at once by the last run, waiting for the units before them. Kept for benchmarks.
+peak_held_values = 0
+
+@dataclass
+class WorkUnit:
+    '''A single sub-request: one tag over one time window, possibly continuing from a previous page.'''
+    root: int
+    tag: str
+    web_id: str
+    start_time: str
+    end_time: str
+    page: int = 0
+    attempts: int = 0
+    seen_at_start_time: int = 0
+    cached: bool = False # Values come from the series cache rather than a request
+    group: int = 0 # Which query the unit belongs to when several are fetched together
+
+@dataclass
+class FailedUnit:
+    unit: WorkUnit
+    status: Optional[int]
+    message: str
+
+class RetryBudget:
+    '''Retries left for a query, shared by all of its requests, so a failing server isn't flooded with them.'''
+    def __init__(self):
+        self.remaining = config.retry_budget
+
+    def spend(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+def retryable(status: Optional[int]) -> bool:
+    '''Whether a failed request may succeed if it's sent again: no response at all, a timeout, throttling or a server error.'''
+    return status is None or status in [408, 429] or status >= 500
+
+def backoff_delay(attempts: int) -> float:
+    '''Seconds to wait before retrying a request that has been retried attempts times already.'''
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempts)
+    # Jittered, so requests that failed together aren't all retried at the same moment.
+    return uniform(delay / 2, delay)
+
+def build_units(tag_web_ids: dict[str, str], start_time: str, end_time: str, timezone: str, sliced: bool = True) -> list[WorkUnit]:
+    '''Splits a query into one unit per tag and time window, in the order their values should be merged.'''
+    windows = None
+    if sliced and config.time_slice is not None:
+        windows = pitime.split_range(start_time, end_time, timezone, config.time_slice)
+    if windows is None:
+        windows = [(start_time, end_time)]
+    units = []
+    for tag, web_id in tag_web_ids.items():
+        for window_start, window_end in windows:
+            units.append(WorkUnit(root=len(units), tag=tag, web_id=web_id, start_time=window_start, end_time=window_end))
+    return units
+
+def run(
+    api_base_url: str,
+    units: list[WorkUnit],
+    build_resource: Callable[[WorkUnit], str],
+    handle_items: Callable[[WorkUnit, list[dict]], tuple[list[dict], Optional[WorkUnit]]],
+    on_values: Callable[[WorkUnit, list[dict]], None],
+    read_cached: Optional[Callable[[WorkUnit], list[dict]]] = None,
+    budget: Optional[RetryBudget] = None
+) -> list[FailedUnit]:
+    '''Fetches all units through concurrent /batch requests and passes their values to on_values in unit order.
+
+    handle_items turns the items of a sub-response into values and returns the unit for the next page, if any.
+    Failed units are retried on their own, after a growing delay, up to max_retries times each and while the
+    budget lasts. Units that still fail are returned, and the values of every other unit are passed on as usual.
+    Cached units aren't requested, read_cached supplies their values when it's their turn.
+    Pages waiting for their turn and pages in flight together stay within one full round of batches,
+    max_workers times batch_size, so memory doesn't grow with the query. Past that, only the unit that
+    releases next is sent.
+    Raises PICLIWebAPIError if PI Web API rejects a batch outright, e.g. for bad credentials.
+    '''
+    from requests.exceptions import RequestException
+    global peak_held_values
+    session = get_session()
+    budget = budget or RetryBudget()
+    release = _OrderedRelease(units, on_values, read_cached)
+    order = count()
+    # (root, order, unit) of units to send, earliest root first, so the values sent for are the ones released next
+    queue = [(unit.root, next(order), unit) for unit in units if not unit.cached]
+    # (when, order, unit) of units waiting to be retried, soonest first
+    delayed = []
+    in_flight = {}
+    in_flight_units = 0
+    failed = []
+    # Units still to finish per tag, for progress
+    remaining = Counter((unit.group, unit.tag) for _, _, unit in queue)
+    tags = {(unit.group, unit.tag) for unit in units}
+    task.add_tags(total=len(tags), done=len(tags) - len(remaining))
+    release.advance()
+    debug(f'Fetching {len(units)} units with {config.max_workers} workers, {config.batch_size} units per batch')
+    executor = ThreadPoolExecutor(max_workers=config.max_workers)
+    try:
+        while queue or in_flight or delayed:
+            task.check_cancelled()
+            while delayed and delayed[0][0] <= monotonic():
+                unit = heappop(delayed)[2]
+                heappush(queue, (unit.root, next(order), unit))
+            while queue and len(in_flight) < config.max_workers:
+                room = config.max_workers * config.batch_size - release.held_pages - in_flight_units
+                if room <= 0 and queue[0][0] != release.root:
+                    break # Everything left waits for the units ahead of it to be released
+                chunk = [heappop(queue)[2] for _ in range(min(config.batch_size, max(room, 1), len(queue)))]
+                in_flight[executor.submit(_post_batch, session, api_base_url, chunk, build_resource, handle_items)] = chunk
+                in_flight_units += len(chunk)
+            timeout = _CANCEL_POLL_INTERVAL
+            if delayed:
+                timeout = max(0, min(timeout, delayed[0][0] - monotonic()))
+            if not in_flight:
+                task.pause(timeout) # Only retries waiting out their delay are left
+                continue
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = in_flight.pop(future)
+                in_flight_units -= len(chunk)
+                try:
+                    outcomes = future.result()
+                    error = 'No response for this sub-request.'
+                except (RequestException, ValueError) as e:
+                    outcomes = {}
+                    error = str(e)
+                for unit in chunk:
+                    outcome = outcomes.get(_batch_key(unit), _Outcome(status=None, message=error))
+                    if outcome.values is not None:
+                        release.add(unit, outcome.values, finished=outcome.next_unit is None)
+                        task.add_pages(1)
+                        if outcome.next_unit is not None:
+                            heappush(queue, (unit.root, next(order), outcome.next_unit))
+                        else:
+                            _finish(remaining, unit)
+                    elif retryable(outcome.status) and unit.attempts < config.max_retries and budget.spend():
+                        delay = backoff_delay(unit.attempts)
+                        debug(f'Retrying {unit.tag} from {unit.start_time} to {unit.end_time} in {delay:.1f}s (status {outcome.status})')
+                        trace.add('data fetch', retries=1)
+                        heappush(delayed, (monotonic() + delay, next(order), replace(unit, attempts=unit.attempts + 1)))
+                    else:
+                        failed.append(FailedUnit(unit=unit, status=outcome.status, message=outcome.message))
+                        release.add(unit, [], finished=True)
+                        _finish(remaining, unit)
+    finally:
+        # On cancel, requests still in flight are abandoned rather than waited for.
+        executor.shutdown(wait=not task.cancelled(), cancel_futures=True)
+        peak_held_values = release.peak_held_values
+    return failed
+
+def _finish(remaining: Counter, unit: WorkUnit) -> None:
+    remaining[unit.group, unit.tag] -= 1
+    if remaining[unit.group, unit.tag] == 0:
+        task.add_tags(done=1)
+
+def next_page(unit: WorkUnit, items: list[dict]) -> tuple[list[dict], Optional[WorkUnit]]:
+    '''Drops events the previous page already returned and builds the unit for the next page if this one was full.'''
+    skip = 0
+    while skip < len(items) and skip < unit.seen_at_start_time and items[skip].get('Timestamp') == unit.start_time:
+        skip += 1
+    new_items = items[skip:]
+    if len(items) < config.page_size:
+        return new_items, None
+    if not new_items:
+        raise PICLIWebAPIError(f'More than {config.page_size} events share timestamp {unit.start_time}. Increase page_size to read past them.')
+    last_timestamp = new_items[-1].get('Timestamp')
+    seen = _count_trailing(new_items, last_timestamp)
+    if last_timestamp == unit.start_time:
+        seen += unit.seen_at_start_time
+    return new_items, replace(unit, start_time=last_timestamp, page=unit.page + 1, attempts=0, seen_at_start_time=seen)
+
+@dataclass
+class _Outcome:
+    status: Optional[int]
+    values: Optional[list[dict]] = None # None if the unit failed
+    next_unit: Optional[WorkUnit] = None
+    message: Optional[str] = None
+
+def _post_batch(
+    session: 'Session',
+    api_base_url: str,
+    units: list[WorkUnit],
+    build_resource: Callable[[WorkUnit], str],
+    handle_items: Callable[[WorkUnit, list[dict]], tuple[list[dict], Optional[WorkUnit]]]
+) -> dict[str, _Outcome]:
+    units_by_key = {}
+    body = {}
+    for unit in units:
+        units_by_key[_batch_key(unit)] = unit
+        body[_batch_key(unit)] = {
+            'Method': 'GET',
+            'Resource': build_resource(unit)
+        }
+    task.check_cancelled()
+    started = perf_counter()
+    # Without debug output the body is parsed as it streams in, one sub-response at a time.
+    response = post_json(session, f'{api_base_url}/batch', body, stream=not debug_enabled())
+    waited = perf_counter() - started
+    task.track(response)
+    chunks = _Chunks(response.iter_content(chunk_size=_CHUNK_SIZE))
+    try:
+        reading = perf_counter()
+        outcomes = _read_batch(response, chunks, units_by_key, handle_items)
+        # Time spent waiting on the next chunk is the network's, the rest of reading the body is picli's.
+        trace.record('network', started, bytes=chunks.bytes, wire_bytes=wire_bytes(response), sent_bytes=sent_bytes(response), requests=1, seconds=waited + chunks.waited)
+        trace.record('decode', reading, seconds=perf_counter() - reading - chunks.waited)
+        return outcomes
+    except Exception:
+        # Reads fail in all sorts of ways when cancel closes the response under them.
+        if task.cancelled():
+            raise PICLICancelledError('Query cancelled.')
+        raise
+    finally:
+        task.untrack(response)
+        response.close()
+
+def _read_batch(response: 'Response', chunks: '_Chunks', units_by_key: dict[str, WorkUnit], handle_items: Callable[[WorkUnit, list[dict]], tuple[list[dict], Optional[WorkUnit]]]) -> dict[str, _Outcome]:
+    debug(f'Request URL: {response.url}')
+    debug(f'Response Status Code: {response.status_code}')
+    if debug_enabled():
+        debug(f'Response Content: {response.text}')
+
+    if response.status_code != 207:
+        if not retryable(response.status_code):
+            raise PICLIWebAPIError(f'Batch request failed with status {response.status_code}.')
+        # Every unit of the batch failed with its status, and each one is retried on its own.
+        return {key: _Outcome(status=response.status_code, message=f'Batch request failed with status {response.status_code}.') for key in units_by_key}
+
+    outcomes = {}
+    for key, sub_response in jsonstream.iter_object(chunks):
+        unit = units_by_key.get(key)
+        if unit is None:
+            continue
+        status = sub_response.get('Status')
+        if status == 200:
+            try:
+                values, next_unit = handle_items(unit, sub_response.get('Content').get('Items'))
+            except PICLIWebAPIError as e:
+                # Only this unit fails, the other sub-responses of the batch are still good.
+                outcomes[key] = _Outcome(status=status, message=str(e))
+                continue
+            outcomes[key] = _Outcome(status=status, values=values, next_unit=next_unit)
+        else:
+            outcomes[key] = _Outcome(status=status, message=str(sub_response.get('Content')))
+    return outcomes
+
+class _Chunks:
+    '''Response body chunks, counting their bytes and the time spent waiting for each one.'''
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self.bytes = 0
+        self.waited = 0.0
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            started = perf_counter()
+            chunk = next(self._chunks, None)
+            self.waited += perf_counter() - started
+            if chunk is None:
+                return
+            self.bytes += len(chunk)
+            task.add_bytes(len(chunk))
+            yield chunk
+
+def _batch_key(unit: WorkUnit) -> str:
+    return f'{unit.root}.{unit.page}'
+
+def _count_trailing(items: list[dict], timestamp: str) -> int:
+    count = 0
+    for item in reversed(items):
+        if item.get('Timestamp') != timestamp:
+            break
+        count += 1
+    return count
+
+class _OrderedRelease:
+    '''Holds values that arrive out of order and releases them in unit, then page, order.'''
+    def __init__(self, units: list[WorkUnit], on_values: Callable[[WorkUnit, list[dict]], None], read_cached: Optional[Callable[[WorkUnit], list[dict]]] = None):
+        self._units = units
+        self._on_values = on_values
+        self._read_cached = read_cached
+        self._pages = [{} for _ in units]
+        self._last_pages: list[Optional[int]] = [None] * len(units)
+        self._root = 0
+        self._page = 0
+        self.held_pages = 0
+        self.held_values = 0
+        self.peak_held_values = 0
+        # Last released timestamp per tag and how many events had it. Adjacent windows both include
+        # the event at their shared boundary, so it's dropped from the start of the later window.
+        self._tails: dict[tuple[int, str], tuple[str, int]] = {}
+
+    @property
+    def root(self) -> int:
+        '''The root that's released next.'''
+        return self._root
+
+    def add(self, unit: WorkUnit, values: list[dict], finished: bool) -> None:
+        self._pages[unit.root][unit.page] = values
+        self.held_pages += 1
+        self.held_values += len(values)
+        if finished:
+            self._last_pages[unit.root] = unit.page
+        self.advance()
+        self.peak_held_values = max(self.peak_held_values, self.held_values)
+
+    def advance(self) -> None:
+        '''Releases every unit whose turn has come and whose values are here, reading cached ones as they're reached.'''
+        while self._root < len(self._units):
+            unit = self._units[self._root]
+            if unit.cached:
+                self._release(unit, self._read_cached(unit))
+                self._root += 1
+                continue
+            if self._page not in self._pages[self._root]:
+                break
+            values = self._pages[self._root].pop(self._page)
+            self.held_pages -= 1
+            self.held_values -= len(values)
+            self._release(unit, values)
+            if self._last_pages[self._root] == self._page:
+                self._root += 1
+                self._page = 0
+            else:
+                self._page += 1
+
+    def _release(self, unit: WorkUnit, values: list[dict]) -> None:
+        tail = self._tails.get((unit.group, unit.tag))
+        if tail is not None and self._page == 0:
+            skip = 0
+            while skip < len(values) and skip < tail[1] and values[skip].get('Timestamp') == tail[0]:
+                skip += 1
+            values = values[skip:]
+        if values:
+            last_timestamp = values[-1].get('Timestamp')
+            seen = _count_trailing(values, last_timestamp)
+            if tail is not None and tail[0] == last_timestamp:
+                seen += tail[1]
+            self._tails[unit.group, unit.tag] = (last_timestamp, seen)
+        self._on_values(unit, values)
@@ -20,4 +20,11 @@ class PICLIValidationError(Exception):
 
 class PICLIWebAPIError(Exception):
     def __init__(self, message):
-        super().__init__(message)
\ No newline at end of file
+        super().__init__(message)
+
+class PICLIStaleWebIdError(PICLIWebAPIError):
+    '''A Web ID, likely from the cache, that the PI Web API no longer recognizes.'''
+
+class PICLICancelledError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
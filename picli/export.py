@@ -0,0 +1,204 @@
+from os import path
+import sys
+import csv
+import json
+from contextlib import ExitStack
+from typing import Optional
+
+from picli import config, pi, query, task
+from picli.commands import register_command
+from picli.errors import PICLICommandError, PICLIConfigError, PICLIWebAPIError
+from picli.log import info
+from picli.query import QueryType
+from picli.results import parse_timestamp, plain_value
+
+_BUFFER_SIZE = 1024 * 1024
+_PARQUET_ROW_GROUP_SIZE = 100_000
+
+class ExportWriter:
+    '''Streams query values to a file as they arrive. Subclasses write a specific format.'''
+    def __init__(self, file_path: str, include_type: bool):
+        self.file_path = file_path
+        self.include_type = include_type
+        self.rows = 0
+
+    def __enter__(self) -> 'ExportWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @property
+    def columns(self) -> list[str]:
+        if self.include_type:
+            return ['Tag', 'Type', 'Timestamp', 'Value', 'Good', 'Questionable', 'Substituted']
+        return ['Tag', 'Timestamp', 'Value', 'Good', 'Questionable', 'Substituted']
+
+    def append(self, tag: str, values: list[dict]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def _open(self, newline: Optional[str] = None):
+        # '-' streams to stdout, which is left open for whatever runs next.
+        if self.file_path == '-':
+            return sys.stdout
+        return open(self.file_path, 'w', newline=newline, encoding='utf-8', buffering=_BUFFER_SIZE)
+
+    def _close(self, file) -> None:
+        if file is sys.stdout:
+            file.flush()
+        else:
+            file.close()
+
+class CsvWriter(ExportWriter):
+    def __init__(self, file_path: str, include_type: bool):
+        super().__init__(file_path, include_type)
+        self._file = self._open(newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.columns)
+
+    def append(self, tag: str, values: list[dict]) -> None:
+        if self.include_type:
+            self._writer.writerows([(tag, value.get('Type'), value.get('Timestamp'), plain_value(value.get('Value')), value.get('Good'), value.get('Questionable'), value.get('Substituted')) for value in values])
+        else:
+            self._writer.writerows([(tag, value.get('Timestamp'), plain_value(value.get('Value')), value.get('Good'), value.get('Questionable'), value.get('Substituted')) for value in values])
+        self.rows += len(values)
+
+    def close(self) -> None:
+        self._close(self._file)
+
+class JsonLinesWriter(ExportWriter):
+    def __init__(self, file_path: str, include_type: bool):
+        super().__init__(file_path, include_type)
+        self._file = self._open()
+
+    def append(self, tag: str, values: list[dict]) -> None:
+        lines = []
+        for value in values:
+            row = {'Tag': tag}
+            for column in self.columns[1:]:
+                row[column] = value.get(column)
+            # Digital states by name, the same as the other formats.
+            row['Value'] = plain_value(row['Value'])
+            lines.append(json.dumps(row))
+        if lines:
+            self._file.write('\n'.join(lines) + '\n')
+        self.rows += len(values)
+
+    def close(self) -> None:
+        self._close(self._file)
+
+class ParquetWriter(ExportWriter):
+    '''Writes Parquet row groups of a fixed size. Non-numeric values go to the ValueText column. Requires pyarrow.'''
+    def __init__(self, file_path: str, include_type: bool):
+        super().__init__(file_path, include_type)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise PICLIConfigError('Parquet export requires pyarrow. Install it with pip install picli[parquet].')
+        self._pyarrow = pyarrow
+        fields = [('Tag', pyarrow.string())]
+        if include_type:
+            fields.append(('Type', pyarrow.string()))
+        fields.extend([
+            ('Timestamp', pyarrow.timestamp('us', tz='UTC')),
+            ('Value', pyarrow.float64()),
+            ('ValueText', pyarrow.string()),
+            ('Good', pyarrow.bool_()),
+            ('Questionable', pyarrow.bool_()),
+            ('Substituted', pyarrow.bool_())
+        ])
+        self._schema = pyarrow.schema(fields)
+        self._writer = pyarrow.parquet.ParquetWriter(file_path, self._schema)
+        self._buffer = {name: [] for name in self._schema.names}
+
+    def append(self, tag: str, values: list[dict]) -> None:
+        for value in values:
+            self._buffer['Tag'].append(tag)
+            if self.include_type:
+                self._buffer['Type'].append(value.get('Type'))
+            self._buffer['Timestamp'].append(parse_timestamp(value.get('Timestamp'))[0])
+            data = value.get('Value')
+            if type(data) in (int, float):
+                self._buffer['Value'].append(float(data))
+                self._buffer['ValueText'].append(None)
+            else:
+                self._buffer['Value'].append(None)
+                self._buffer['ValueText'].append(None if data is None else str(plain_value(data)))
+            self._buffer['Good'].append(value.get('Good'))
+            self._buffer['Questionable'].append(value.get('Questionable'))
+            self._buffer['Substituted'].append(value.get('Substituted'))
+        self.rows += len(values)
+        if len(self._buffer['Tag']) >= _PARQUET_ROW_GROUP_SIZE:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._buffer['Tag']:
+            self._writer.write_table(self._pyarrow.Table.from_pydict(self._buffer, schema=self._schema))
+            self._buffer = {name: [] for name in self._schema.names}
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+_WRITERS = {
+    '.csv': CsvWriter,
+    '.jsonl': JsonLinesWriter,
+    '.ndjson': JsonLinesWriter,
+    '.parquet': ParquetWriter
+}
+
+def open_writer(file_path: str, include_type: bool = False) -> ExportWriter:
+    '''Opens a writer for the file, choosing the format from its extension. '-' writes CSV to stdout.'''
+    if file_path == '-':
+        return CsvWriter(file_path, include_type)
+    extension = path.splitext(file_path)[1].lower()
+    if extension not in _WRITERS:
+        raise PICLIConfigError(f'Unsupported export format {extension or "(none)"}. Must be one of {", ".join(_WRITERS)}.')
+    return _WRITERS[extension](file_path, include_type)
+
+def export_results() -> list[str]:
+    '''Runs the active query and streams the results to the output file. Format is chosen by extension: csv, jsonl or parquet.
+
+    Returns the tags with values missing from the export.
+    '''
+    if config.output_file_path is None:
+        raise PICLIConfigError('No output file path set. Set one with config set output_file_path.')
+    if task.running():
+        raise PICLICommandError('A query is still running. Wait for it or cancel it first.')
+    info(f'Exporting results to {config.output_file_path}.')
+    with open_writer(config.output_file_path, include_type=query.active_query.query_type == QueryType.SUMMARY) as writer:
+        failed_tags = pi.run_query(writer)
+    info(f'Exported {writer.rows} rows to {config.output_file_path}.')
+    return failed_tags
+register_command(export_results, ['export'])
+
+def export_queries(names: str) -> None:
+    '''Runs several queries together, "all" or names separated by commas, and exports each to its own file named after the output file.'''
+    if config.output_file_path is None:
+        raise PICLIConfigError('No output file path set. Set one with config set output_file_path.')
+    if config.output_file_path == '-':
+        raise PICLIConfigError('Several queries can\'t all be written to stdout. Set an output file path.')
+    if task.running():
+        raise PICLICommandError('A query is still running. Wait for it or cancel it first.')
+    queued_queries = query.get_queries(names)
+    file_paths = {queued_query.name: _query_file_path(config.output_file_path, queued_query.name) for queued_query in queued_queries}
+    info(f'Exporting results of {len(queued_queries)} queries to {", ".join(file_paths.values())}.')
+    with ExitStack() as stack:
+        writers = {queued_query.name: stack.enter_context(open_writer(file_paths[queued_query.name], include_type=queued_query.query_type == QueryType.SUMMARY)) for queued_query in queued_queries}
+        errors = pi.run_queries([(queued_query, writers[queued_query.name]) for queued_query in queued_queries])
+    for name, writer in writers.items():
+        if name not in errors:
+            info(f'Exported {writer.rows} rows to {file_paths[name]}.')
+    if errors:
+        raise PICLIWebAPIError(f'{len(errors)} of {len(queued_queries)} queries failed: {", ".join(errors)}.')
+# Not under export, which runs as soon as the word is read since it takes no arguments.
+register_command(export_queries, ['run', 'export'])
+
+def _query_file_path(file_path: str, name: str) -> str:
+    '''Returns the file a query's results are exported to when several are: the output file with the query name added.'''
+    root, extension = path.splitext(file_path)
+    return f'{root}_{name}{extension}'
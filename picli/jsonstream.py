@@ -0,0 +1,86 @@
+from codecs import getincrementaldecoder
+from json import JSONDecoder, JSONDecodeError
+from typing import Any, Iterable, Iterator
+import re
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = JSONDecoder()
+
+def iter_object(chunks: Iterable[bytes]) -> Iterator[tuple[str, Any]]:
+    '''Yields the key/value pairs of a top level JSON object as soon as each value has fully arrived.
+
+    Only the value being read is kept in memory, so a large batch response is never held as one
+    string or one object tree. Each value is still decoded by the C JSON decoder.
+    '''
+    reader = _ChunkReader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.expect('}')
+        return
+    while True:
+        key = reader.decode()
+        reader.expect(':')
+        yield key, reader.decode()
+        reader.consume()
+        if reader.peek() == '}':
+            reader.expect('}')
+            return
+        reader.expect(',')
+
+class _ChunkReader:
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._text_decoder = getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._position = 0
+        self._exhausted = False
+
+    def _read(self) -> bool:
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer += self._text_decoder.decode(chunk)
+                return True
+        if not self._exhausted:
+            self._buffer += self._text_decoder.decode(b'', final=True)
+            self._exhausted = True
+        return False
+
+    def _skip_whitespace(self) -> None:
+        while True:
+            self._position = _WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer) or not self._read():
+                return
+
+    def peek(self) -> str:
+        self._skip_whitespace()
+        if self._position >= len(self._buffer):
+            raise JSONDecodeError('Unexpected end of JSON input', self._buffer, self._position)
+        return self._buffer[self._position]
+
+    def expect(self, character: str) -> None:
+        if self.peek() != character:
+            raise JSONDecodeError(f'Expected {character!r}', self._buffer, self._position)
+        self._position += 1
+
+    def decode(self) -> Any:
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._position)
+                # A number at the very end of the buffer may still have digits on the way.
+                if end < len(self._buffer) or self._exhausted or self._buffer[end - 1] in '}]"el':
+                    self._position = end
+                    return value
+            except JSONDecodeError:
+                if self._exhausted:
+                    raise
+            # Wait until the pending text has doubled before decoding again, so a value
+            # spread over many chunks is re-decoded a logarithmic number of times.
+            target = 2 * (len(self._buffer) - self._position)
+            while len(self._buffer) - self._position < target and self._read():
+                pass
+
+    def consume(self) -> None:
+        '''Drops everything that has already been decoded.'''
+        self._buffer = self._buffer[self._position:]
+        self._position = 0
@@ -1,29 +1,60 @@
-from logging import Handler, getLogger
+from logging import Handler, LogRecord, getLogger, getLevelName, DEBUG, INFO, WARNING, ERROR
+from collections import deque
+from itertools import islice
 
 from picli import config
 from picli.commands import register_command, _all_commands
+from picli.errors import PICLICommandError
 
-log_buffer = []
+LOG_BUFFER_SIZE = 1000
+
+# Records are kept as they are and only formatted when they're shown, so debug output
+# that scrolls out of the buffer unseen is never formatted at all.
+log_buffer: deque[LogRecord] = deque(maxlen=LOG_BUFFER_SIZE)
 
 class BufferHandler(Handler):
     def emit(self, record):
-        log_buffer.append(self.format(record))
+        log_buffer.append(record)
+
+    def tail(self, count: int) -> list[str]:
+        '''Formats the newest records, newest first, without copying the rest of the buffer.'''
+        # Held while reading, since a background query may be logging at the same time.
+        with self.lock:
+            records = list(islice(reversed(log_buffer), max(count, 0)))
+        return [self.format(record) for record in records]
 
+_buffer_handler = BufferHandler()
 logger = getLogger('picli')
-logger.addHandler(BufferHandler())
-if config.debug_mode:
-    logger.setLevel('DEBUG')
-else:
-    logger.setLevel('INFO')
+logger.addHandler(_buffer_handler)
+logger.setLevel('INFO') # Raised to DEBUG once the config is loaded, if debug_mode is set
 
 info = logger.info
+warning = logger.warning
 debug = logger.debug
 
+def debug_enabled() -> bool:
+    '''Whether debug messages are logged. Check it before building expensive debug output.'''
+    return logger.isEnabledFor(DEBUG)
+
+def tail(count: int) -> list[str]:
+    '''Returns up to count of the newest log messages, newest first.'''
+    return _buffer_handler.tail(count)
+
 def flush() -> None:
     '''Clears logs.'''
-    log_buffer.clear()
+    with _buffer_handler.lock:
+        log_buffer.clear()
 register_command(flush, ['logs', 'clear'])
 
+def set_log_level(level: str) -> None:
+    '''Sets the lowest level of message shown in the log: debug, info, warning or error. Debug messages also need debug_mode.'''
+    levels = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+    if level.lower() not in levels:
+        raise PICLICommandError(f'Invalid log level {level}. Must be one of {", ".join(levels)}.')
+    _buffer_handler.setLevel(levels[level.lower()])
+    info(f'Showing {getLevelName(levels[level.lower()]).lower()} messages and above.')
+register_command(set_log_level, ['logs', 'level'])
+
 def log_config() -> None: # Putting this here to avoid a circular import ven though it's not that intuitive
     '''Logs the current configuration.'''
     info('Current configuration:')
@@ -33,6 +64,23 @@ def log_config() -> None: # Putting this here to avoid a circular import ven tho
     info(f'output_file_path: {config.output_file_path}')
     info(f'tls_cert_path: {config.tls_cert_path}')
     info(f'debug_mode: {config.debug_mode}')
+    info(f'pool_connections: {config.pool_connections}')
+    info(f'pool_maxsize: {config.pool_maxsize}')
+    info(f'compression: {config.compression.value}')
+    info(f'webid_cache_ttl: {config.webid_cache_ttl}')
+    info(f'series_cache_size: {config.series_cache_size}')
+    info(f'page_size: {config.page_size}')
+    info(f'max_workers: {config.max_workers}')
+    info(f'batch_size: {config.batch_size}')
+    info(f'follow_interval: {config.follow_interval}')
+    info(f'max_retries: {config.max_retries}')
+    info(f'retry_budget: {config.retry_budget}')
+    info(f'time_slice: {config.time_slice}')
+    info(f'log_file_path: {config.log_file_path}')
+    info(f'trace_file_path: {config.trace_file_path}')
+    info(f'recorded_fields: {config.recorded_fields or "all"}')
+    info(f'interpolated_fields: {config.interpolated_fields or "all"}')
+    info(f'summary_fields: {config.summary_fields or "all"}')
 register_command(log_config, ['config', 'show'])
 
 def list_commands() -> None: # Same as above
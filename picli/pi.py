@@ -1,40 +1,241 @@
-from requests import get, post
-from requests.auth import HTTPBasicAuth
-from requests.exceptions import SSLError
+from copy import deepcopy
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from time import perf_counter
+from typing import Callable, Optional
+from urllib.parse import quote
 
-from picli.config import tls_cert_path, auth_method, AuthMethod
-from picli.credentials import username, password
+from picli import config, engine, pitime, query, series_cache, tag_resolver, task, trace, view, webid_cache
 from picli.commands import register_command
-from picli.errors import PICLIValidationError, PICLIWebAPIError
-from picli.log import info, debug
-from picli.query import active_query, Query
+from picli.errors import PICLICancelledError, PICLIStaleWebIdError, PICLIValidationError, PICLIWebAPIError
+from picli.log import info, debug, debug_enabled, warning
+from picli.query import BoundaryType, Query, QueryType
+from picli.results import ResultStore, ValueSink, parse_timestamp
+from picli.session import get_session, wire_bytes
 
-results = []
+# The last results of each query, by query name. The results of the active query are the ones shown.
+results_by_query: dict[str, ResultStore] = {}
 
-def execute_query() -> list[dict]:
+def active_results() -> ResultStore:
+    '''Returns the last results of the active query, empty if it hasn't been run.'''
+    return results_by_query.get(query.get_active_query().name) or ResultStore()
+
+def execute_query() -> None:
     '''Executes a query against the PI Web API.'''
-    global results
-    info('Executing query')
-    server_web_id = _get_server_web_id()
-    tag_web_ids = _get_tag_web_ids(server_web_id)
-    results = _get_recorded_values(tag_web_ids)
-    info('Query executed successfully.')
+    # The query runs in the background on a copy, so the prompt stays usable and edits don't affect it.
+    active_query = deepcopy(query.active_query)
+
+    def run() -> None:
+        store = ResultStore()
+        run_query(store, active_query)
+        results_by_query[active_query.name] = store
+        view.reset()
+    task.start('Query', run)
 register_command(execute_query, [''])
 
-def _get_server_web_id() -> str:
+def execute_queries(names: str) -> None:
+    '''Runs several queries together, "all" or names separated by commas, sharing batches. Each keeps its own results.'''
+    queued_queries = deepcopy(query.get_queries(names))
+
+    def run() -> None:
+        stores = {queued_query.name: ResultStore() for queued_query in queued_queries}
+        errors = run_queries([(queued_query, stores[queued_query.name]) for queued_query in queued_queries])
+        # Queries that failed keep their previous results.
+        for name, store in stores.items():
+            if name not in errors:
+                results_by_query[name] = store
+        view.reset()
+        if errors:
+            raise PICLIWebAPIError(f'{len(errors)} of {len(stores)} queries failed: {", ".join(errors)}.')
+    task.start('Queries', run)
+register_command(execute_queries, ['run'])
+
+def follow() -> None:
+    '''Runs the active recorded query, then keeps polling for newer values and adds them to the results. cancel stops it.'''
+    active_query = deepcopy(query.active_query)
+    if active_query.query_type != QueryType.RECORDED:
+        raise PICLIValidationError('Only recorded queries can be followed.')
+    # Polls start at the last value of each tag, so other boundary types would add an extra value every time.
+    poll_query = deepcopy(active_query)
+    poll_query.boundary_type = BoundaryType.INSIDE
+
+    def run() -> None:
+        store = ResultStore()
+        tails = _Tails(store)
+        loaded_at = pitime.format_time(datetime.now(timezone.utc))
+        run_query(tails, active_query)
+        results_by_query[active_query.name] = store
+        view.reset()
+        tag_web_ids = _get_tag_web_ids(active_query, _get_server_web_id(active_query))
+        info(f'Following {len(tag_web_ids)} tags, polling every {config.follow_interval}s.')
+        try:
+            while True:
+                task.pause(config.follow_interval)
+                _poll(poll_query, tag_web_ids, tails, store, loaded_at)
+        except PICLICancelledError:
+            raise PICLICancelledError('Stopped following.')
+    task.start('Follow', run)
+register_command(follow, ['follow'])
+
+class _Tails:
+    '''Passes values on to a sink, keeping the last timestamp of each tag and how many values had it.'''
+    def __init__(self, sink: ValueSink):
+        self.sink = sink
+        self.tails: dict[str, tuple[str, int]] = {}
+
+    def append(self, tag: str, values: list[dict]) -> None:
+        self.sink.append(tag, values)
+        if not values:
+            return
+        last_timestamp = values[-1].get('Timestamp')
+        seen = 0
+        for value in reversed(values):
+            if value.get('Timestamp') != last_timestamp:
+                break
+            seen += 1
+        tail = self.tails.get(tag)
+        if tail is not None and tail[0] == last_timestamp:
+            seen += tail[1]
+        self.tails[tag] = (last_timestamp, seen)
+
+def _poll(active_query: Query, tag_web_ids: dict[str, str], tails: _Tails, store: ResultStore, since: str) -> None:
+    # Each tag is read from its last timestamp on, skipping the values already seen there. Tags with no
+    # values yet are read from when the query was first run.
+    units = []
+    for tag, web_id in tag_web_ids.items():
+        start_time, seen = tails.tails.get(tag, (since, 0))
+        units.append(engine.WorkUnit(root=len(units), tag=tag, web_id=web_id, start_time=start_time, end_time='*', seen_at_start_time=seen))
+    rows = len(store)
+    at_end = view.offset + view.page_rows >= view.total_rows
+    task.new_round()
+    failed = engine.run(active_query.api_base_url, units, partial(_recorded_resource, active_query), engine.next_page, lambda unit, values: tails.append(unit.tag, values))
+    if failed:
+        info(f'Could not get new values for {len(failed)} tags, trying again next poll.')
+    if len(store) > rows:
+        debug(f'Added {len(store) - rows} new values')
+        if at_end:
+            # Stay on the last page as it grows, like tail -f.
+            view.offset = len(store)
+
+def run_query(sink: ValueSink, active_query: Optional[Query] = None) -> list[str]:
+    '''Runs a query, the active one by default, passing values to the sink in tag and time order as they arrive.
+
+    Returns the tags with values missing from the results, those that couldn't be found or fetched in full.
+    '''
+    if active_query is None:
+        active_query = query.active_query
+    info('Executing query')
+    query_trace = trace.start()
+    budget = engine.RetryBudget()
+    try:
+        server_web_id = _get_server_web_id(active_query)
+        task.check_cancelled()
+        tag_web_ids = _get_tag_web_ids(active_query, server_web_id, budget=budget)
+        task.check_cancelled()
+        failed_tags = [tag for tag in active_query.tags if not tag_resolver.is_pattern(tag) and tag not in tag_web_ids]
+        failed_tags += _get_values(active_query, server_web_id, tag_web_ids, sink, budget=budget)
+        webid_cache.save()
+    finally:
+        query_trace.finished_at = perf_counter()
+        if config.trace_file_path is not None:
+            query_trace.save(config.trace_file_path)
+    if failed_tags:
+        info(f'Query executed with values missing for {len(failed_tags)} tags.')
+    else:
+        info('Query executed successfully.')
+    return failed_tags
+
+def run_queries(jobs: list[tuple[Query, ValueSink]]) -> dict[str, Exception]:
+    '''Runs queries together, passing each one's values to its own sink. Returns the error of each query that failed.
+
+    Tags of queries on the same server are looked up together, and the units of every query on the same
+    PI Web API go through one engine run, so they share batches and workers instead of running one by one.
+    A query with values missing for some of its tags still counts as executed.
+    '''
+    from requests.exceptions import RequestException
+    info(f'Executing {len(jobs)} queries')
+    query_trace = trace.start()
+    budget = engine.RetryBudget()
+    errors = {}
+    try:
+        _resolve_together([job_query for job_query, _ in jobs], budget)
+        # (query, sink, server Web ID, fetch) of each query that got as far as fetching values
+        planned = []
+        for job_query, sink in jobs:
+            task.check_cancelled()
+            try:
+                server_web_id = _get_server_web_id(job_query)
+                tag_web_ids = _get_tag_web_ids(job_query, server_web_id, budget=budget)
+            except (RequestException, PICLIWebAPIError, PICLIValidationError) as e:
+                errors[job_query.name] = e
+                continue
+            info(f'Getting {job_query.query_type.value.lower()} values for {len(tag_web_ids)} tags of query {job_query.name} from PI Web API.')
+            planned.append((job_query, sink, server_web_id, _plan_values(job_query, tag_web_ids, sink)))
+
+        for api_base_url in dict.fromkeys(job_query.api_base_url for job_query, _, _, _ in planned):
+            group = [job for job in planned if job[0].api_base_url == api_base_url]
+            fetch = _combine([job_fetch for _, _, _, job_fetch in group])
+            started = perf_counter()
+            try:
+                failed = engine.run(api_base_url, fetch.units, fetch.build_resource, fetch.handle_items, fetch.on_values, fetch.read_cached, budget)
+            except PICLIWebAPIError as e:
+                # The server rejected the batch itself, so every query on it failed.
+                errors.update({job_query.name: e for job_query, _, _, _ in group})
+                continue
+            finally:
+                trace.record('data fetch', started)
+            for index, (job_query, sink, server_web_id, _) in enumerate(group):
+                failed_tags = _check_failures(job_query, server_web_id, [failure for failure in failed if failure.unit.group == index], sink, budget=budget)
+                if failed_tags:
+                    info(f'Query {job_query.name} has values missing for {len(failed_tags)} tags.')
+        if any(job_fetch.cached for _, _, _, job_fetch in planned):
+            series_cache.trim()
+        webid_cache.save()
+    finally:
+        query_trace.finished_at = perf_counter()
+        if config.trace_file_path is not None:
+            query_trace.save(config.trace_file_path)
+    for name, error in errors.items():
+        info(f'Query {name} failed: {error}')
+    info(f'{len(jobs) - len(errors)} of {len(jobs)} queries executed successfully.')
+    return errors
+
+def _resolve_together(queries: list[Query], budget: engine.RetryBudget) -> None:
+    '''Looks up the tags of queries on the same server in one go, so resolving each query after only reads the local index.'''
+    from requests.exceptions import RequestException
+    servers = {}
+    for server_query in queries:
+        servers.setdefault((server_query.api_base_url, server_query.pi_server), []).append(server_query)
+    for server_queries in servers.values():
+        if len(server_queries) < 2:
+            continue
+        tags = list(dict.fromkeys(tag for server_query in server_queries for tag in server_query.tags))
+        try:
+            _get_tag_web_ids(server_queries[0], _get_server_web_id(server_queries[0]), tags, budget=budget)
+        except (RequestException, PICLIWebAPIError):
+            # The tags that were found are cached, and each query is resolved on its own next, which
+            # reports the error against the query it's in.
+            pass
+
+def _get_server_web_id(active_query: Query) -> str:
+    web_id = webid_cache.get_server(active_query.api_base_url, active_query.pi_server)
+    if web_id is not None:
+        debug(f'Using cached Web ID for server {active_query.pi_server}')
+        return web_id
     info(f'Getting Web ID for server {active_query.pi_server} from PI Web API.')
-    debug(f'TLS Cert Path: {tls_cert_path}')
+    from requests.exceptions import SSLError
+    started = perf_counter()
     try:
-        response = get(
-            f'{active_query.api_base_url}/dataservers?name={active_query.pi_server}', 
-            auth=_get_auth(),
-            verify=tls_cert_path
-        )
+        response = get_session().get(f'{active_query.api_base_url}/dataservers?name={active_query.pi_server}')
     except SSLError:
         raise PICLIWebAPIError(f'TLS issue while connecting to PI Web API.')
+    trace.record('server lookup', started, bytes=len(response.content), wire_bytes=wire_bytes(response), requests=1)
+    task.add_bytes(len(response.content))
     debug(f'Request URL: {response.url}')
     debug(f'Response Status Code: {response.status_code}')
-    debug(f'Response Content: {response.text}')
+    if debug_enabled():
+        debug(f'Response Content: {response.text}')
     
     if response.status_code != 200:
         raise PICLIWebAPIError(f'Error getting Web ID for {active_query.pi_server}. Likely incorrect server name.')
@@ -42,96 +243,262 @@ def _get_server_web_id() -> str:
     web_id = response.json().get('WebId')
     if web_id is None:
         raise PICLIWebAPIError(f'Error getting Web ID for {active_query.pi_server}. Response was good, but did not contain Web ID.')
+    webid_cache.put_server(active_query.api_base_url, active_query.pi_server, web_id)
     
     return web_id
 
-def _get_tag_web_ids(server_web_id: str) -> dict[str, str]:
-    info(f'Getting Web IDs for tags {active_query.tags} from PI Web API')
-    body = {}
-    for tag in active_query.tags:
-        body[tag] = {
-            'Method': 'GET',
-            'Resource': f'{active_query.api_base_url}/points/search?dataServerWebId={server_web_id}&query=tag:"{tag}"'
-        }
-    headers = {
-        'X-Requested-With': ''
-    }
-    response = post(
-        f'{active_query.api_base_url}/batch', 
-        json=body, 
-        auth=_get_auth(), 
-        headers=headers,
-        verify=tls_cert_path
-    )
-    debug(f'Request URL: {response.url}')
-    debug(f'Request Body: {response.request.body}')
-    debug(f'Response Status Code: {response.status_code}')
-    debug(f'Response Content: {response.text}')
-    
-    if response.status_code != 207:
-        raise PICLIWebAPIError(f'Error getting Web IDs for tags.')
-    
-    web_ids = {}
-    for tag, tag_info in response.json().items():
-        if tag_info.get('Status') != 200:
-            raise PICLIWebAPIError(f'Error getting Web ID for tag {tag}. Likely incorrect tag name.')
-        web_id = tag_info.get('Content').get('Items')[0].get('WebId')
-        if web_id is None:
-            raise PICLIWebAPIError(f'Error getting Web ID for tag {tag}. Response was good, but did not contain Web ID.')
-        web_ids[tag] = web_id
-
-    return web_ids
-
-def _get_recorded_values(tag_web_ids: dict[str, str]) -> list[dict]:
-    info(f'Getting recorded values for tags {active_query.tags} from PI Web API.')
-    body = {}
-    for tag, web_id in tag_web_ids.items():
-        body[tag] = {
-            'Method': 'GET',
-            'Resource': f'{active_query.api_base_url}/streams/{web_id}/recorded?startTime={active_query.start_time}&endTime={active_query.end_time}&boundaryType={active_query.boundary_type.value}&timeZone={active_query.timezone}'
-        }
-    headers = {
-        'X-Requested-With': ''
-    }
-    response = post(
-        f'{active_query.api_base_url}/batch', 
-        json=body, 
-        auth=_get_auth(), 
-        headers=headers,
-        verify=tls_cert_path
-    )
-    debug(f'Request URL: {response.url}')
-    debug(f'Response Status Code: {response.status_code}')
-    debug(f'Response Content: {response.text}')
+def _get_tag_web_ids(active_query: Query, server_web_id: str, tags: Optional[list[str]] = None, retry_stale: bool = True, budget: Optional[engine.RetryBudget] = None) -> dict[str, str]:
+    if tags is None:
+        tags = active_query.tags
+    try:
+        return tag_resolver.resolve(active_query.api_base_url, active_query.pi_server, server_web_id, tags, budget)
+    except PICLIStaleWebIdError:
+        if not retry_stale:
+            raise
+        # The server Web ID may have come from a stale cache entry, look it up again and retry once.
+        webid_cache.evict_server(active_query.api_base_url, active_query.pi_server)
+        return _get_tag_web_ids(active_query, _get_server_web_id(active_query), tags, retry_stale=False, budget=budget)
 
-    if response.status_code != 207:
-        raise PICLIWebAPIError(f'Error getting recorded values for tags {active_query.tags}.')
-    
-    recorded_values = []
-    for tag, tag_info in response.json().items():
-        if tag_info.get('Status') != 200:
-            raise PICLIWebAPIError(f'Error getting recorded values for tag {tag}. Likely incorrect tag name.')
-        for value in tag_info.get('Content').get('Items'):
-            recorded_values.append({
-                'Tag': tag,
-                'Timestamp': value.get('Timestamp'),
-                'Value': value.get('Value'),
-                'Good': value.get('Good'),
-                'Questionable': value.get('Questionable'),
-                'Substituted': value.get('Substituted')
-            })
-
-    return recorded_values
-
-def _get_auth():
-    debug('Getting authentication method')
-    debug(f'Auth method: {auth_method}')
-    if auth_method == AuthMethod.BASIC:
-        debug('Using basic authentication')
-        debug(f'Username: {username}')
-        debug(f'Password: {password}')
-        return HTTPBasicAuth(username, password)
-    elif auth_method == AuthMethod.NTLM:
-        raise NotImplementedError('Windows authentication not yet implemented.')
+@dataclass
+class _Fetch:
+    '''The units of a query's values and how to request and handle them, so several queries can share an engine run.'''
+    units: list[engine.WorkUnit]
+    build_resource: Callable[[engine.WorkUnit], str]
+    handle_items: Callable[[engine.WorkUnit, list[dict]], tuple[list[dict], Optional[engine.WorkUnit]]]
+    on_values: Callable[[engine.WorkUnit, list[dict]], None]
+    read_cached: Callable[[engine.WorkUnit], list[dict]]
+    cached: bool # Whether it reads from or writes to the series cache
+
+def _get_values(active_query: Query, server_web_id: str, tag_web_ids: dict[str, str], sink: ValueSink, retry_stale: bool = True, budget: Optional[engine.RetryBudget] = None) -> list[str]:
+    '''Passes the values of the tags to the sink and returns the tags that still had values missing after retrying.'''
+    info(f'Getting {active_query.query_type.value.lower()} values for tags {list(tag_web_ids)} from PI Web API.')
+    fetch = _plan_values(active_query, tag_web_ids, sink)
+    started = perf_counter()
+    failed = engine.run(active_query.api_base_url, fetch.units, fetch.build_resource, fetch.handle_items, fetch.on_values, fetch.read_cached, budget)
+    trace.record('data fetch', started)
+    if fetch.cached:
+        series_cache.trim()
+    return _check_failures(active_query, server_web_id, failed, sink, retry_stale, budget)
+
+def _plan_values(active_query: Query, tag_web_ids: dict[str, str], sink: ValueSink) -> _Fetch:
+    def on_values(unit: engine.WorkUnit, values: list[dict]) -> None:
+        started = perf_counter()
+        sink.append(unit.tag, values)
+        trace.record('store', started)
+
+    if active_query.query_type == QueryType.RECORDED:
+        # Adjacent windows only line up cleanly when neither end adds a boundary value, so other boundary types fetch the range in one piece
+        # and can't be stitched together from cached pieces either.
+        inside = active_query.boundary_type == BoundaryType.INSIDE
+        series_parameters = ('recorded', active_query.timezone, config.recorded_fields) if inside else None
+        units, pieces, segments = _build_units(active_query, tag_web_ids, inside, series_parameters)
+        build_resource, handle_items = partial(_recorded_resource, active_query), _caching(engine.next_page, segments)
+    elif active_query.query_type == QueryType.INTERPOLATED:
+        interval = pitime.parse_duration(active_query.interval)
+        series_parameters = ('interpolated', active_query.timezone, config.interpolated_fields, active_query.interval) if interval else None
+        units, pieces, segments = _build_units(active_query, tag_web_ids, False, series_parameters, interval)
+        build_resource, handle_items = partial(_interpolated_resource, active_query), _caching(_single_page, segments)
+    elif active_query.query_type == QueryType.SUMMARY:
+        units, pieces, segments = _build_units(active_query, tag_web_ids, False)
+        build_resource, handle_items = partial(_summary_resource, active_query), _summary_page
     else:
-        raise PICLIValidationError(f'Unsupported authentication method: {auth_method}.')
\ No newline at end of file
+        raise PICLIValidationError(f'Unsupported query type: {active_query.query_type}.')
+    return _Fetch(units, build_resource, handle_items, on_values, partial(_read_cached, pieces), bool(pieces or segments))
+
+def _check_failures(active_query: Query, server_web_id: str, failed: list[engine.FailedUnit], sink: ValueSink, retry_stale: bool = True, budget: Optional[engine.RetryBudget] = None) -> list[str]:
+    '''Fetches tags whose cached Web IDs went stale again, and warns about and returns the tags that still have values missing.'''
+    # The values of every other tag have already been passed on, a failed tag only loses the windows that failed.
+    from requests.exceptions import RequestException
+    stale_tags = []
+    failed_tags = []
+    for failure in failed:
+        tag = failure.unit.tag
+        if failure.status == 404 and retry_stale and failure.unit.page == 0:
+            if tag not in stale_tags:
+                stale_tags.append(tag)
+            continue
+        debug(f'Could not get values for {tag} from {failure.unit.start_time} to {failure.unit.end_time} (status {failure.status}): {failure.message}')
+        if tag not in failed_tags:
+            failed_tags.append(tag)
+
+    if stale_tags:
+        # Cached Web IDs that no longer exist on the server, resolve them again and retry once.
+        for tag in stale_tags:
+            webid_cache.evict_tag(active_query.api_base_url, active_query.pi_server, tag)
+        try:
+            tag_web_ids = _get_tag_web_ids(active_query, server_web_id, stale_tags, budget=budget)
+            failed_tags.extend(tag for tag in stale_tags if tag not in tag_web_ids)
+            if tag_web_ids:
+                failed_tags.extend(_get_values(active_query, server_web_id, tag_web_ids, sink, retry_stale=False, budget=budget))
+        except (RequestException, PICLIWebAPIError) as e:
+            debug(f'Could not get values for {", ".join(stale_tags)} again: {e}')
+            failed_tags.extend(stale_tags)
+
+    failed_tags = list(dict.fromkeys(failed_tags))
+    if failed_tags and retry_stale: # Stale tags fetched again are reported along with the rest
+        warning(f'PI Web API did not return all {active_query.query_type.value.lower()} values for {", ".join(failed_tags)}, even after retrying. Their values are missing from the results.')
+    return failed_tags
+
+def _combine(fetches: list[_Fetch]) -> _Fetch:
+    '''Merges the fetches of several queries into one, each unit numbered after the units before it and grouped by its fetch.'''
+    offsets = []
+    units = []
+    for group, fetch in enumerate(fetches):
+        offsets.append(len(units))
+        units.extend(replace(unit, root=unit.root + offsets[-1], group=group) for unit in fetch.units)
+
+    # Each query's own functions see its units as they were before merging.
+    def local(unit: engine.WorkUnit) -> engine.WorkUnit:
+        return replace(unit, root=unit.root - offsets[unit.group], group=0)
+
+    def build_resource(unit: engine.WorkUnit) -> str:
+        return fetches[unit.group].build_resource(local(unit))
+
+    def handle_items(unit: engine.WorkUnit, items: list[dict]) -> tuple[list[dict], Optional[engine.WorkUnit]]:
+        values, next_unit = fetches[unit.group].handle_items(local(unit), items)
+        if next_unit is not None:
+            next_unit = replace(next_unit, root=unit.root, group=unit.group)
+        return values, next_unit
+
+    def on_values(unit: engine.WorkUnit, values: list[dict]) -> None:
+        fetches[unit.group].on_values(local(unit), values)
+
+    def read_cached(unit: engine.WorkUnit) -> list[dict]:
+        return fetches[unit.group].read_cached(local(unit))
+    return _Fetch(units, build_resource, handle_items, on_values, read_cached, any(fetch.cached for fetch in fetches))
+
+def _build_units(
+    active_query: Query,
+    tag_web_ids: dict[str, str],
+    sliced: bool,
+    series_parameters: Optional[tuple] = None,
+    grid: Optional[timedelta] = None
+) -> tuple[list[engine.WorkUnit], dict[int, series_cache.Piece], dict[int, tuple[str, int, int]]]:
+    '''Builds the units of a query, reading the parts of each tag's range the series cache has instead of fetching them.
+
+    Also returns the cached piece behind each cached unit and the segment each fetched unit's values will be cached as.
+    '''
+    now = datetime.now(timezone.utc)
+    start = pitime.resolve(active_query.start_time, active_query.timezone, now)
+    end = pitime.resolve(active_query.end_time, active_query.timezone, now)
+    if series_parameters is None or not series_cache.enabled() or start is None or end is None or end < start:
+        return engine.build_units(tag_web_ids, active_query.start_time, active_query.end_time, active_query.timezone, sliced=sliced), {}, {}
+
+    start_us = series_cache.to_micros(start)
+    end_us = series_cache.to_micros(end)
+    settled_us = series_cache.settled_until(now)
+    grid_us = None
+    if grid is not None:
+        # Interpolated values only line up with cached ones taken on the same grid of times.
+        grid_us = grid // timedelta(microseconds=1)
+        series_parameters += (start_us % grid_us,)
+    units = []
+    pieces = {}
+    segments = {}
+    for tag, web_id in tag_web_ids.items():
+        series = series_cache.series_key(active_query.api_base_url, web_id, *series_parameters)
+        for piece in series_cache.plan(series, start_us, end_us):
+            piece_start = pitime.format_time(series_cache.to_time(piece.start_us))
+            piece_end = pitime.format_time(series_cache.to_time(piece.end_us))
+            if piece.segment_id is not None:
+                pieces[len(units)] = piece
+                units.append(engine.WorkUnit(root=len(units), tag=tag, web_id=web_id, start_time=piece_start, end_time=piece_end, cached=True))
+                continue
+            windows = None
+            if sliced and config.time_slice is not None:
+                windows = pitime.split_range(piece_start, piece_end, 'UTC', config.time_slice)
+            for window_start, window_end in windows or [(piece_start, piece_end)]:
+                window_start_us = series_cache.to_micros(pitime.resolve(window_start, 'UTC'))
+                cached_until = min(series_cache.to_micros(pitime.resolve(window_end, 'UTC')), settled_us)
+                if grid_us is not None:
+                    cached_until = window_start_us + (cached_until - window_start_us) // grid_us * grid_us
+                if cached_until > window_start_us:
+                    segments[len(units)] = (series, window_start_us, cached_until)
+                units.append(engine.WorkUnit(root=len(units), tag=tag, web_id=web_id, start_time=window_start, end_time=window_end))
+    debug(f'Reading {len(pieces)} of {len(units)} ranges from the series cache')
+    return units, pieces, segments
+
+def _caching(
+    handle_items: Callable[[engine.WorkUnit, list[dict]], tuple[list[dict], Optional[engine.WorkUnit]]],
+    segments: dict[int, tuple[str, int, int]]
+) -> Callable[[engine.WorkUnit, list[dict]], tuple[list[dict], Optional[engine.WorkUnit]]]:
+    '''Wraps handle_items to write each unit's values to the series cache a page at a time.
+
+    A page is written once the next one is in, as a segment from where the last one ended to its last
+    timestamp, so it takes the events at that timestamp which spilled onto the next page. Only about a
+    page of each unit is held, however long its window.
+    '''
+    # The start of each root's next segment and the values waiting to be written in it
+    pending = {}
+
+    def handle(unit: engine.WorkUnit, items: list[dict]) -> tuple[list[dict], Optional[engine.WorkUnit]]:
+        values, next_unit = handle_items(unit, items)
+        # Runs on the workers, but a unit's pages are fetched one after another, so only one handles a unit at a time.
+        if unit.root not in segments:
+            return values, next_unit
+        series, start_us, end_us = segments[unit.root]
+        segment_start_us, held = pending.pop(unit.root, (start_us, []))
+        waiting = held + values
+        if held:
+            last_timestamp = held[-1].get('Timestamp')
+            last_us = parse_timestamp(last_timestamp)[0]
+            if last_us > segment_start_us:
+                # Segments include the events at both ends, so the events at the shared timestamp go in both.
+                spilled = _count_leading(values, last_timestamp)
+                at_last = len(held) - _count_trailing(held, last_timestamp)
+                _write_segment(series, segment_start_us, last_us, held + values[:spilled])
+                segment_start_us, waiting = last_us, held[at_last:] + values
+        if next_unit is None or (waiting and parse_timestamp(waiting[-1].get('Timestamp'))[0] >= end_us):
+            del segments[unit.root]
+            _write_segment(series, segment_start_us, end_us, waiting)
+        else:
+            pending[unit.root] = (segment_start_us, waiting)
+        return values, next_unit
+    return handle
+
+def _write_segment(series: str, start_us: int, end_us: int, values: list[dict]) -> None:
+    started = perf_counter()
+    series_cache.write(series, start_us, end_us, values)
+    trace.record('cache write', started)
+
+def _count_leading(values: list[dict], timestamp: str) -> int:
+    count = 0
+    while count < len(values) and values[count].get('Timestamp') == timestamp:
+        count += 1
+    return count
+
+def _count_trailing(values: list[dict], timestamp: str) -> int:
+    count = 0
+    while count < len(values) and values[-1 - count].get('Timestamp') == timestamp:
+        count += 1
+    return count
+
+def _read_cached(pieces: dict[int, series_cache.Piece], unit: engine.WorkUnit) -> list[dict]:
+    started = perf_counter()
+    values = series_cache.read(pieces[unit.root])
+    trace.record('cache read', started)
+    return values
+
+def _recorded_resource(active_query: Query, unit: engine.WorkUnit) -> str:
+    return f'{active_query.api_base_url}/streams/{unit.web_id}/recorded?startTime={quote(unit.start_time)}&endTime={quote(unit.end_time)}&boundaryType={active_query.boundary_type.value}&timeZone={active_query.timezone}&maxCount={config.page_size}{_selected_fields(config.recorded_fields)}'
+
+def _interpolated_resource(active_query: Query, unit: engine.WorkUnit) -> str:
+    return f'{active_query.api_base_url}/streams/{unit.web_id}/interpolated?startTime={quote(unit.start_time)}&endTime={quote(unit.end_time)}&interval={quote(active_query.interval)}&timeZone={active_query.timezone}{_selected_fields(config.interpolated_fields)}'
+
+def _summary_resource(active_query: Query, unit: engine.WorkUnit) -> str:
+    summary_types = ''.join([f'&summaryType={summary_type.value}' for summary_type in active_query.summary_types])
+    selected_fields = _selected_fields(config.summary_fields, 'Items.Value', ['Items.Type'])
+    return f'{active_query.api_base_url}/streams/{unit.web_id}/summary?startTime={quote(unit.start_time)}&endTime={quote(unit.end_time)}&summaryDuration={quote(active_query.interval)}{summary_types}&calculationBasis={active_query.calculation_basis.value}&timeType={active_query.timestamp_calculation.value}&timeZone={active_query.timezone}{selected_fields}'
+
+def _selected_fields(fields: Optional[list[str]], prefix: str = 'Items', required: list[str] = []) -> str:
+    # Only the fields picli keeps are requested, which makes responses on large pulls much smaller and quicker to decode.
+    if fields is None:
+        return ''
+    return '&selectedFields=' + ';'.join(required + [f'{prefix}.{field}' for field in fields])
+
+def _single_page(unit: engine.WorkUnit, items: list[dict]) -> tuple[list[dict], Optional[engine.WorkUnit]]:
+    return items, None
+
+def _summary_page(unit: engine.WorkUnit, items: list[dict]) -> tuple[list[dict], Optional[engine.WorkUnit]]:
+    # Summary items wrap each value together with the summary type it belongs to.
+    return [{'Type': item.get('Type'), **item.get('Value')} for item in items], None
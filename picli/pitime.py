@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta, timezone as dt_timezone, tzinfo
+from typing import Optional
+import re
+
+_DURATION_UNITS = {
+    's': 'seconds', 'sec': 'seconds', 'second': 'seconds', 'seconds': 'seconds',
+    'm': 'minutes', 'min': 'minutes', 'minute': 'minutes', 'minutes': 'minutes',
+    'h': 'hours', 'hr': 'hours', 'hour': 'hours', 'hours': 'hours',
+    'd': 'days', 'day': 'days', 'days': 'days',
+    'w': 'weeks', 'week': 'weeks', 'weeks': 'weeks'
+}
+_DURATION = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([a-z]+)\s*$', re.IGNORECASE)
+_RELATIVE_TIME = re.compile(r'^\s*(\*|t|today|y|yesterday)\s*(?:([+-])\s*(\d+(?:\.\d+)?\s*[a-z]+))?\s*$', re.IGNORECASE)
+
+def parse_duration(text: str) -> Optional[timedelta]:
+    '''Parses a PI style duration such as 1d, 30m or 1.5h. Returns None for anything else.'''
+    match = _DURATION.match(text)
+    if match is None or match.group(2).lower() not in _DURATION_UNITS:
+        return None
+    return timedelta(**{_DURATION_UNITS[match.group(2).lower()]: float(match.group(1))})
+
+def resolve(expression: str, timezone: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    '''Resolves an absolute or simple relative PI time expression to a UTC datetime. Returns None if it can't be resolved locally.'''
+    zone = _get_zone(timezone)
+    if now is None:
+        now = datetime.now(dt_timezone.utc)
+    try:
+        resolved = datetime.fromisoformat(expression.strip().replace('Z', '+00:00'))
+        if resolved.tzinfo is None:
+            if zone is None:
+                return None
+            resolved = resolved.replace(tzinfo=zone)
+        return resolved.astimezone(dt_timezone.utc)
+    except ValueError:
+        pass
+
+    match = _RELATIVE_TIME.match(expression)
+    if match is None:
+        return None
+    base, sign, offset = match.groups()
+    if base == '*':
+        resolved = now
+    else:
+        if zone is None:
+            return None
+        resolved = now.astimezone(zone).replace(hour=0, minute=0, second=0, microsecond=0)
+        if base.lower() in ['y', 'yesterday']:
+            resolved -= timedelta(days=1)
+    if offset is not None:
+        duration = parse_duration(offset)
+        if duration is None:
+            return None
+        resolved = resolved + duration if sign == '+' else resolved - duration
+    return resolved.astimezone(dt_timezone.utc)
+
+def format_time(time: datetime) -> str:
+    '''Formats a datetime as an ISO 8601 UTC timestamp the PI Web API accepts.'''
+    return time.astimezone(dt_timezone.utc).isoformat().replace('+00:00', 'Z')
+
+def split_range(start_time: str, end_time: str, timezone: str, window_length: str) -> Optional[list[tuple[str, str]]]:
+    '''Splits a time range into consecutive windows. Returns None if the range can't be resolved locally.'''
+    now = datetime.now(dt_timezone.utc)
+    start = resolve(start_time, timezone, now)
+    end = resolve(end_time, timezone, now)
+    length = parse_duration(window_length)
+    if start is None or end is None or length is None or length <= timedelta(0) or end <= start:
+        return None
+    windows = []
+    while start < end:
+        window_end = min(start + length, end)
+        windows.append((format_time(start), format_time(window_end)))
+        start = window_end
+    return windows
+
+def _get_zone(timezone: str) -> Optional[tzinfo]:
+    if timezone.upper() in ['UTC', 'GMT']:
+        return dt_timezone.utc
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(timezone)
+    except (ImportError, ValueError, KeyError):
+        return None
@@ -1,14 +1,10 @@
 from enum import Enum
-import platform
-from os import path
-from typing import List
-import os
+from copy import deepcopy
+from typing import List, Any, Optional
 from dataclasses import dataclass, field
-from dateutil.parser import parse
-import json
 
-from picli.errors import PICLIInitError, PICLIShutdownError
-from picli import config
+from picli.errors import PICLICommandError
+from picli import config, state, view
 from picli.commands import register_command
 from picli.log import info
 
@@ -56,7 +52,7 @@ class BoundaryType(Enum):
 
 @dataclass
 class Query:
-    query_number: int = 1
+    name: str = '1'
     query_type: QueryType = QueryType.RECORDED
     api_base_url: str = 'https://piwebapi.domain.com'
     pi_server: str = 'piserver'
@@ -64,90 +60,164 @@ class Query:
     end_time: str = '*'
     tags: List[str] = field(default_factory=list)
     timezone: str = 'UTC'
-    summary_type: SummaryType = SummaryType.AVERAGE
+    summary_types: List[SummaryType] = field(default_factory=lambda: [SummaryType.AVERAGE])
     calculation_basis: CalculationBasis = CalculationBasis.TIME_WEIGHTED
     timestamp_calculation: TimestampCalculation = TimestampCalculation.AUTO
     boundary_type: BoundaryType = BoundaryType.INSIDE
     interval: str = '1d'
 
-    def __post_init__(self):
-        self._populate_from_file() 
-
-    def __del__(self):
-        self._save()
-
-    def _populate_from_file(self) -> None:
-        global query_1, query_2
-        if platform.system() == 'Windows':
-            save_path = path.join(path.expanduser('~'), 'AppData', 'Local', 'picli', 'save.json')
-        elif platform.system() == 'Linux':
-            save_path = path.join(path.expanduser('~'), '.local', 'share', 'picli', 'save.json')
-        else:
-            raise PICLIInitError('Unsupported operating system. Don\'t know where to look for save file.')
-        if not path.isfile(save_path):
-            try:
-                os.makedirs(path.dirname(save_path), exist_ok=True)
-                with open(save_path, 'w') as file:
-                    file.write(r'{"1": {}, "2": {}}')
-            except FileNotFoundError:
-                raise PICLIInitError(f'Could not create save file at {save_path}.')
-            
-        with open(save_path, 'r') as file:
-            save_file_contents = json.loads(file.read())
-            for field, value in save_file_contents[str(self.query_number)].items():
-                if field in config.request_fields_to_save:
-                    setattr(self, field, value)
-
-    def _save(self) -> None:
-        if platform.system() == 'Windows':
-            save_path = path.join(path.expanduser('~'), 'AppData', 'Local', 'picli', 'save.json')
-        elif platform.system() == 'Linux':
-            save_path = path.join(path.expanduser('~'), '.local', 'share', 'picli', 'save.json')
-        else:
-            raise PICLIShutdownError('Unsupported operating system. Don\'t know where to look for save file.')
-        
-        save_file_contents = {"1": {}, "2": {}}
-        for field in self.__dataclass_fields__:
-            if field in config.request_fields_to_save:
-                save_file_contents[str(self.query_number)][field] = getattr(self, field)
-        with open(save_path, 'w') as file:
-            file.write(json.dumps(save_file_contents, default=str, indent=4))
-
-query_1 = Query(query_number=1)
-query_2 = Query(query_number=2)
-active_query = query_1
+    def _populate(self, saved_fields: dict) -> None:
+        for field, value in saved_fields.items():
+            if field in config.request_fields_to_save and field in self.__dataclass_fields__ and field != 'name':
+                setattr(self, field, _from_saved(getattr(self, field), value))
 
-def swap_queries():
-    '''Swaps the currently active query.'''
-    info('Swapping queries.')
-    global active_query
-    if active_query == query_1:
-        active_query = query_2
+    def _saved_fields(self) -> dict:
+        return {field: _to_saved(getattr(self, field)) for field in self.__dataclass_fields__ if field in config.request_fields_to_save and field != 'name'}
+
+def _to_saved(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, list):
+        return [_to_saved(item) for item in value]
+    return value
+
+def _from_saved(default: Any, value: Any) -> Any:
+    '''Converts a saved value back to the type of the field's default. Values that don't convert leave the default.'''
+    try:
+        if isinstance(default, Enum):
+            return type(default).from_string_insensitive(value)
+        if isinstance(default, list) and default and isinstance(default[0], Enum):
+            return [type(default[0]).from_string_insensitive(item) for item in value]
+    except (ValueError, TypeError, AttributeError):
+        return default
+    return value
+
+# The saved queries are loaded on first use rather than at import, so startup doesn't touch the save file.
+# Queries are kept by name in the order they were created. swap goes back to the previously active one.
+queries: dict[str, Query]
+active_query: Query
+_previous_name: Optional[str] = None
+
+def __getattr__(name: str) -> Any:
+    if name in ['queries', 'active_query']:
+        _load()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def _load() -> None:
+    global queries, active_query, _previous_name
+    if 'active_query' in globals():
+        return
+    saved = state.load() or {'1': {}, '2': {}}
+    queries = {}
+    for name, saved_fields in saved.items():
+        queries[name] = Query(name=name)
+        queries[name]._populate(saved_fields)
+    names = list(queries)
+    active_query = queries['1'] if '1' in queries else queries[names[0]]
+    _previous_name = next((name for name in queries if name != active_query.name), None)
+
+def save() -> None:
+    '''Saves the fields of the queries that changed since they were loaded or last saved.'''
+    # Nothing to save if no query was used, and the save file is left alone.
+    if 'queries' not in globals():
+        return
+    state.save({name: saved_query._saved_fields() for name, saved_query in queries.items()})
+
+def get_active_query() -> Query:
+    '''Returns the active query, loading the saved queries if they haven't been yet.'''
+    _load()
+    return active_query
+
+def get_queries(names: str) -> list[Query]:
+    '''Returns the named queries, or every query for "all". Names can be comma, semicolon, or pipe separated.'''
+    _load()
+    if names.lower() == 'all':
+        return list(queries.values())
+    for separator in [',', ';', '|']:
+        if separator in names:
+            names = names.split(separator)
+            break
     else:
-        active_query = query_1
+        names = [names]
+    for name in names:
+        if name not in queries:
+            raise PICLICommandError(f'No query named {name}. query list shows the queries.')
+    return [queries[name] for name in dict.fromkeys(names)]
+
+def select_query(name: str):
+    '''Makes the named query active, creating it as a copy of the active query if there's no query with that name.'''
+    global active_query, _previous_name
+    _load()
+    if name == active_query.name:
+        return
+    if name not in queries:
+        info(f'Creating query {name} from query {active_query.name}.')
+        new_query = deepcopy(active_query)
+        new_query.name = name
+        queries[name] = new_query
+    info(f'Switching to query {name}.')
+    _previous_name = active_query.name
+    active_query = queries[name]
+    view.reset()
+register_command(select_query, ['query'])
+
+def list_queries():
+    '''Logs the queries, marking the active one.'''
+    _load()
+    for name, listed_query in queries.items():
+        marker = '*' if listed_query is active_query else ' '
+        info(f'{marker} {name}: {listed_query.query_type.value.lower()}, {len(listed_query.tags)} tags, {listed_query.start_time} to {listed_query.end_time}')
+register_command(list_queries, ['query', 'list'])
+
+def remove_query(name: str):
+    '''Removes a query. The active query can't be removed.'''
+    global _previous_name
+    _load()
+    if name not in queries:
+        raise PICLICommandError(f'No query named {name}.')
+    if queries[name] is active_query:
+        raise PICLICommandError('The active query can\'t be removed. Switch to another query first.')
+    info(f'Removing query {name}.')
+    del queries[name]
+    if _previous_name == name:
+        _previous_name = next((other for other in queries if other != active_query.name), None)
+register_command(remove_query, ['query', 'remove'])
+
+def swap_queries():
+    '''Switches back to the previously active query.'''
+    _load()
+    if _previous_name is None or _previous_name not in queries:
+        raise PICLICommandError('There\'s no other query to swap to. Create one with query <name>.')
+    select_query(_previous_name)
 register_command(swap_queries, ['swap'])
 
 def set_query_type(query_type: str):
     '''Sets the query type for the active query.'''
     info(f'Setting query type to {query_type}.')
+    active_query = get_active_query()
     active_query.query_type = QueryType.from_string_insensitive(query_type)
 register_command(set_query_type, ['type'])
 
 def set_api_base_url(url: str):
     '''Sets the API base URL for the active query.'''
     info(f'Setting API base URL to {url}.')
+    active_query = get_active_query()
     active_query.api_base_url = url
 register_command(set_api_base_url, ['url'])
 
 def set_pi_server(server: str):
     '''Sets the PI server for the active query.'''
     info(f'Setting PI server to {server}.')
+    active_query = get_active_query()
     active_query.pi_server = server
 register_command(set_pi_server, ['server'])
 
 def set_start_time(time: str):
     '''Sets the start time for the active query.'''
     info(f'Setting start time to {time}.')
+    active_query = get_active_query()
+    from dateutil.parser import parse
     try:
         datetime = parse(time)
         active_query.start_time = datetime.isoformat()
@@ -158,6 +228,8 @@ register_command(set_start_time, ['start'])
 def set_end_time(time: str):
     '''Sets the end time for the active query.'''
     info(f'Setting end time to {time}.')
+    active_query = get_active_query()
+    from dateutil.parser import parse
     try:
         datetime = parse(time)
         active_query.end_time = datetime.isoformat()
@@ -168,6 +240,7 @@ register_command(set_end_time, ['end'])
 def add_tags(tags: str):
     '''Adds tags to the active query. Can be comma, semicolon, or pipe separated.'''
     info(f'Adding tags: {tags}.')
+    active_query = get_active_query()
     if ',' in tags:
         active_query.tags.extend(tags.split(','))
     elif ';' in tags:
@@ -181,6 +254,7 @@ register_command(add_tags, ['tags', 'add'])
 def remove_tags(tags: str):
     '''Removes tags from the active query. Can be comma, semicolon, or pipe separated.'''
     info(f'Removing tags: {tags}.')
+    active_query = get_active_query()
     if ',' in tags:
         for tag in tags.split(','):
             active_query.tags.remove(tag)
@@ -197,6 +271,7 @@ register_command(remove_tags, ['tags', 'remove'])
 def set_tags(tags: str):
     '''Sets the tags for the active query. Can be comma, semicolon, or pipe separated.'''
     info(f'Setting tags: {tags}.')
+    active_query = get_active_query()
     active_query.tags = []
     if ',' in tags:
         active_query.tags = tags.split(',')
@@ -211,41 +286,56 @@ register_command(set_tags, ['tags', 'set'])
 def clear_tags():
     '''Clears the tags for the active query.'''
     info('Clearing tags.')
+    active_query = get_active_query()
     active_query.tags = []
 register_command(clear_tags, ['tags', 'clear'])
 
 def set_timezone(timezone: str):
     '''Sets the timezone for the active query.'''
     info(f'Setting timezone to {timezone}.')
+    active_query = get_active_query()
     active_query.timezone = timezone
 register_command(set_timezone, ['timezone'])
 
-def set_summary_type(summary_type: str):
-    '''Sets the summary type for the active query.'''
-    info(f'Setting summary type to {summary_type}.')
-    active_query.summary_type = SummaryType.from_string_insensitive(summary_type)
-register_command(set_summary_type, ['summary'])
+def set_summary_types(summary_types: str):
+    '''Sets the summary types for the active query. Can be comma, semicolon, or pipe separated.'''
+    info(f'Setting summary types to {summary_types}.')
+    active_query = get_active_query()
+    if ',' in summary_types:
+        summary_types = summary_types.split(',')
+    elif ';' in summary_types:
+        summary_types = summary_types.split(';')
+    elif '|' in summary_types:
+        summary_types = summary_types.split('|')
+    else:
+        summary_types = [summary_types]
+    active_query.summary_types = [SummaryType.from_string_insensitive(summary_type) for summary_type in summary_types]
+register_command(set_summary_types, ['summary'])
 
 def set_calculation_basis(calculation_basis: str):
     '''Sets the calculation basis for the active query.'''
     info(f'Setting calculation basis to {calculation_basis}.')
+    active_query = get_active_query()
     active_query.calculation_basis = CalculationBasis.from_string_insensitive(calculation_basis)
 register_command(set_calculation_basis, ['basis'])
 
 def set_timestamp_calculation(timestamp_calculation: str):
     '''Sets the timestamp calculation for the active query.'''
     info(f'Setting timestamp calculation to {timestamp_calculation}.')
+    active_query = get_active_query()
     active_query.timestamp_calculation = TimestampCalculation.from_string_insensitive(timestamp_calculation)
 register_command(set_timestamp_calculation, ['timecalc'])
 
 def set_boundary_type(boundary_type: str):
     '''Sets the boundary type for the active query.'''
     info(f'Setting boundary type to {boundary_type}.')
+    active_query = get_active_query()
     active_query.boundary_type = BoundaryType.from_string_insensitive(boundary_type)
 register_command(set_boundary_type, ['bound'])
 
 def set_interval(interval: str):
     '''Sets the interval for the active query.'''
     info(f'Setting interval to {interval}.')
+    active_query = get_active_query()
     active_query.interval = interval
 register_command(set_interval, ['interval'])
\ No newline at end of file
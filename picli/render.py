@@ -1,122 +1,213 @@
-from os import get_terminal_size
+from os import terminal_size
+from shutil import get_terminal_size
+from threading import Lock, Thread
+from time import perf_counter, sleep
+from typing import Optional
+import signal
+import sys
+import re
 
-from picli.log import log_buffer, info
-from picli.credentials import username, password
-from picli.query import active_query, QueryType
+from picli import log
+from picli.query import QueryType
+from picli.results import plain_value
 from picli.ansi import *
-from picli import pi
-
-CREDENTIALS_SECTION_HEIGHT = 2
-QUERY_SECTION_HEIGHT = 0
-PROMPT_SECTION_HEIGHT = 2
-RESULTS_SECTION_HEIGHT = 0
-LOG_SECTION_HEIGHT = 0
-
-def render():
-    print(ANSI_CLEAR, end='')
-    print(ANSI_CURSOR_HOME, end='')
-    _render_credentials()
-    print()
-    _render_query()
-    print('\n' * 3, end='')
-    if pi.results:
-        _render_results()
-    _render_log()
-    _reset_cursor()
-
-def _render_credentials():
-    if username is None and password is None:
-        print(f'{ANSI_FG_YELLOW}Not logged in.{ANSI_FG_RESET}')
+from picli import pi, query, credentials, task, trace, view
+
+LOG_SECTION_MIN_HEIGHT = 5
+TABLE_CHROME_HEIGHT = 6 # Separator, top border, header, header border, bottom border and footer
+MAX_COLUMN_WIDTH = 40
+PROGRESS_INTERVAL = 0.25
+
+_ANSI_ESCAPE = re.compile(r'\033\[[0-9;]*[A-Za-z]')
+
+# What's currently on screen, so the next frame only has to send the lines that changed.
+_previous_frame: Optional[list[str]] = None
+_previous_size: Optional[terminal_size] = None
+_resized = False # Set by the resize signal, the progress thread redraws
+_lock = Lock()
+
+def render(keep_cursor: bool = False):
+    '''Draws the lines that changed since the last frame in one write, then moves the cursor to the prompt line.'''
+    global _resized
+    with _lock:
+        # This frame is drawn at the current size. A resize while it's drawn sets the flag again.
+        _resized = False
+        started = perf_counter()
+        try:
+            _draw(keep_cursor)
+        finally:
+            trace.record('render', started)
+
+def _draw(keep_cursor: bool) -> None:
+    global _previous_frame, _previous_size
+    size = get_terminal_size()
+    lines = _render_credentials()
+    lines.append('')
+    lines.extend(_render_query())
+    prompt_line = len(lines) + 2
+    lines.extend(['', '', _render_progress()]) # The prompt goes on the middle line
+    if pi.active_results():
+        lines.extend(_render_results(size, size.lines - len(lines) - LOG_SECTION_MIN_HEIGHT))
+    lines.extend(_render_log(size, size.lines - len(lines)))
+    lines = [_clip(line, size.columns) for line in lines]
+
+    output = []
+    if _previous_frame is None:
+        output.append(ANSI_CLEAR + ANSI_CURSOR_HOME)
+    # A narrower terminal may have wrapped or reflowed what was on screen, so every line is rewritten
+    # in place. Otherwise only changed lines are, plus the lines around the prompt, which the echoed
+    # command and prompts like login's have written over.
+    rewrite_all = _previous_frame is None or size.columns < _previous_size.columns
+    previous_frame = _previous_frame or []
+    for number, line in enumerate(lines, start=1):
+        if keep_cursor and number == prompt_line:
+            continue # Holds the prompt and whatever has been typed so far
+        changed = rewrite_all or number > len(previous_frame) or previous_frame[number - 1] != line
+        if changed or (not keep_cursor and prompt_line <= number <= prompt_line + 2):
+            output.append(ansi_cursor_position(number) + ANSI_CLEAR_LINE + line)
+    if len(lines) < len(previous_frame) or rewrite_all:
+        output.append(ansi_cursor_position(len(lines) + 1) + ANSI_CLEAR_TO_END)
+    if keep_cursor:
+        output.insert(0, ANSI_SAVE_CURSOR)
+        output.append(ANSI_RESTORE_CURSOR)
     else:
-        print(f'{ANSI_FG_CYAN}Logged in as: {ANSI_FG_RESET}{username}')
-
-def _render_query():
-    global QUERY_SECTION_HEIGHT
-    print(f'{ANSI_FG_CYAN}API Base URL: {ANSI_FG_RESET}{active_query.api_base_url}{ANSI_FG_RESET}')
-    print(f'{ANSI_FG_CYAN}PI Server: {ANSI_FG_RESET}{active_query.pi_server}{ANSI_FG_RESET}')
-    print(f'{ANSI_FG_CYAN}Type: {ANSI_FG_RESET}{active_query.query_type.value}{ANSI_FG_RESET}')
-    print(f'{ANSI_FG_CYAN}Start Time: {ANSI_FG_RESET}{active_query.start_time}{ANSI_FG_RESET}')
-    print(f'{ANSI_FG_CYAN}End Time: {ANSI_FG_RESET}{active_query.end_time}{ANSI_FG_RESET}')
-    print(f'{ANSI_FG_CYAN}Tags: {ANSI_FG_RESET}{", ".join(active_query.tags)}{ANSI_FG_RESET}')
-    print(f'{ANSI_FG_CYAN}Timezone: {ANSI_FG_RESET}{active_query.timezone}{ANSI_FG_RESET}')
+        output.append(ansi_cursor_position(prompt_line))
+    sys.stdout.write(''.join(output))
+    sys.stdout.flush()
+    _previous_frame = lines
+    _previous_size = size
+
+def invalidate() -> None:
+    '''Forgets what's on screen, so the next frame is drawn from scratch.'''
+    global _previous_frame, _previous_size
+    _previous_frame = None
+    _previous_size = None
+
+def watch_resize() -> None:
+    '''Redraws whenever the terminal is resized, including while waiting at the prompt.'''
+    if hasattr(signal, 'SIGWINCH'):
+        signal.signal(signal.SIGWINCH, _on_resize)
+
+def _on_resize(signal_number, frame) -> None:
+    # The handler runs on the main thread, which may be part way through a frame and holding the lock,
+    # so it only flags the resize and the progress thread draws the frame.
+    global _resized
+    _resized = True
+
+def watch_progress() -> None:
+    '''Redraws a few times a second while a query runs in the background, once more when it finishes, and after a resize.'''
+    def watch() -> None:
+        shown = None
+        while True:
+            sleep(PROGRESS_INTERVAL)
+            progress = task.progress
+            if _previous_frame is None:
+                continue
+            changed = progress is not None and (progress.state == 'running' or shown != (id(progress), progress.state))
+            if _resized or changed:
+                render(keep_cursor=True)
+                if progress is not None:
+                    shown = (id(progress), progress.state)
+    Thread(target=watch, name='picli-progress', daemon=True).start()
+
+def _render_progress() -> str:
+    progress = task.progress
+    if progress is None:
+        return ''
+    counts = f'{progress.tags_done}/{progress.tags_total} tags, {progress.pages_done:,} pages, {_format_bytes(progress.bytes_received)} in {progress.elapsed:.1f}s'
+    if progress.state == 'running':
+        return f'{ANSI_FG_YELLOW}{progress.description} running: {counts}. cancel or Ctrl+C to stop.{ANSI_FG_RESET}'
+    return f'{ANSI_FG_CYAN}{progress.description} {progress.state}: {ANSI_FG_RESET}{counts}'
+
+def _format_bytes(count: int) -> str:
+    for unit in ['B', 'KB', 'MB']:
+        if count < 1024:
+            return f'{count:.0f} {unit}' if unit == 'B' else f'{count:.1f} {unit}'
+        count /= 1024
+    return f'{count:.1f} GB'
+
+def _clip(line: str, columns: int) -> str:
+    # Lines wider than the terminal would wrap and push everything below them down a line.
+    visible = len(_ANSI_ESCAPE.sub('', line))
+    if visible <= columns:
+        return line
+    clipped = []
+    remaining = columns
+    position = 0
+    for escape in _ANSI_ESCAPE.finditer(line):
+        text = line[position:escape.start()][:max(remaining, 0)]
+        clipped.append(text)
+        remaining -= len(text)
+        clipped.append(escape.group())
+        position = escape.end()
+    clipped.append(line[position:][:max(remaining, 0)])
+    return ''.join(clipped)
+
+def _render_credentials() -> list[str]:
+    if credentials.username is None and credentials.password is None:
+        return [f'{ANSI_FG_YELLOW}Not logged in.{ANSI_FG_RESET}']
+    return [f'{ANSI_FG_CYAN}Logged in as: {ANSI_FG_RESET}{credentials.username}']
+
+def _render_query() -> list[str]:
+    active_query = query.active_query
+    fields = [
+        ('Query', active_query.name),
+        ('API Base URL', active_query.api_base_url),
+        ('PI Server', active_query.pi_server),
+        ('Type', active_query.query_type.value),
+        ('Start Time', active_query.start_time),
+        ('End Time', active_query.end_time),
+        ('Tags', ', '.join(active_query.tags)),
+        ('Timezone', active_query.timezone)
+    ]
     if active_query.query_type == QueryType.SUMMARY:
-        print(f'{ANSI_FG_CYAN}Summary Type: {ANSI_FG_RESET}{active_query.summary_type.value}{ANSI_FG_RESET}')
-        print(f'{ANSI_FG_CYAN}Interval: {ANSI_FG_RESET}{active_query.interval}{ANSI_FG_RESET}')
-        print(f'{ANSI_FG_CYAN}Calculation Basis: {ANSI_FG_RESET}{active_query.calculation_basis.value}{ANSI_FG_RESET}')
-        print(f'{ANSI_FG_CYAN}Timestamp Calculation: {ANSI_FG_RESET}{active_query.timestamp_calculation.value}{ANSI_FG_RESET}')
-        QUERY_SECTION_HEIGHT = 12
+        fields.extend([
+            ('Summary Types', ', '.join([summary_type.value for summary_type in active_query.summary_types])),
+            ('Interval', active_query.interval),
+            ('Calculation Basis', active_query.calculation_basis.value),
+            ('Timestamp Calculation', active_query.timestamp_calculation.value)
+        ])
     if active_query.query_type == QueryType.INTERPOLATED:
-        print(f'{ANSI_FG_CYAN}Interval: {ANSI_FG_RESET}{active_query.interval}{ANSI_FG_RESET}')
-        QUERY_SECTION_HEIGHT = 9
+        fields.append(('Interval', active_query.interval))
     if active_query.query_type == QueryType.RECORDED:
-        print(f'{ANSI_FG_CYAN}Boundary Type: {ANSI_FG_RESET}{active_query.boundary_type.value}{ANSI_FG_RESET}')
-        QUERY_SECTION_HEIGHT = 9
-
-def _render_results():
-    # TODO: Anything but this...
-    global RESULTS_SECTION_HEIGHT
-    terminal_size = get_terminal_size()
-    print(f'{ANSI_FG_CYAN}{"─" * terminal_size.columns}{ANSI_FG_RESET}')
-    column_titles = list(pi.results[0].keys())
-    # Top border
-    print(f' ┌', end='')
-    for column in column_titles:
-        print(f'{"─" * (len(str.ljust(column, 25)) + 2)}', end='')
-        if column != column_titles[-1]:
-            print(f'┬', end='')
-    print(f'┐')
-    # Headers
-    print(' │', end='')
-    for column in column_titles:
-        print(f' {str.ljust(column, 25)} ', end='')
-        print(f'│', end='')
-    # Bottom header border
-    print(f'\n ├', end='')
-    for column in column_titles:
-        print(f'{"─" * (len(str.ljust(column, 25)) + 2)}', end='')
-        if column != column_titles[-1]:
-            print(f'┼', end='')
-    print(f'┤')
-    # Data
-    current_row = 0
-    for row in pi.results:
-        print(' │', end='')
-        for column in column_titles:
-            data = str(row[column])
-            if len(data) > len(str.ljust(column, 25)):
-                print(f' {data[:len(str.ljust(column, 25))]} ', end='')
-            else:
-                print(f' {str.ljust(data, len(str.ljust(column, 25)))} ', end='')
-            print(f'│', end='')
-        print()
-        current_row += 1
-        if current_row >= 9:
-            break
-    # Bottom border
-    print(f' └', end='')
-    for column in column_titles:
-        print(f'{"─" * (len(str.ljust(column, 25)) + 2)}', end='')
-        if column != column_titles[-1]:
-            print(f'┴', end='')
-    print(f'┘')
-    print()
-
-    RESULTS_SECTION_HEIGHT = 5 + min(len(pi.results), 10)
-
-def _render_log():
-    global LOG_SECTION_HEIGHT
-    terminal_size = get_terminal_size()
-    log_section_total_height = terminal_size.lines - CREDENTIALS_SECTION_HEIGHT - QUERY_SECTION_HEIGHT - PROMPT_SECTION_HEIGHT - RESULTS_SECTION_HEIGHT
-    print(f'{ANSI_FG_CYAN}{"─" * terminal_size.columns}{ANSI_FG_RESET}')
-    reversed_buffer = log_buffer[::-1]
-    for i, log in enumerate(reversed_buffer):
-        if i >= log_section_total_height:
-            break
-        if len(log) > terminal_size.columns:
-            print(log[:terminal_size.columns - 3] + '...')
-        else:
-            print(log)
-    LOG_SECTION_HEIGHT = len(log_buffer)
+        fields.append(('Boundary Type', active_query.boundary_type.value))
+    return [f'{ANSI_FG_CYAN}{name}: {ANSI_FG_RESET}{value}' for name, value in fields]
 
-def _reset_cursor():
-    print(ANSI_UP * (4 + LOG_SECTION_HEIGHT + RESULTS_SECTION_HEIGHT), end='')
\ No newline at end of file
+def _render_results(size: terminal_size, height: int) -> list[str]:
+    # Only the rows on screen are read and formatted, so the cost doesn't depend on the size of the result.
+    results = pi.active_results()
+    view.page_rows = max(1, min(len(results), height - TABLE_CHROME_HEIGHT))
+    start = view.clamp(len(results))
+    stop = min(start + view.page_rows, len(results))
+    columns = results.columns
+    rows = [[_format_cell(row[column]) for column in columns] for row in map(results.__getitem__, range(start, stop))]
+    widths = [min(MAX_COLUMN_WIDTH, max([len(column)] + [len(row[position]) for row in rows])) for position, column in enumerate(columns)]
+
+    lines = [f'{ANSI_FG_CYAN}{"─" * size.columns}{ANSI_FG_RESET}']
+    lines.append(' ┌' + '┬'.join(['─' * (width + 2) for width in widths]) + '┐')
+    lines.append(' │' + '│'.join([f' {_fit(column, width)} ' for column, width in zip(columns, widths)]) + '│')
+    lines.append(' ├' + '┼'.join(['─' * (width + 2) for width in widths]) + '┤')
+    for row in rows:
+        lines.append(' │' + '│'.join([f' {_fit(cell, width)} ' for cell, width in zip(row, widths)]) + '│')
+    lines.append(' └' + '┴'.join(['─' * (width + 2) for width in widths]) + '┘')
+    lines.append(f' Rows {start + 1:,}-{stop:,} of {len(results):,}. next, prev and goto <row> to scroll.')
+    return lines
+
+def _format_cell(value) -> str:
+    return '' if value is None else str(plain_value(value))
+
+def _fit(text: str, width: int) -> str:
+    if len(text) > width:
+        return text[:width - 1] + '…'
+    return text.ljust(width)
+
+def _render_log(size: terminal_size, height: int) -> list[str]:
+    if height < 1:
+        return []
+    lines = [f'{ANSI_FG_CYAN}{"─" * size.columns}{ANSI_FG_RESET}']
+    for message in log.tail(height - 1):
+        if len(message) > size.columns:
+            lines.append(message[:size.columns - 3] + '...')
+        else:
+            lines.append(message)
+    return lines
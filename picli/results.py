@@ -0,0 +1,246 @@
+from array import array
+from bisect import bisect_right
+from collections.abc import Mapping
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, Optional, Protocol
+
+from picli.errors import PICLIWebAPIError
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_NAIVE_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+_GOOD = 1
+_QUESTIONABLE = 2
+_SUBSTITUTED = 4
+_FLAGS_MISSING = 128
+
+class ValueSink(Protocol):
+    '''Anything query values can be streamed into, such as a ResultStore or an export writer.'''
+    def append(self, tag: str, values: list[dict]) -> None: ...
+
+class Series:
+    '''Values of a single tag (and summary type) held in typed arrays.'''
+    __slots__ = ['tag_code', 'summary_type', 'timestamps', 'utc_offsets', 'values', 'flags']
+
+    def __init__(self, tag_code: int, summary_type: Optional[str] = None):
+        self.tag_code = tag_code
+        self.summary_type = summary_type
+        self.timestamps = array('q') # Microseconds since the epoch, UTC
+        self.utc_offsets: Optional[array] = None # Minutes, only allocated once a timestamp isn't in UTC
+        self.values = array('q') # Promoted to doubles, then to a plain list, as less compact values show up
+        self.flags = array('B')
+
+    def __len__(self) -> int:
+        # Flags are appended last, so the length never runs ahead of a value still being added while follow
+        # appends to results that are on screen.
+        return len(self.flags)
+
+    def extend(self, values: list[dict]) -> None:
+        # Runs once per value on large pulls, so the lookups are bound to locals up front.
+        parse = parse_timestamp
+        append_timestamp = self.timestamps.append
+        append_flag = self.flags.append
+        append_value = self._append_value
+        for value in values:
+            micros, offset = parse(value.get('Timestamp'))
+            if offset != 0 and self.utc_offsets is None:
+                self.utc_offsets = array('h', bytes(2 * len(self.timestamps)))
+            if self.utc_offsets is not None:
+                self.utc_offsets.append(offset)
+            append_timestamp(micros)
+            append_value(value.get('Value'))
+            good, questionable, substituted = value.get('Good'), value.get('Questionable'), value.get('Substituted')
+            if good is None and questionable is None and substituted is None:
+                append_flag(_FLAGS_MISSING)
+            else:
+                append_flag((_GOOD if good else 0) | (_QUESTIONABLE if questionable else 0) | (_SUBSTITUTED if substituted else 0))
+
+    def _append_value(self, value) -> None:
+        value_type = type(value)
+        if value_type is float and self.values.__class__ is array and self.values.typecode == 'd':
+            self.values.append(value)
+            return
+        if isinstance(self.values, array):
+            if self.values.typecode == 'q' and value_type is int and -2**63 <= value < 2**63:
+                self.values.append(value)
+                return
+            if value_type is float or (value_type is int and self.values.typecode == 'd'):
+                if self.values.typecode == 'q':
+                    self.values = array('d', self.values)
+                self.values.append(value)
+                return
+            self.values = self.values.tolist()
+        self.values.append(value)
+
+    def timestamp(self, index: int) -> str:
+        time = _EPOCH + self.timestamps[index] * _MICROSECOND
+        offset = self.utc_offsets[index] if self.utc_offsets is not None else 0
+        if offset == 0:
+            return time.isoformat().replace('+00:00', 'Z')
+        return time.astimezone(timezone(timedelta(minutes=offset))).isoformat()
+
+    def flag(self, index: int, mask: int) -> Optional[bool]:
+        flags = self.flags[index]
+        if flags & _FLAGS_MISSING:
+            return None
+        return bool(flags & mask)
+
+class Row(Mapping):
+    '''A lazy, read-only view of one row of a ResultStore.'''
+    __slots__ = ['_store', '_series', '_index']
+
+    def __init__(self, store: 'ResultStore', series: Series, index: int):
+        self._store = store
+        self._series = series
+        self._index = index
+
+    def __getitem__(self, column: str):
+        if column == 'Tag':
+            return self._store.tags[self._series.tag_code]
+        if column == 'Type' and self._store.has_summary_types:
+            return self._series.summary_type
+        if column == 'Timestamp':
+            return self._series.timestamp(self._index)
+        if column == 'Value':
+            return self._series.values[self._index]
+        if column == 'Good':
+            return self._series.flag(self._index, _GOOD)
+        if column == 'Questionable':
+            return self._series.flag(self._index, _QUESTIONABLE)
+        if column == 'Substituted':
+            return self._series.flag(self._index, _SUBSTITUTED)
+        raise KeyError(column)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._store.columns)
+
+    def __len__(self) -> int:
+        return len(self._store.columns)
+
+class ResultStore:
+    '''Columnar query results: a dictionary encoded tag column and per tag typed arrays, read through lazy rows.'''
+    def __init__(self):
+        self.tags: list[str] = []
+        self.has_summary_types = False
+        self._tag_codes: dict[str, int] = {}
+        self._series: list[Series] = []
+        self._series_by_key: dict[tuple[int, Optional[str]], Series] = {}
+        self._starts: Optional[list[int]] = None
+
+    @property
+    def columns(self) -> list[str]:
+        if self.has_summary_types:
+            return ['Tag', 'Type', 'Timestamp', 'Value', 'Good', 'Questionable', 'Substituted']
+        return ['Tag', 'Timestamp', 'Value', 'Good', 'Questionable', 'Substituted']
+
+    def append(self, tag: str, values: Iterable[dict]) -> None:
+        '''Adds PI Web API values for a tag. Summary values are told apart by their Type.'''
+        tag_code = self._tag_codes.get(tag)
+        if tag_code is None:
+            tag_code = self._tag_codes[tag] = len(self.tags)
+            self.tags.append(tag)
+        values_by_type: dict[Optional[str], list[dict]] = {}
+        for value in values:
+            values_by_type.setdefault(value.get('Type'), []).append(value)
+        for summary_type, typed_values in values_by_type.items():
+            series = self._series_by_key.get((tag_code, summary_type))
+            if series is None:
+                series = self._series_by_key[(tag_code, summary_type)] = Series(tag_code, summary_type)
+                self._series.append(series)
+                self.has_summary_types = self.has_summary_types or summary_type is not None
+            series.extend(typed_values)
+        self._starts = None
+
+    def _index(self) -> list[int]:
+        # Row offset of each series, followed by the total row count
+        starts = self._starts
+        if starts is None:
+            starts = [0]
+            for series in self._series:
+                starts.append(starts[-1] + len(series))
+            self._starts = starts
+        return starts
+
+    def __len__(self) -> int:
+        return self._index()[-1]
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __getitem__(self, index: int) -> Row:
+        starts = self._index()
+        if index < 0:
+            index += starts[-1]
+        if not 0 <= index < starts[-1]:
+            raise IndexError('Result index out of range.')
+        position = bisect_right(starts, index) - 1
+        return Row(self, self._series[position], index - starts[position])
+
+    def __iter__(self) -> Iterator[Row]:
+        for series in self._series:
+            for index in range(len(series)):
+                yield Row(self, series, index)
+
+    def to_numpy(self) -> dict:
+        '''Returns the results as a dict of NumPy arrays, one per column. Requires numpy.'''
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('NumPy export requires numpy. Install it with pip install picli[numpy].')
+        lengths = [len(series) for series in self._series]
+        columns = {'Tag': numpy.array(self.tags, dtype=object)[self._tag_code_column(numpy)]}
+        if self.has_summary_types:
+            columns['Type'] = numpy.repeat(numpy.array([series.summary_type for series in self._series], dtype=object), lengths)
+        columns['Timestamp'] = numpy.concatenate([numpy.frombuffer(series.timestamps, dtype=numpy.int64) for series in self._series] or [numpy.empty(0, dtype=numpy.int64)]).astype('datetime64[us]')
+        if all(isinstance(series.values, array) for series in self._series):
+            columns['Value'] = numpy.concatenate([numpy.asarray(series.values, dtype=numpy.float64) for series in self._series] or [numpy.empty(0)])
+        else:
+            columns['Value'] = numpy.array([value for series in self._series for value in series.values], dtype=object)
+        flags = numpy.concatenate([numpy.frombuffer(series.flags, dtype=numpy.uint8) for series in self._series] or [numpy.empty(0, dtype=numpy.uint8)])
+        columns['Good'] = (flags & _GOOD) != 0
+        columns['Questionable'] = (flags & _QUESTIONABLE) != 0
+        columns['Substituted'] = (flags & _SUBSTITUTED) != 0
+        return columns
+
+    def to_pandas(self):
+        '''Returns the results as a pandas DataFrame with a categorical Tag column. Requires pandas.'''
+        try:
+            import pandas
+        except ImportError:
+            raise ImportError('pandas export requires pandas. Install it with pip install picli[pandas].')
+        import numpy
+        columns = self.to_numpy()
+        columns['Tag'] = pandas.Categorical.from_codes(self._tag_code_column(numpy), categories=self.tags)
+        return pandas.DataFrame(columns)
+
+    def _tag_code_column(self, numpy):
+        return numpy.repeat(numpy.array([series.tag_code for series in self._series], dtype=numpy.int32), [len(series) for series in self._series])
+
+def parse_timestamp(text: str) -> tuple[int, int]:
+    '''Parses a PI Web API timestamp into microseconds since the epoch and its UTC offset in minutes.'''
+    # Fast path for the UTC timestamps the PI Web API returns by default
+    if text is not None and text[-1:] == 'Z':
+        try:
+            return (datetime.fromisoformat(text[:-1]) - _NAIVE_EPOCH) // _MICROSECOND, 0
+        except ValueError:
+            pass
+    try:
+        time = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        try:
+            from dateutil.parser import isoparse
+            time = isoparse(text)
+        except (ValueError, TypeError):
+            raise PICLIWebAPIError(f'Unexpected timestamp {text} in PI Web API response.')
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    offset = time.utcoffset()
+    return (time - _EPOCH) // _MICROSECOND, int(offset.total_seconds() // 60)
+
+def plain_value(value):
+    '''Returns the name of a digital state value, or the value itself for anything else.'''
+    # Digital states come back as objects, the state name is what's useful in a flat file or a table.
+    if isinstance(value, dict) and 'Name' in value:
+        return value['Name']
+    return value
@@ -0,0 +1,172 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from time import time
+from typing import Optional, TYPE_CHECKING
+import json
+import os
+import zlib
+
+from picli import config
+from picli.commands import register_command
+from picli.errors import PICLIInitError
+from picli.log import info, debug
+from picli.results import parse_timestamp
+
+if TYPE_CHECKING:
+    from sqlite3 import Connection
+
+# Values are only cached up to this long before the time they were fetched. Newer ones may still
+# change as the archive catches up, so they're fetched again by the next query.
+RECENT_DATA_WINDOW = timedelta(minutes=10)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Each segment holds every value of one series between its start and end, both included, as
+# compressed JSON. A query reads the segments overlapping its range and only fetches the gaps.
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    series TEXT NOT NULL,
+    start_us INTEGER NOT NULL,
+    end_us INTEGER NOT NULL,
+    value_count INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_by_series ON segments (series, start_us);
+'''
+
+_connection: Optional['Connection'] = None
+_lock = Lock()
+
+@dataclass
+class Piece:
+    '''Part of a requested range, either covered by a cached segment or still to be fetched.'''
+    start_us: int
+    end_us: int
+    segment_id: Optional[int] = None
+
+def _cache_path() -> str:
+    return config.get_data_path('series_cache.sqlite')
+
+def _connect() -> 'Connection':
+    global _connection
+    if _connection is None:
+        import sqlite3
+        cache_path = _cache_path()
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Segments are written from the workers fetching them, every use goes through _lock.
+            _connection = sqlite3.connect(cache_path, check_same_thread=False, isolation_level=None)
+            _connection.executescript(_SCHEMA)
+        except sqlite3.Error:
+            _connection = None
+            raise PICLIInitError(f'Could not open series cache at {cache_path}.')
+    return _connection
+
+def enabled() -> bool:
+    return config.series_cache_size > 0
+
+def series_key(api_base_url: str, web_id: str, *parameters) -> str:
+    '''Identifies a series: a tag's values for one kind of query, with every parameter that changes them.'''
+    return '|'.join([api_base_url, web_id] + [str(parameter) for parameter in parameters])
+
+def to_micros(time: datetime) -> int:
+    return (time - _EPOCH) // _MICROSECOND
+
+def to_time(micros: int) -> datetime:
+    return _EPOCH + micros * _MICROSECOND
+
+def settled_until(now: datetime) -> int:
+    '''Returns the latest time, in microseconds, that values fetched at now can be cached up to.'''
+    return to_micros(now - RECENT_DATA_WINDOW)
+
+def plan(series: str, start_us: int, end_us: int) -> list[Piece]:
+    '''Splits a range into pieces in time order: the parts cached segments cover and the gaps between them.'''
+    with _lock:
+        connection = _connect()
+        segments = connection.execute(
+            'SELECT id, start_us, end_us FROM segments WHERE series = ? AND start_us < ? AND end_us > ? ORDER BY start_us',
+            (series, end_us, start_us)
+        ).fetchall()
+        if segments:
+            connection.execute(f'UPDATE segments SET last_used = ? WHERE id IN ({",".join("?" * len(segments))})', (time(), *[segment[0] for segment in segments]))
+    pieces = []
+    cursor = start_us
+    for segment_id, segment_start, segment_end in segments:
+        if segment_end <= cursor:
+            continue # Overlaps one already used
+        if segment_start > cursor:
+            pieces.append(Piece(cursor, segment_start))
+        pieces.append(Piece(max(cursor, segment_start), min(segment_end, end_us), segment_id))
+        cursor = min(segment_end, end_us)
+        if cursor >= end_us:
+            break
+    if cursor < end_us or not pieces:
+        pieces.append(Piece(cursor, end_us))
+    return pieces
+
+def read(piece: Piece) -> list[dict]:
+    '''Returns the cached values inside a piece, in time order.'''
+    with _lock:
+        row = _connect().execute('SELECT data FROM segments WHERE id = ?', (piece.segment_id,)).fetchone()
+    if row is None:
+        raise PICLIInitError('Cached values were removed by another picli while being read. Run the query again.')
+    values = json.loads(zlib.decompress(row[0]))
+    # Values are in time order, so only the ones at either end can be outside the piece.
+    first = 0
+    while first < len(values) and parse_timestamp(values[first].get('Timestamp'))[0] < piece.start_us:
+        first += 1
+    last = len(values)
+    while last > first and parse_timestamp(values[last - 1].get('Timestamp'))[0] > piece.end_us:
+        last -= 1
+    return values[first:last]
+
+def write(series: str, start_us: int, end_us: int, values: list[dict]) -> None:
+    '''Caches the values fetched for a range. Values after end_us are left out.'''
+    count = len(values)
+    while count and parse_timestamp(values[count - 1].get('Timestamp'))[0] > end_us:
+        count -= 1
+    values = values[:count]
+    data = zlib.compress(json.dumps(values, separators=(',', ':')).encode(), 1)
+    with _lock:
+        _connect().execute(
+            'INSERT INTO segments (series, start_us, end_us, value_count, size, last_used, data) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (series, start_us, end_us, len(values), len(data), time(), data)
+        )
+
+def trim() -> None:
+    '''Evicts the least recently used segments until the cache fits in series_cache_size.'''
+    limit = config.series_cache_size * 1024 * 1024
+    with _lock:
+        connection = _connect()
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM segments').fetchone()[0]
+        if total <= limit:
+            return
+        evicted = []
+        for segment_id, size in connection.execute('SELECT id, size FROM segments ORDER BY last_used').fetchall():
+            if total <= limit:
+                break
+            evicted.append(segment_id)
+            total -= size
+        connection.executemany('DELETE FROM segments WHERE id = ?', [(segment_id,) for segment_id in evicted])
+    debug(f'Evicted {len(evicted)} segments from the series cache')
+
+def clear_cache() -> None:
+    '''Clears all cached values.'''
+    info('Clearing series cache.')
+    with _lock:
+        connection = _connect()
+        connection.execute('DELETE FROM segments')
+        connection.execute('VACUUM')
+register_command(clear_cache, ['cache', 'values', 'clear'])
+
+def show_cache() -> None:
+    '''Logs how many values are cached and how much space they take.'''
+    with _lock:
+        series, segments, values, size = _connect().execute('SELECT COUNT(DISTINCT series), COUNT(*), COALESCE(SUM(value_count), 0), COALESCE(SUM(size), 0) FROM segments').fetchone()
+    info(f'Series cache: {values:,} values of {series:,} series in {segments:,} segments, {size / 1024 / 1024:.1f} of {config.series_cache_size} MB.')
+register_command(show_cache, ['cache', 'values', 'show'])
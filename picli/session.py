@@ -0,0 +1,110 @@
+from os import path
+from typing import Optional, TYPE_CHECKING
+import json
+
+from picli import config, credentials
+from picli.config import AuthMethod, Compression
+from picli.errors import PICLIConfigError, PICLIValidationError
+from picli.log import debug
+
+# requests takes longer to import than the rest of picli put together, so it's only imported once a request is made.
+if TYPE_CHECKING:
+    from requests import Response, Session
+
+COMPRESS_MIN_BYTES = 16 * 1024 # Request bodies smaller than this aren't worth compressing
+
+_session: Optional['Session'] = None
+_session_key: Optional[tuple] = None
+# Turned off for the rest of the session if the PI Web API turns a compressed request body down.
+_compress_requests = True
+
+def get_session() -> 'Session':
+    '''Returns the shared HTTP session, rebuilding it if the connection settings have changed.'''
+    global _session, _session_key
+    key = (config.tls_cert_path, config.pool_connections, config.pool_maxsize, config.compression)
+    if _session is None or _session_key != key:
+        close_session()
+        _session = _build_session()
+        _session_key = key
+    _session.auth = _get_auth()
+    return _session
+
+def close_session() -> None:
+    '''Closes the shared HTTP session and all of its pooled connections.'''
+    global _session, _session_key, _compress_requests
+    if _session is not None:
+        debug('Closing HTTP session')
+        _session.close()
+    _session = None
+    _session_key = None
+    _compress_requests = True
+
+def post_json(session: 'Session', url: str, body: dict, stream: bool = False) -> 'Response':
+    '''POSTs a JSON body, gzipped if it's large and compression allows it.'''
+    global _compress_requests
+    data = json.dumps(body).encode()
+    headers = {'Content-Type': 'application/json'}
+    if config.compression == Compression.GZIP and _compress_requests and len(data) >= COMPRESS_MIN_BYTES:
+        import gzip
+        response = session.post(url, data=gzip.compress(data, compresslevel=6), headers={**headers, 'Content-Encoding': 'gzip'}, stream=stream)
+        if response.status_code not in [400, 415]:
+            return response
+        response.close()
+        debug(f'PI Web API turned down a compressed request body with status {response.status_code}, sending them uncompressed from now on')
+        _compress_requests = False
+    return session.post(url, data=data, headers=headers, stream=stream)
+
+def sent_bytes(response: 'Response') -> int:
+    '''Returns the size of the request body as sent, after any compression.'''
+    body = response.request.body
+    return len(body) if body is not None else 0
+
+def wire_bytes(response: 'Response') -> int:
+    '''Returns how many bytes of the response body came over the network, before decompression. Read the body first.'''
+    try:
+        return response.raw.tell()
+    except (AttributeError, ValueError):
+        return len(response.content)
+
+def _build_session() -> 'Session':
+    from ssl import create_default_context
+    from requests import Session
+    from picli.adapters import PooledAdapter
+    debug('Creating HTTP session')
+    debug(f'TLS Cert Path: {config.tls_cert_path}')
+    debug(f'Pool connections: {config.pool_connections}, pool max size: {config.pool_maxsize}')
+    ssl_context = None
+    if config.tls_cert_path is not None:
+        try:
+            if path.isdir(config.tls_cert_path):
+                ssl_context = create_default_context(capath=config.tls_cert_path)
+            else:
+                ssl_context = create_default_context(cafile=config.tls_cert_path)
+        except OSError:
+            raise PICLIConfigError(f'Could not load TLS certificate from {config.tls_cert_path}.')
+    adapter = PooledAdapter(
+        ssl_context=ssl_context,
+        pool_connections=config.pool_connections,
+        pool_maxsize=config.pool_maxsize
+    )
+    session = Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['X-Requested-With'] = ''
+    # Batch responses are very repetitive JSON, gzip usually shrinks them to a tenth or less.
+    session.headers['Accept-Encoding'] = 'identity' if config.compression == Compression.NONE else 'gzip, deflate'
+    return session
+
+def _get_auth():
+    debug('Getting authentication method')
+    debug(f'Auth method: {config.auth_method}')
+    if config.auth_method == AuthMethod.BASIC:
+        debug('Using basic authentication')
+        debug(f'Username: {credentials.username}')
+        debug(f'Password: {credentials.password}')
+        from requests.auth import HTTPBasicAuth
+        return HTTPBasicAuth(credentials.username, credentials.password)
+    elif config.auth_method == AuthMethod.NTLM:
+        raise NotImplementedError('Windows authentication not yet implemented.')
+    else:
+        raise PICLIValidationError(f'Unsupported authentication method: {config.auth_method}.')
@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+from copy import deepcopy
+from os import path
+from typing import Iterator, Optional
+import json
+import os
+import tempfile
+
+from picli import config
+from picli.errors import PICLIInitError, PICLIShutdownError
+from picli.log import debug
+
+# The saved fields of each query as this process last read or wrote them. Saving compares the queries
+# to it, so nothing is written unless a field changed, and only the fields that changed are merged into
+# the save file as it is on disk then. picli processes sharing a save file keep each other's changes.
+_saved: Optional[dict[str, dict]] = None
+
+def _save_path() -> str:
+    return config.get_data_path('save.json')
+
+def load() -> dict[str, dict]:
+    '''Returns the saved fields of each query by name, reading the save file the first time.'''
+    global _saved
+    if _saved is None:
+        with _locked():
+            _saved = _read() or {}
+    return deepcopy(_saved)
+
+def save(queries: dict[str, dict]) -> bool:
+    '''Writes the fields that changed since the last load or save, and drops removed queries. Returns whether anything was written.'''
+    global _saved
+    saved = load()
+    changes = {}
+    for name, fields in queries.items():
+        saved_fields = saved.get(name)
+        if saved_fields is None:
+            changes[name] = fields
+            continue
+        changed_fields = {field: value for field, value in fields.items() if field not in saved_fields or saved_fields[field] != value}
+        if changed_fields:
+            changes[name] = changed_fields
+    removed = [name for name in saved if name not in queries]
+    if not changes and not removed:
+        return False
+    with _locked():
+        contents = _read() or {}
+        for name in removed:
+            contents.pop(name, None)
+        for name, fields in changes.items():
+            contents.setdefault(name, {}).update(fields)
+        _write(contents)
+    debug(f'Saved {", ".join(changes) or "nothing"} and removed {", ".join(removed) or "nothing"} in the save file')
+    _saved = deepcopy(queries)
+    return True
+
+def _read() -> Optional[dict]:
+    save_path = _save_path()
+    try:
+        with open(save_path, 'r') as file:
+            return json.loads(file.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        raise PICLIInitError(f'Could not read save file at {save_path}.')
+
+def _write(contents: dict) -> None:
+    # Written to a temporary file that replaces the save file in one step, so a reader never sees half
+    # of it and a crash while writing leaves the last save in place.
+    save_path = _save_path()
+    try:
+        os.makedirs(path.dirname(save_path), exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(prefix='save.', suffix='.tmp', dir=path.dirname(save_path))
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                file.write(json.dumps(contents, indent=4))
+            os.replace(temporary_path, save_path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+    except OSError:
+        raise PICLIShutdownError(f'Could not write save file at {save_path}.')
+
+@contextmanager
+def _locked() -> Iterator[None]:
+    '''Holds a lock on the save file between reading and writing it, where the platform has file locks.'''
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    lock_path = f'{_save_path()}.lock'
+    try:
+        os.makedirs(path.dirname(lock_path), exist_ok=True)
+        lock_file = open(lock_path, 'a')
+    except OSError:
+        yield # Read-only data directory, saving will report it
+        return
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
@@ -0,0 +1,199 @@
+from time import monotonic, perf_counter
+from typing import Optional
+from urllib.parse import quote
+
+from picli import config, engine, task, trace, webid_cache
+from picli.errors import PICLIStaleWebIdError, PICLIWebAPIError
+from picli.log import info, debug, debug_enabled, warning
+from picli.session import get_session, post_json, sent_bytes, wire_bytes
+
+WILDCARDS = '*?'
+MIN_PREFIX_LENGTH = 3 # Shortest shared prefix that names are looked up together under
+MAX_PREFIX_PAGES = 5 # Pages read for a shared prefix before falling back to looking its names up one by one
+
+def is_pattern(tag: str) -> bool:
+    return any(character in tag for character in WILDCARDS)
+
+def resolve(api_base_url: str, pi_server: str, server_web_id: str, tags: list[str], budget: Optional[engine.RetryBudget] = None) -> dict[str, str]:
+    '''Resolves tag names and patterns to Web IDs, in order, with patterns expanded to the tags they match.
+
+    Names are looked up in the local index first. The rest are fetched with points?nameFilter, names
+    sharing a prefix together under one filter, so a long list of similar tags takes a few paged requests.
+    Tags that can't be resolved are warned about and left out, unless none of the tags could be.
+    '''
+    patterns = {}
+    for tag in tags:
+        if is_pattern(tag):
+            patterns[tag] = webid_cache.get_pattern(api_base_url, pi_server, tag)
+    names = [tag for tag in dict.fromkeys(tags) if not is_pattern(tag)]
+    for pattern_tags in patterns.values():
+        names.extend(pattern_tags or [])
+    web_ids = webid_cache.find_tags(api_base_url, pi_server, names)
+
+    pattern_filters = [pattern for pattern, pattern_tags in patterns.items() if pattern_tags is None]
+    missing_names = [name for name in names if name not in web_ids]
+    if pattern_filters or missing_names:
+        info(f'Getting Web IDs for {len(missing_names)} tags and {len(pattern_filters)} patterns from PI Web API.')
+        points, failed_filters = _fetch(api_base_url, server_web_id, pattern_filters, missing_names, budget or engine.RetryBudget())
+        webid_cache.put_tags(api_base_url, pi_server, points)
+        by_upper_name = {name.upper(): web_id for name, web_id in points.items()}
+        for name in missing_names:
+            if name.upper() in by_upper_name:
+                web_ids[name] = by_upper_name[name.upper()]
+        for pattern in pattern_filters:
+            patterns[pattern] = sorted([name for name in points if _matches(pattern, name)], key=str.upper)
+            if pattern in failed_filters:
+                continue # Only some of its matches may have been read, so it isn't cached.
+            webid_cache.put_pattern(api_base_url, pi_server, pattern, patterns[pattern])
+            web_ids.update({name: points[name] for name in patterns[pattern]})
+    else:
+        failed_filters = set()
+        debug('Using cached Web IDs for all tags')
+
+    resolved = {}
+    not_found = []
+    failed = [] # Tags whose lookups failed even after retrying, rather than finding nothing
+    for tag in tags:
+        if is_pattern(tag):
+            if tag in failed_filters:
+                failed.append(tag)
+            elif not patterns[tag]:
+                info(f'No tags match {tag}.')
+            for name in patterns[tag]:
+                if name in web_ids:
+                    resolved.setdefault(name, web_ids[name])
+        elif tag in web_ids:
+            resolved.setdefault(tag, web_ids[tag])
+        elif tag in failed_filters:
+            failed.append(tag)
+        else:
+            not_found.append(tag)
+    if failed:
+        if not resolved:
+            raise PICLIWebAPIError(f'Error getting Web IDs for {", ".join(dict.fromkeys(failed))}. PI Web API did not answer after retrying.')
+        warning(f'Leaving out tags PI Web API did not answer for after retrying: {", ".join(dict.fromkeys(failed))}.')
+    if not_found:
+        if not resolved:
+            raise PICLIWebAPIError(f'Error getting Web IDs for {", ".join(dict.fromkeys(not_found))}. Likely incorrect tag names.')
+        warning(f'Leaving out tags that could not be found: {", ".join(dict.fromkeys(not_found))}. Likely incorrect tag names.')
+    return resolved
+
+def _fetch(api_base_url: str, server_web_id: str, patterns: list[str], names: list[str], budget: engine.RetryBudget) -> tuple[dict[str, str], set[str]]:
+    '''Fetches the points matching the patterns and names, a page of each filter per sub-request.
+
+    Failed sub-requests are retried on their own after a growing delay, like failed units of values.
+    Returns the points and the patterns and names whose filters still failed.
+    '''
+    points = {}
+    failed_filters = set()
+    # (name filter, page, names still wanted from it or None to read every page, retries so far)
+    requests = [(pattern, 0, None, 0) for pattern in patterns]
+    for prefix, group in _group_by_prefix(names):
+        if len(group) == 1:
+            requests.append((group[0], 0, None, 0))
+        else:
+            requests.append((f'{prefix}*', 0, group, 0))
+    # (when, request) of failed requests waiting to be retried
+    delayed = []
+
+    while requests or delayed:
+        ready = [request for when, request in delayed if when <= monotonic()]
+        delayed = [(when, request) for when, request in delayed if when > monotonic()]
+        requests.extend(ready)
+        if not requests:
+            task.pause(min(when for when, _ in delayed) - monotonic())
+            continue
+        chunk, requests = requests[:config.batch_size], requests[config.batch_size:]
+        for (name_filter, page, group, attempts), (status, items) in zip(chunk, _post_batch(api_base_url, server_web_id, chunk)):
+            if status != 200:
+                if engine.retryable(status) and attempts < config.max_retries and budget.spend():
+                    delay = engine.backoff_delay(attempts)
+                    debug(f'Retrying {name_filter} in {delay:.1f}s (status {status})')
+                    trace.add('tag resolution', retries=1)
+                    delayed.append((monotonic() + delay, (name_filter, page, group, attempts + 1)))
+                else:
+                    debug(f'Could not get Web IDs for {name_filter} (status {status})')
+                    failed_filters.update([name_filter] if group is None else group)
+                continue
+            page_points = {item['Name']: item['WebId'] for item in items if item.get('Name') is not None and item.get('WebId') is not None}
+            points.update(page_points)
+            if len(items) < config.page_size:
+                continue
+            if group is None:
+                requests.append((name_filter, page + 1, None, 0))
+                continue
+            upper_names = {name.upper() for name in points}
+            remaining = [name for name in group if name.upper() not in upper_names]
+            if not remaining:
+                continue
+            if page + 1 < MAX_PREFIX_PAGES:
+                requests.append((name_filter, page + 1, remaining, 0))
+            else:
+                # The prefix matches far more points than were asked for, look the rest up by name.
+                debug(f'{name_filter} matches too many points, looking up {len(remaining)} tags by name')
+                requests.extend([(name, 0, None, 0) for name in remaining])
+    return points, failed_filters
+
+def _post_batch(api_base_url: str, server_web_id: str, requests: list[tuple]) -> list[tuple[Optional[int], list[dict]]]:
+    '''Returns the status and items of each request, with no status for all of them if the batch itself failed.'''
+    from requests.exceptions import RequestException
+    body = {}
+    for index, (name_filter, page, _, _) in enumerate(requests):
+        body[str(index)] = {
+            'Method': 'GET',
+            'Resource': f'{api_base_url}/dataservers/{server_web_id}/points?nameFilter={quote(name_filter)}&startIndex={page * config.page_size}&maxCount={config.page_size}&selectedFields=Items.Name;Items.WebId'
+        }
+    task.check_cancelled()
+    started = perf_counter()
+    try:
+        response = post_json(get_session(), f'{api_base_url}/batch', body)
+    except RequestException as e:
+        debug(f'Error getting Web IDs for tags: {e}')
+        return [(None, [])] * len(requests)
+    trace.record('tag resolution', started, bytes=len(response.content), wire_bytes=wire_bytes(response), sent_bytes=sent_bytes(response), requests=1)
+    task.add_bytes(len(response.content))
+    debug(f'Request URL: {response.url}')
+    debug(f'Response Status Code: {response.status_code}')
+    if debug_enabled():
+        debug(f'Request Body: {response.request.body}')
+        debug(f'Response Content: {response.text}')
+
+    if response.status_code != 207:
+        if not engine.retryable(response.status_code):
+            raise PICLIWebAPIError(f'Error getting Web IDs for tags.')
+        return [(response.status_code, [])] * len(requests)
+
+    sub_responses = response.json()
+    pages = []
+    for index in range(len(requests)):
+        sub_response = sub_responses.get(str(index), {})
+        if sub_response.get('Status') == 404:
+            raise PICLIStaleWebIdError(f'PI Web API did not recognize server Web ID {server_web_id}.')
+        if sub_response.get('Status') != 200:
+            pages.append((sub_response.get('Status'), []))
+            continue
+        pages.append((200, sub_response.get('Content', {}).get('Items') or []))
+    return pages
+
+def _group_by_prefix(names: list[str]) -> list[tuple[str, list[str]]]:
+    '''Groups names that share a prefix of at least MIN_PREFIX_LENGTH characters, so each group takes one filter.'''
+    groups = []
+    for name in sorted(set(names), key=str.upper):
+        if groups:
+            prefix = _common_prefix(groups[-1][0], name)
+            if len(prefix) >= MIN_PREFIX_LENGTH and not is_pattern(prefix):
+                groups[-1] = (prefix, groups[-1][1] + [name])
+                continue
+        groups.append((name, [name]))
+    return groups
+
+def _common_prefix(first: str, second: str) -> str:
+    length = 0
+    while length < min(len(first), len(second)) and first[length].upper() == second[length].upper():
+        length += 1
+    return first[:length]
+
+def _matches(pattern: str, name: str) -> bool:
+    # Same rules as a PI name filter: * matches any run of characters, ? any one, case is ignored.
+    from fnmatch import fnmatchcase
+    return fnmatchcase(name.upper(), pattern.upper().replace('[', '[[]'))
@@ -0,0 +1,133 @@
+from dataclasses import dataclass, field
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable, Optional
+
+from picli.commands import register_command
+from picli.errors import PICLICancelledError, PICLICommandError
+from picli.log import info
+
+@dataclass
+class Progress:
+    '''Counters a background query updates as it runs, for the renderer to show.'''
+    description: str
+    state: str = 'running' # running, done, cancelled or failed
+    tags_total: int = 0
+    tags_done: int = 0
+    pages_done: int = 0
+    bytes_received: int = 0
+    started_at: float = field(default_factory=monotonic)
+    finished_at: Optional[float] = None
+    error: Optional[Exception] = None # Why it failed
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or monotonic()) - self.started_at
+
+# Progress of the running task, or the last one to finish. None until something runs in the background,
+# so queries run in the foreground, like headless ones, don't count anything.
+progress: Optional[Progress] = None
+
+_thread: Optional[Thread] = None
+_cancel = Event()
+_lock = Lock()
+_responses: set = set()
+
+def start(description: str, target: Callable[[], None]) -> None:
+    '''Runs target in a background thread. Only one task runs at a time.'''
+    global progress, _thread
+    if running():
+        raise PICLICommandError(f'{progress.description} is still running. Wait for it or cancel it first.')
+    _cancel.clear()
+    progress = Progress(description)
+    _thread = Thread(target=_run, args=(progress, target), name='picli-task', daemon=True)
+    _thread.start()
+
+def _run(task_progress: Progress, target: Callable[[], None]) -> None:
+    try:
+        target()
+        task_progress.state = 'done'
+    except PICLICancelledError as e:
+        task_progress.state = 'cancelled'
+        info(e)
+    except Exception as e:
+        task_progress.state = 'failed'
+        task_progress.error = e
+        info(e)
+    finally:
+        # A cancel only applies to the task it was meant for, not to queries run in the foreground after it.
+        with _lock:
+            task_progress.finished_at = monotonic()
+            _cancel.clear()
+
+def running() -> bool:
+    return _thread is not None and _thread.is_alive()
+
+def wait() -> None:
+    '''Blocks until the background task, if any, has finished.'''
+    if _thread is not None:
+        _thread.join()
+
+def cancel() -> None:
+    '''Cancels the running query, aborting its in-flight requests.'''
+    with _lock:
+        # Checked under the lock, so a task finishing right now can't leave the cancel set behind it.
+        cancelling = running() and progress.finished_at is None
+        if cancelling:
+            _cancel.set()
+            responses = list(_responses)
+    if not cancelling:
+        info('Nothing to cancel.')
+        return
+    info(f'Cancelling {progress.description.lower()}.')
+    # Closing a streamed response makes the worker reading it stop at its next read.
+    for response in responses:
+        response.close()
+register_command(cancel, ['cancel'])
+
+def pause(seconds: float) -> None:
+    '''Waits between rounds of a task, raising PICLICancelledError as soon as it's cancelled.'''
+    _cancel.wait(seconds)
+    check_cancelled()
+
+def cancelled() -> bool:
+    return _cancel.is_set()
+
+def check_cancelled() -> None:
+    '''Raises PICLICancelledError if the running task has been cancelled.'''
+    if _cancel.is_set():
+        raise PICLICancelledError('Query cancelled.')
+
+def track(response) -> None:
+    '''Registers a streamed response so cancel can close it.'''
+    with _lock:
+        _responses.add(response)
+    if _cancel.is_set():
+        response.close()
+
+def untrack(response) -> None:
+    with _lock:
+        _responses.discard(response)
+
+def add_bytes(count: int) -> None:
+    if progress is not None and progress.state == 'running':
+        with _lock:
+            progress.bytes_received += count
+
+def add_tags(total: int = 0, done: int = 0) -> None:
+    if progress is not None and progress.state == 'running':
+        with _lock:
+            progress.tags_total += total
+            progress.tags_done += done
+
+def new_round() -> None:
+    '''Counts tags from zero again, for tasks that fetch the same tags over and over.'''
+    if progress is not None and progress.state == 'running':
+        with _lock:
+            progress.tags_total = 0
+            progress.tags_done = 0
+
+def add_pages(count: int) -> None:
+    if progress is not None and progress.state == 'running':
+        with _lock:
+            progress.pages_done += count
@@ -0,0 +1,117 @@
+from dataclasses import dataclass, asdict
+from threading import Lock, get_native_id
+from time import perf_counter
+from typing import Optional
+import json
+import os
+
+from picli.commands import register_command
+from picli.log import info
+
+MAX_EVENTS = 100_000
+
+@dataclass
+class Span:
+    '''Totals for one phase of a query.'''
+    name: str
+    calls: int = 0
+    seconds: float = 0.0
+    bytes: int = 0 # Decoded, as picli reads them
+    wire_bytes: int = 0 # Received over the network, before decompression
+    sent_bytes: int = 0
+    requests: int = 0
+    retries: int = 0
+
+class Trace:
+    '''Timing spans for one query. Spans are totalled per phase, and each timed call is also kept as a trace event.'''
+    def __init__(self):
+        self.started_at = perf_counter()
+        self.finished_at: Optional[float] = None
+        self.spans: dict[str, Span] = {}
+        self.events: list[dict] = []
+        self._lock = Lock()
+
+    def record(self, name: str, started: float, bytes: int = 0, wire_bytes: int = 0, sent_bytes: int = 0, requests: int = 0, retries: int = 0, seconds: Optional[float] = None) -> None:
+        if seconds is None:
+            seconds = perf_counter() - started
+        with self._lock:
+            span = self._span(name)
+            span.calls += 1
+            span.seconds += seconds
+            span.bytes += bytes
+            span.wire_bytes += wire_bytes
+            span.sent_bytes += sent_bytes
+            span.requests += requests
+            span.retries += retries
+            if len(self.events) < MAX_EVENTS:
+                self.events.append({
+                    'name': name,
+                    'ph': 'X',
+                    'ts': (started - self.started_at) * 1e6,
+                    'dur': seconds * 1e6,
+                    'pid': os.getpid(),
+                    'tid': get_native_id(),
+                    'args': {'bytes': bytes, 'wire_bytes': wire_bytes, 'sent_bytes': sent_bytes, 'requests': requests, 'retries': retries}
+                })
+
+    def add(self, name: str, bytes: int = 0, requests: int = 0, retries: int = 0) -> None:
+        with self._lock:
+            span = self._span(name)
+            span.bytes += bytes
+            span.requests += requests
+            span.retries += retries
+
+    def _span(self, name: str) -> Span:
+        if name not in self.spans:
+            self.spans[name] = Span(name)
+        return self.spans[name]
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or perf_counter()) - self.started_at
+
+    def save(self, file_path: str) -> None:
+        '''Writes the trace in Chrome's trace event format, which Perfetto and chrome://tracing can open.'''
+        with self._lock:
+            contents = {
+                'traceEvents': list(self.events),
+                'displayTimeUnit': 'ms',
+                'otherData': {
+                    'elapsed_seconds': self.elapsed,
+                    'spans': [asdict(span) for span in self.spans.values()]
+                }
+            }
+        with open(file_path, 'w') as file:
+            json.dump(contents, file)
+
+# The trace of the running query, or the last one. Renders are recorded into it too.
+current = Trace()
+
+def start() -> Trace:
+    '''Starts a new trace for a query.'''
+    global current
+    current = Trace()
+    return current
+
+def record(name: str, started: float, bytes: int = 0, wire_bytes: int = 0, sent_bytes: int = 0, requests: int = 0, retries: int = 0, seconds: Optional[float] = None) -> None:
+    '''Records a call to a phase that began at started, a perf_counter() time, and ended now unless seconds is given.'''
+    current.record(name, started, bytes=bytes, wire_bytes=wire_bytes, sent_bytes=sent_bytes, requests=requests, retries=retries, seconds=seconds)
+
+def add(name: str, bytes: int = 0, requests: int = 0, retries: int = 0) -> None:
+    '''Adds to a phase's counters without timing anything.'''
+    current.add(name, bytes=bytes, requests=requests, retries=retries)
+
+def show_stats() -> None:
+    '''Logs timings, bytes, request counts and retries for each phase of the last query.'''
+    trace = current
+    info(f'Last query took {trace.elapsed:.3f}s. Network and decode are summed over concurrent requests.')
+    info(f'{"phase":<16}{"calls":>8}{"seconds":>10}{"avg ms":>10}{"bytes":>14}{"wire bytes":>14}{"sent bytes":>12}{"requests":>10}{"retries":>9}')
+    spans = list(trace.spans.values())
+    for span in spans:
+        average = span.seconds / span.calls * 1000 if span.calls else 0
+        info(f'{span.name:<16}{span.calls:>8}{span.seconds:>10.3f}{average:>10.2f}{span.bytes:>14,}{span.wire_bytes:>14,}{span.sent_bytes:>12,}{span.requests:>10}{span.retries:>9}')
+    decoded = sum(span.bytes for span in spans if span.wire_bytes)
+    wire = sum(span.wire_bytes for span in spans)
+    if wire:
+        info(f'Responses took {wire:,} bytes on the wire for {decoded:,} bytes of JSON, {decoded / wire:.1f}x compression.')
+register_command(show_stats, ['stats'])
@@ -0,0 +1,46 @@
+from picli.commands import register_command
+from picli.errors import PICLICommandError
+
+# The results table only formats the rows on screen, starting at offset. page_rows is set by the
+# renderer to however many rows fit in the terminal.
+offset: int = 0
+page_rows: int = 10
+total_rows: int = 0
+
+def clamp(rows: int) -> int:
+    '''Keeps the offset inside a result of the given size and returns it.'''
+    global offset, total_rows
+    total_rows = rows
+    offset = max(0, min(offset, rows - page_rows))
+    return offset
+
+def next_page() -> None:
+    '''Scrolls the results table forward a page.'''
+    global offset
+    offset += page_rows
+    clamp(total_rows)
+register_command(next_page, ['next'])
+
+def previous_page() -> None:
+    '''Scrolls the results table back a page.'''
+    global offset
+    offset -= page_rows
+    clamp(total_rows)
+register_command(previous_page, ['prev'])
+
+def goto_row(row: str) -> None:
+    '''Scrolls the results table to a row number. "end" goes to the last page.'''
+    global offset
+    if row.lower() == 'end':
+        offset = total_rows
+    elif row.isdigit() and int(row) > 0:
+        offset = int(row) - 1
+    else:
+        raise PICLICommandError(f'Invalid row {row}. Must be a row number or "end".')
+    clamp(total_rows)
+register_command(goto_row, ['goto'])
+
+def reset() -> None:
+    '''Scrolls back to the top, for when new results replace the old ones.'''
+    global offset
+    offset = 0
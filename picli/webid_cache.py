@@ -0,0 +1,183 @@
+from threading import Lock
+from time import time
+from os import path
+from typing import Optional
+import os
+import json
+import tempfile
+
+from picli import config
+from picli.commands import register_command
+from picli.errors import PICLIShutdownError
+from picli.log import info, debug
+
+# {api_base_url: {pi_server: {
+#     'web_id': str, 'cached_at': float,
+#     'tags': {tag: {'web_id': str, 'cached_at': float}},
+#     'patterns': {pattern: {'tags': [tag], 'cached_at': float}}
+# }}}
+# The tags of a server double as a local index of its points, filled by every lookup, so most
+# tags in a long list can be resolved without asking the PI Web API.
+_entries: Optional[dict] = None
+_dirty: bool = False
+# Queries update the cache from the background while commands on the main thread read it, every use goes through _lock.
+_lock = Lock()
+
+def _cache_path() -> str:
+    return config.get_data_path('webid_cache.json')
+
+def _load() -> dict:
+    global _entries
+    if _entries is None:
+        _entries = {}
+        cache_path = _cache_path()
+        if path.isfile(cache_path):
+            try:
+                with open(cache_path, 'r') as file:
+                    _entries = json.loads(file.read())
+            except (OSError, ValueError):
+                debug(f'Could not read Web ID cache at {cache_path}, starting with an empty cache.')
+    return _entries
+
+def _is_fresh(entry: Optional[dict]) -> bool:
+    return entry is not None and entry.get('web_id') is not None and time() - entry['cached_at'] < config.webid_cache_ttl
+
+def _server_entry(api_base_url: str, pi_server: str) -> dict:
+    entry = _load().setdefault(api_base_url, {}).setdefault(pi_server, {'web_id': None, 'cached_at': 0, 'tags': {}})
+    entry.setdefault('patterns', {})
+    return entry
+
+def get_server(api_base_url: str, pi_server: str) -> Optional[str]:
+    with _lock:
+        entry = _load().get(api_base_url, {}).get(pi_server)
+        if _is_fresh(entry):
+            return entry['web_id']
+        return None
+
+def put_server(api_base_url: str, pi_server: str, web_id: str) -> None:
+    global _dirty
+    with _lock:
+        if config.webid_cache_ttl <= 0:
+            return
+        entry = _server_entry(api_base_url, pi_server)
+        if entry['web_id'] != web_id:
+            # A different server Web ID means the tag Web IDs under it can't be trusted either.
+            entry['tags'] = {}
+            entry['patterns'] = {}
+        entry['web_id'] = web_id
+        entry['cached_at'] = time()
+        _dirty = True
+
+def evict_server(api_base_url: str, pi_server: str) -> None:
+    global _dirty
+    with _lock:
+        if _load().get(api_base_url, {}).pop(pi_server, None) is not None:
+            debug(f'Evicted cached Web ID for server {pi_server}')
+            _dirty = True
+
+def find_tags(api_base_url: str, pi_server: str, tags: list[str]) -> dict[str, str]:
+    '''Looks tags up in the index, ignoring case like the PI Web API does. Returns the Web IDs of the ones found.'''
+    with _lock:
+        entries = _load().get(api_base_url, {}).get(pi_server, {}).get('tags', {})
+        web_ids = {}
+        by_upper_name = None
+        for tag in tags:
+            entry = entries.get(tag)
+            if entry is None:
+                if by_upper_name is None:
+                    by_upper_name = {name.upper(): name_entry for name, name_entry in entries.items()}
+                entry = by_upper_name.get(tag.upper())
+            if _is_fresh(entry):
+                web_ids[tag] = entry['web_id']
+        return web_ids
+
+def put_tags(api_base_url: str, pi_server: str, web_ids: dict[str, str]) -> None:
+    global _dirty
+    with _lock:
+        if config.webid_cache_ttl <= 0 or not web_ids:
+            return
+        tags = _server_entry(api_base_url, pi_server)['tags']
+        cached_at = time()
+        for tag, web_id in web_ids.items():
+            tags[tag] = {'web_id': web_id, 'cached_at': cached_at}
+        _dirty = True
+
+def get_pattern(api_base_url: str, pi_server: str, pattern: str) -> Optional[list[str]]:
+    '''Returns the tags a pattern matched when it was last looked up, if that was within the TTL.'''
+    with _lock:
+        entry = _load().get(api_base_url, {}).get(pi_server, {}).get('patterns', {}).get(pattern.upper())
+        if entry is not None and time() - entry['cached_at'] < config.webid_cache_ttl:
+            return entry['tags']
+        return None
+
+def put_pattern(api_base_url: str, pi_server: str, pattern: str, tags: list[str]) -> None:
+    global _dirty
+    with _lock:
+        if config.webid_cache_ttl <= 0:
+            return
+        _server_entry(api_base_url, pi_server)['patterns'][pattern.upper()] = {'tags': tags, 'cached_at': time()}
+        _dirty = True
+
+def evict_tag(api_base_url: str, pi_server: str, tag: str) -> None:
+    global _dirty
+    with _lock:
+        tags = _load().get(api_base_url, {}).get(pi_server, {}).get('tags', {})
+        # The index keeps the server's spelling of each name, which may differ in case from the query's.
+        names = [name for name in tags if name.upper() == tag.upper()]
+        for name in names:
+            del tags[name]
+        if names:
+            debug(f'Evicted cached Web ID for tag {tag}')
+            _dirty = True
+
+def save() -> None:
+    '''Writes the cache to disk if it has changed since it was loaded.'''
+    with _lock:
+        _save()
+
+def _save() -> None:
+    global _dirty
+    if not _dirty:
+        return
+    # Each write has its own temporary file, so processes sharing the cache don't replace each other's half written one.
+    cache_path = _cache_path()
+    try:
+        os.makedirs(path.dirname(cache_path), exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(prefix='webid_cache.', suffix='.tmp', dir=path.dirname(cache_path))
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                file.write(json.dumps(_entries, indent=4))
+            os.replace(temporary_path, cache_path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+    except OSError:
+        raise PICLIShutdownError(f'Could not write Web ID cache at {cache_path}.')
+    _dirty = False
+
+def clear_cache() -> None:
+    '''Clears all cached server and tag Web IDs.'''
+    global _entries, _dirty
+    info('Clearing Web ID cache.')
+    with _lock:
+        _entries = {}
+        _dirty = True
+        _save()
+register_command(clear_cache, ['cache', 'clear'])
+
+def show_cache() -> None:
+    '''Logs the cached server and tag Web IDs.'''
+    lines = []
+    with _lock:
+        for api_base_url, servers in _load().items():
+            for pi_server, server_entry in servers.items():
+                lines.append(f'{api_base_url} {pi_server}: {server_entry["web_id"]}{"" if _is_fresh(server_entry) else " (expired)"}')
+                for tag, tag_entry in server_entry['tags'].items():
+                    lines.append(f'    {tag}: {tag_entry["web_id"]}{"" if _is_fresh(tag_entry) else " (expired)"}')
+                for pattern, pattern_entry in server_entry.get('patterns', {}).items():
+                    lines.append(f'    {pattern}: {len(pattern_entry["tags"])} tags')
+    if not lines:
+        info('Web ID cache is empty.')
+    for line in lines:
+        info(line)
+register_command(show_cache, ['cache', 'show'])
@@ -5,9 +5,15 @@ setup(
     version='0.1',
     packages=find_packages(),
     install_requires=[
-        'requests==2.31.0',
-        'keyring==25.2.1'
+        'requests==2.32.3',
+        'keyring==25.2.1',
+        'python-dateutil'
     ],
+    extras_require={
+        'numpy': ['numpy'],
+        'pandas': ['numpy', 'pandas'],
+        'parquet': ['pyarrow']
+    },
     entry_points={
         'console_scripts': [
             'picli=picli.__main__:main',